@@ -4,38 +4,50 @@ import asyncio
 import json
 import os
 import time
-from typing import Any
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, Literal
 
-from dotenv import load_dotenv
+from checkpoint import checkpointed, stage_key
+from clients import get_shared_client, sdk_missing
+from config import env_flag, env_float, env_int, load_environment
+from deadlines import DeadlineExceeded, deadline_scope, gather_within_deadline, time_remaining
+from guardrails import GuardrailViolation, load_guardrail
+from metrics import record_usage
+from resilience import CircuitOpenError, RetryPolicy, count_hedge, get_breaker, get_latency_tracker, is_outage
+from scheduler import PRIORITY_RANK, estimate_tokens, get_scheduler
+from tracing import span
+from tracing import record as _record
 
-# --- Timeline collector ---
-_TIMELINE: list[dict] = []
-_START_TIME: float = 0.0
 
+# Placeholder for an agent client that has not been resolved yet
+_UNRESOLVED = object()
 
-def reset_timeline() -> None:
-    global _START_TIME
-    _TIMELINE.clear()
-    _START_TIME = time.time()
 
+# --- Optional response cache ---
+_RESPONSE_CACHE: Any | None = None
 
-def get_timeline() -> list[dict]:
-    return list(_TIMELINE)
 
+def set_response_cache(cache: Any | None) -> None:
+    global _RESPONSE_CACHE
+    _RESPONSE_CACHE = cache
 
-def _record(agent: str, event: str, detail: str = "") -> None:
-    elapsed = round(time.time() - _START_TIME, 2) if _START_TIME else 0.0
-    _TIMELINE.append({"t": elapsed, "agent": agent, "event": event, "detail": detail})
 
-try:
-    import httpx
-    from anthropic import AsyncAnthropic, APIConnectionError, APITimeoutError, InternalServerError
-except ImportError:  # pragma: no cover
-    AsyncAnthropic = None
-    httpx = None
-    APIConnectionError = APITimeoutError = InternalServerError = Exception
+def get_response_cache() -> Any | None:
+    return _RESPONSE_CACHE
+
+
+# --- Optional adaptive output budgets (budgets.UsageHistory) ---
+_USAGE_HISTORY: Any | None = None
+
+
+def set_usage_history(history: Any | None) -> None:
+    global _USAGE_HISTORY
+    _USAGE_HISTORY = history
+
+
+def get_usage_history() -> Any | None:
+    return _USAGE_HISTORY
 
-_RETRY_DELAYS = [5, 20]  # seconds between attempts 1→2 and 2→3
 
 SHARED_BASE_PROMPT = """
 You are one member of a multi-agent Hive Mind team.
@@ -43,43 +55,175 @@ Work with high autonomy, stay inside your role boundaries, and keep outputs conc
 When context is uncertain, make the safest useful assumption and state it.
 """.strip()
 
+CONTINUE_PROMPT = (
+    "Your previous reply was cut off by the output length limit. Continue exactly where it stopped, "
+    "without repeating any text and without adding commentary."
+)
+
+# Timeline event closing a 调用 LLM / 流式调用 LLM that raised instead of completing
+LLM_FAILED_EVENT = "LLM 调用失败"
+
+
+def min_cacheable_tokens(model: str) -> int:
+    """Shortest prefix the API will cache for ``model``; a breakpoint on a shorter prefix is silently ignored."""
+    if any(family in model for family in ("haiku-4-5", "opus-4-5", "opus-4-6")):
+        return 4096
+    if "haiku" in model:
+        return 2048
+    return 1024
+
+
+class IncrementalJSONParser:
+    """Emits each top-level member of a streamed JSON object as soon as its value is complete."""
+
+    def __init__(self) -> None:
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = -1
+        self._last_string: str | None = None
+        self._key: str | None = None
+        self._value_start = -1
+
+    def feed(self, chunk: str) -> list[tuple[str, Any]]:
+        self._text += chunk
+        completed: list[tuple[str, Any]] = []
+        text = self._text
+        while self._pos < len(text):
+            index = self._pos
+            char = text[index]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._value_start == self._string_start:
+                        self._complete(index, completed)
+                    elif self._depth == 1 and self._key is None:
+                        self._last_string = self._decode(self._string_start, index)
+                continue
+
+            if self._depth == 0:
+                # Ignore anything (e.g. a ```json fence) before the top-level object opens
+                if char == "{":
+                    self._depth = 1
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = index
+                if self._depth == 1 and self._key is not None and self._value_start == -1:
+                    self._value_start = index
+            elif char in "{[":
+                if self._depth == 1 and self._key is not None and self._value_start == -1:
+                    self._value_start = index
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 1:
+                    # Closing the top-level object ends any pending scalar value
+                    if self._value_start != -1:
+                        self._complete(index - 1, completed)
+                    self._depth = 0
+                    continue
+                self._depth -= 1
+                if self._depth == 1 and self._value_start != -1:
+                    self._complete(index, completed)
+            elif self._depth == 1:
+                if char == ":" and self._key is None:
+                    self._key = self._last_string
+                elif char == "," and self._value_start != -1:
+                    self._complete(index - 1, completed)
+                elif not char.isspace() and self._key is not None and self._value_start == -1:
+                    self._value_start = index
+        return completed
+
+    def _decode(self, start: int, end: int) -> Any:
+        try:
+            return json.loads(self._text[start : end + 1])
+        except json.JSONDecodeError:
+            return None
+
+    def _complete(self, end: int, completed: list[tuple[str, Any]]) -> None:
+        key = self._key
+        value = self._decode(self._value_start, end)
+        self._key = None
+        self._last_string = None
+        self._value_start = -1
+        if isinstance(key, str):
+            completed.append((key, value))
+
 
 class BaseAgent:
-    def __init__(self, name: str, role_prompt: str, model: str, tools: list | None = None) -> None:
-        load_dotenv()
+    # None means RetryPolicy.from_env(), read at call time so .env overrides apply
+    retry_policy: RetryPolicy | None = None
+    # Seconds of the run deadline kept back for this agent's own synthesis after its sub-agents
+    synthesis_reserve: float = 15.0
+    # Check generated text against the guardrail term list; streamed replies are cut off at the first hit.
+    # "flag" only records the hit, for final reports where one bad line shouldn't fail the whole run.
+    screen_output: bool | Literal["flag"] = False
+
+    def __init__(
+        self,
+        name: str,
+        role_prompt: str,
+        model: str,
+        tools: list | None = None,
+        client: Any | None = None,
+        shared_prompt: str = "",
+    ) -> None:
+        load_environment()
         self.name = name
         self.role_prompt = role_prompt.strip()
+        # Instructions repeated verbatim across sibling agents; placed before role_prompt so the prefix is shared.
+        self.shared_prompt = shared_prompt.strip()
         self.model = model
         self.tools = tools or []
+        self.usage: dict[str, int] = {
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+        }
+        self._cache_skip_logged = False
 
-        api_key = os.getenv("ANTHROPIC_API_KEY", "").strip()
-        base_url = os.getenv("ANTHROPIC_BASE_URL", "").strip()
-
-        if AsyncAnthropic and api_key:
-            client_kwargs: dict[str, Any] = {"api_key": api_key}
-            if base_url:
-                client_kwargs["base_url"] = base_url
-            # Bypass system proxy (Clash/VPN) to connect directly to the API endpoint
-            if httpx:
-                client_kwargs["http_client"] = httpx.AsyncClient(
-                    transport=httpx.AsyncHTTPTransport(proxy=None),
-                    timeout=120,
-                )
-            self.client = AsyncAnthropic(**client_kwargs)
-        else:
-            self.client = None
+        # Resolved on first use, so constructing agents never imports the SDK or opens a pool
+        self._client: Any = client if client is not None else _UNRESOLVED
+
+    @property
+    def client(self) -> Any | None:
+        if self._client is _UNRESOLVED:
+            api_key = os.getenv("ANTHROPIC_API_KEY", "").strip()
+            base_url = os.getenv("ANTHROPIC_BASE_URL", "").strip()
+            # Without a key the agent runs offline and the SDK is never imported
+            self._client = get_shared_client(api_key, base_url) if api_key else None
+        return self._client
+
+    @client.setter
+    def client(self, value: Any | None) -> None:
+        self._client = value
+
+    def agent_tree(self) -> list[BaseAgent]:
+        """This agent and every sub-agent below it, building any that were not created yet."""
+        return [self]
 
     def _log(self, message: str) -> None:
         print(f"[{self.name}] {message}")
         _record(self.name, message)
 
     @staticmethod
-    def _extract_text(content: Any) -> str:
+    def _extract_text(content: Any, strip: bool = True) -> str:
         chunks: list[str] = []
         for item in content:
             if getattr(item, "type", "") == "text":
                 chunks.append(getattr(item, "text", ""))
-        return "\n".join(chunk for chunk in chunks if chunk).strip()
+        text = "\n".join(chunk for chunk in chunks if chunk)
+        return text.strip() if strip else text
 
     @staticmethod
     def _extract_json(text: str) -> dict[str, Any] | None:
@@ -108,7 +252,135 @@ class BaseAgent:
             return None
         return None
 
-    async def _query_llm(
+    def _offline_response(self, user_prompt: str) -> str:
+        if sdk_missing():
+            self._log("anthropic SDK missing; using offline fallback response.")
+        else:
+            self._log("ANTHROPIC_API_KEY missing; using offline fallback response.")
+        return f"[offline:{self.name}] {user_prompt[:600]}"
+
+    def _screen_output(self, text: str, screen: bool | Literal["flag"] | None = None) -> None:
+        mode = self.screen_output if screen is None else screen
+        if not mode:
+            return
+        term = load_guardrail().find(text, allow_negated=True)
+        if term is None:
+            return
+        if mode == "flag":
+            _record(self.name, "护栏标记", f"输出命中: {term}，已保留输出")
+            self._log(f"Guardrail flagged term in output: {term!r}")
+            return
+        _record(self.name, "护栏拦截", f"输出命中: {term}")
+        raise GuardrailViolation(self.name, term)
+
+    def _screened(
+        self, on_text: Callable[[str], None], screen: bool | Literal["flag"] | None = None
+    ) -> Callable[[str], None]:
+        mode = self.screen_output if screen is None else screen
+        if not mode:
+            return on_text
+        scanner = load_guardrail().scanner()
+        flagged = False
+
+        def forward(chunk: str) -> None:
+            nonlocal flagged
+            if not flagged and scanner.feed(chunk) is not None:
+                if mode == "flag":
+                    flagged = True
+                    _record(self.name, "护栏标记", f"流式输出命中: {scanner.violation}，已保留输出")
+                    self._log(f"Guardrail flagged term in output: {scanner.violation!r}")
+                else:
+                    # Raising here leaves the stream context, which closes the response and stops paying for tokens
+                    _record(self.name, "护栏拦截", f"流式输出命中: {scanner.violation}，已中止生成")
+                    raise GuardrailViolation(self.name, scanner.violation)
+            on_text(chunk)
+
+        return forward
+
+    def _build_system(self, extra_system_prompt: str) -> str | list[dict[str, Any]]:
+        shared_prefix = "\n\n".join(part for part in (SHARED_BASE_PROMPT, self.shared_prompt) if part)
+        if not env_flag("HIVEMIND_PROMPT_CACHE"):
+            return "\n\n".join(part for part in (shared_prefix, self.role_prompt, extra_system_prompt) if part)
+
+        # Breakpoints after the team-wide prefix and after the role prompt, each only once the prefix it
+        # closes reaches the model's cacheable minimum; the per-call extra stays uncached.
+        minimum = min_cacheable_tokens(self.model)
+        prefix_tokens = estimate_tokens(shared_prefix)
+        blocks: list[dict[str, Any]] = [{"type": "text", "text": shared_prefix}]
+        if prefix_tokens >= minimum:
+            blocks[0]["cache_control"] = {"type": "ephemeral"}
+        if self.role_prompt:
+            prefix_tokens += estimate_tokens(self.role_prompt)
+            blocks.append({"type": "text", "text": self.role_prompt})
+            if prefix_tokens >= minimum:
+                blocks[-1]["cache_control"] = {"type": "ephemeral"}
+        if not any("cache_control" in block for block in blocks) and not self._cache_skip_logged:
+            self._cache_skip_logged = True
+            self._log(
+                f"Prompt cache skipped: stable prefix ≈{prefix_tokens} tokens is below the "
+                f"{minimum}-token minimum for {self.model}."
+            )
+        if extra_system_prompt:
+            blocks.append({"type": "text", "text": extra_system_prompt})
+        return blocks
+
+    @staticmethod
+    def _thinking_tokens(response: Any) -> int:
+        # The API folds thinking into output_tokens; estimate its share from the returned thinking blocks
+        return sum(
+            estimate_tokens(getattr(block, "thinking", "") or "")
+            for block in getattr(response, "content", None) or []
+            if getattr(block, "type", "") == "thinking"
+        )
+
+    def _track_usage(self, response: Any, seconds: float) -> str:
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return ""
+        tokens = {field: getattr(usage, field, None) or 0 for field in self.usage}
+        for field, value in tokens.items():
+            self.usage[field] += value
+        tokens["thinking_tokens"] = self._thinking_tokens(response)
+        # A rerouted call is billed at the fallback model's price
+        model = getattr(response, "model", None)
+        cost = record_usage(self.name, model if isinstance(model, str) and model else self.model, tokens, seconds)
+        return (
+            f" in={tokens['input_tokens']} out={tokens['output_tokens']}"
+            f" cache_read={tokens['cache_read_input_tokens']} cache_write={tokens['cache_creation_input_tokens']}"
+            f" ≈${cost:.4f}"
+        )
+
+    def _budget_site(self, site: str) -> str:
+        return f"{self.name}:{site}" if site else self.name
+
+    def _observe_budget(self, site: str, response: Any, seconds: float, max_tokens: int) -> None:
+        history = _USAGE_HISTORY
+        usage = getattr(response, "usage", None)
+        if history is None or usage is None:
+            return
+        key = self._budget_site(site)
+        truncated = getattr(response, "stop_reason", None) == "max_tokens"
+        history.observe(
+            key,
+            getattr(usage, "output_tokens", None) or 0,
+            max_tokens=max_tokens,
+            truncated=truncated,
+            seconds=seconds,
+            thinking_tokens=self._thinking_tokens(response),
+        )
+        if truncated:
+            _record(self.name, "输出预算上调", f"{key} max_tokens {max_tokens} -> {history.budget(key, max_tokens)}")
+
+    def _default_max_tokens(self, max_tokens: int | None) -> int:
+        return max_tokens if max_tokens is not None else (4096 if "opus" in self.model else 2048)
+
+    def _raised_budget(self, site: str, default: int) -> int:
+        """Budget for finishing a reply the learned budget cut short; never below the caller's own."""
+        if _USAGE_HISTORY is None:
+            return default
+        return max(default, _USAGE_HISTORY.budget(self._budget_site(site), default))
+
+    def _build_request(
         self,
         user_prompt: str,
         *,
@@ -116,56 +388,496 @@ class BaseAgent:
         temperature: float = 0.2,
         max_tokens: int | None = None,
         output_config: dict[str, Any] | None = None,
-    ) -> str:
-        if not self.client:
-            if not AsyncAnthropic:
-                self._log("anthropic SDK missing; using offline fallback response.")
-            else:
-                self._log("ANTHROPIC_API_KEY missing; using offline fallback response.")
-            return f"[offline:{self.name}] {user_prompt[:600]}"
-
-        system_prompt = "\n\n".join(
-            part
-            for part in (SHARED_BASE_PROMPT, self.role_prompt, extra_system_prompt.strip())
-            if part
-        )
-        token_limit = max_tokens if max_tokens is not None else (4096 if "opus" in self.model else 2048)
+        site: str = "",
+    ) -> dict[str, Any]:
+        system_prompt = self._build_system(extra_system_prompt.strip())
+        token_limit = self._default_max_tokens(max_tokens)
+        if _USAGE_HISTORY is not None:
+            # Opus thinking shares max_tokens with the reply, so this one budget bounds both
+            learned = _USAGE_HISTORY.budget(self._budget_site(site), token_limit)
+            # Truncated JSON can't be continued, so structured output only ever gets more room
+            token_limit = max(token_limit, learned) if output_config else learned
 
         request_payload: dict[str, Any] = {
-            "model": self.model,
             "max_tokens": token_limit,
             "system": system_prompt,
             "messages": [{"role": "user", "content": user_prompt}],
         }
+        if output_config:
+            request_payload["output_config"] = output_config
+        return self._with_model(request_payload, self.model, temperature)
 
+    @staticmethod
+    def _with_model(request_payload: dict[str, Any], model: str, temperature: float = 0.2) -> dict[str, Any]:
+        payload = {**request_payload, "model": model}
         # Opus main agents use adaptive thinking; Haiku sub-agents must not send thinking.
-        if "opus" in self.model:
-            request_payload["thinking"] = {"type": "adaptive"}
+        if "opus" in model:
+            payload.pop("temperature", None)
+            payload["thinking"] = {"type": "adaptive"}
+        else:
+            payload.pop("thinking", None)
+            payload["temperature"] = temperature
+        return payload
+
+    def _route(self, request_payload: dict[str, Any], temperature: float) -> tuple[dict[str, Any], object | None]:
+        """Payload for the next attempt and the breaker token it goes out under.
+
+        The payload is unchanged or moved to HIVEMIND_FALLBACK_MODEL; CircuitOpenError when neither may be called.
+        """
+        model = request_payload["model"]
+        breaker = get_breaker(model)
+        if breaker is None:
+            return request_payload, None
+        token = breaker.allow()
+        if token is not None:
+            return request_payload, token
+
+        fallback = os.getenv("HIVEMIND_FALLBACK_MODEL", "").strip()
+        fallback_breaker = get_breaker(fallback) if fallback and fallback != model else None
+        token = fallback_breaker.allow() if fallback_breaker is not None else None
+        if token is None:
+            _record(self.name, "熔断快速失败", f"model={model} {breaker.reason}，约 {breaker.retry_in():.0f}s 后探测")
+            raise CircuitOpenError(model, breaker.retry_in())
+        _record(self.name, "模型降级", f"{model} -> {fallback}（{breaker.reason}）")
+        return self._with_model(request_payload, fallback, temperature), token
+
+    async def _guarded(
+        self, send: Callable[[dict[str, Any]], Awaitable[Any]], payload: dict[str, Any], token: object | None
+    ) -> Any:
+        breaker = get_breaker(payload["model"])
+        if breaker is None:
+            return await send(payload)
+        started = time.monotonic()
+        try:
+            response = await send(payload)
+        except Exception as exc:
+            if is_outage(exc) and breaker.record(False, time.monotonic() - started, token):
+                _record(self.name, "熔断器打开", f"model={payload['model']} {breaker.reason}")
+            raise
+        if breaker.record(True, time.monotonic() - started, token):
+            _record(self.name, "熔断器打开", f"model={payload['model']} {breaker.reason}")
+        return response
+
+    @contextmanager
+    def _closing_call_event(self) -> Iterator[None]:
+        # Every 调用 LLM gets a closing event, so --tail can tell a failed call from one still in flight
+        try:
+            yield
+        except BaseException as exc:
+            _record(self.name, LLM_FAILED_EVENT, exc.__class__.__name__)
+            raise
+
+    async def _cache_lookup(self, request_payload: dict[str, Any]) -> tuple[str, str | None]:
+        cache = _RESPONSE_CACHE
+        if cache is None:
+            return "", None
+        cache_key = cache.key(request_payload)
+        cached = await cache.aget(cache_key)
+        if cached is not None:
+            record_usage(self.name, self.model, {}, 0.0, response_cache_hit=True)
+            _record(self.name, "缓存命中", f"hits={cache.hits} misses={cache.misses}")
         else:
-            request_payload["temperature"] = temperature
+            _record(self.name, "缓存未命中", f"hits={cache.hits} misses={cache.misses}")
+        return cache_key, cached
 
-        if output_config:
-            request_payload["output_config"] = output_config
+    @staticmethod
+    async def _cache_store(cache_key: str, text: str, stop_reason: str | None = None) -> None:
+        # A reply still cut off at max_tokens isn't stored: the key ignores max_tokens, so a later
+        # call with a bigger budget would be served the truncated text
+        if _RESPONSE_CACHE is not None and cache_key and text and stop_reason != "max_tokens":
+            await _RESPONSE_CACHE.aput(cache_key, text)
 
-        t0 = time.time()
-        _record(self.name, "调用 LLM", f"model={self.model} max_tokens={token_limit}")
+    async def _scheduled(
+        self,
+        send: Callable[[dict[str, Any]], Awaitable[Any]],
+        request_payload: dict[str, Any],
+        priority: str,
+        temperature: float = 0.2,
+    ) -> Any:
+        """One attempt: route around open breakers, wait for a scheduler slot, then send(payload)."""
+        prompt_tokens = estimate_tokens(
+            json.dumps([request_payload["system"], request_payload["messages"]], ensure_ascii=False)
+        )
+        remaining = time_remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"{self.name}: run deadline reached before the request was sent")
 
-        last_exc: Exception | None = None
-        for attempt in range(3):
-            try:
-                response = await self.client.messages.create(**request_payload)
-                break
-            except (APITimeoutError, APIConnectionError, InternalServerError) as exc:
-                last_exc = exc
-                if attempt < 2:
-                    delay = _RETRY_DELAYS[attempt]
-                    self._log(f"请求失败，{delay}s 后重试 ({attempt+1}/2)... [{exc.__class__.__name__}]")
-                    await asyncio.sleep(delay)
-        else:
+        payload, token = self._route(request_payload, temperature)
+        model = payload["model"]
+        queued_at = time.time()
+        try:
+            async with asyncio.timeout(remaining):
+                async with get_scheduler().slot(model, priority, tokens=prompt_tokens):
+                    waited = time.time() - queued_at
+                    if waited >= 0.05:
+                        _record(self.name, "排队等待", f"{round(waited, 2)}s priority={priority}")
+                    with span(self.name, "http_attempt", model=model, priority=priority):
+                        return await self._guarded(send, payload, token)
+        except TimeoutError as exc:
+            if remaining is not None and not isinstance(exc, DeadlineExceeded) and (time_remaining() or 0) <= 0:
+                _record(self.name, "截止时间已到", "请求已取消")
+                raise DeadlineExceeded(f"{self.name}: run deadline reached") from exc
+            raise
+        finally:
+            # A probe that got a 429, was cancelled or timed out in the queue decided nothing
+            breaker = get_breaker(model)
+            if breaker is not None:
+                breaker.release(token)
+
+    @staticmethod
+    def _hedge_delay(model: str) -> float | None:
+        # Only cheap-model calls are hedged; duplicating an Opus request costs more than its tail saves
+        if "opus" in model or not env_flag("HIVEMIND_HEDGE"):
+            return None
+        return get_latency_tracker().percentile(
+            model,
+            env_float("HIVEMIND_HEDGE_PERCENTILE", 95.0),
+            min_samples=env_int("HIVEMIND_HEDGE_MIN_SAMPLES", 20),
+        )
+
+    async def _create_message(self, request_payload: dict[str, Any]) -> Any:
+        hedge_after = self._hedge_delay(request_payload["model"])
+        if hedge_after is not None:
+            return await self._hedged_create(request_payload, hedge_after)
+        started = time.monotonic()
+        response = await self.client.messages.create(**request_payload)
+        get_latency_tracker().observe(request_payload["model"], time.monotonic() - started)
+        return response
+
+    async def _hedged_create(self, request_payload: dict[str, Any], hedge_after: float) -> Any:
+        model = request_payload["model"]
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self.client.messages.create(**request_payload))
+
+        def observe_primary(task: asyncio.Future) -> None:
+            # Only the primary feeds the hedge threshold; a winning duplicate would drag it down.
+            # When the duplicate wins, the primary's elapsed time is kept as a lower bound.
+            if task.cancelled() or task.exception() is None:
+                get_latency_tracker().observe(model, time.monotonic() - started)
+
+        primary.add_done_callback(observe_primary)
+        attempts = [primary]
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=hedge_after)
+            if done:
+                return primary.result()
+
+            # The duplicate needs its own scheduler slot; if none is free right now, don't hedge
+            prompt_tokens = estimate_tokens(
+                json.dumps([request_payload["system"], request_payload["messages"]], ensure_ascii=False)
+            )
+            release = get_scheduler().try_slot(model, tokens=prompt_tokens)
+            if release is None:
+                _record(self.name, "跳过对冲请求", "调度器没有空闲槽位")
+                return await primary
+
+            stats = count_hedge()
+            _record(self.name, "发送对冲请求", f"{round(hedge_after, 2)}s 未响应 fired={stats['fired']}")
+            duplicate = self._in_slot(self.client.messages.create(**request_payload), release)
+            attempts.append(asyncio.ensure_future(duplicate))
+
+            pending = set(attempts)
+            last_exc: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    last_exc = finished.exception()
+                    if last_exc is not None:
+                        continue
+                    if finished is not primary:
+                        stats = count_hedge(won=True)
+                        _record(self.name, "对冲请求胜出", f"won={stats['won']}/{stats['fired']}")
+                    return finished.result()
             raise last_exc  # type: ignore[misc]
+        finally:
+            for attempt in attempts:
+                if not attempt.done():
+                    attempt.cancel()
+
+    @staticmethod
+    async def _in_slot(call: Awaitable[Any], release: Callable[[], None]) -> Any:
+        try:
+            return await call
+        finally:
+            release()
+
+    @staticmethod
+    def _task_priority(task: dict[str, Any]) -> str:
+        payload = task.get("payload") if isinstance(task.get("payload"), dict) else {}
+        priority = str(task.get("priority") or payload.get("priority") or "medium").strip().lower()
+        return priority if priority in PRIORITY_RANK else "medium"
+
+    async def _with_retries(
+        self,
+        send: Callable[[], Awaitable[Any]],
+        *,
+        can_retry: Callable[[], bool] = lambda: True,
+    ) -> Any:
+        policy = self.retry_policy or RetryPolicy.from_env()
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await send()
+            except DeadlineExceeded:
+                raise
+            except Exception as exc:
+                if attempt >= policy.max_attempts or not policy.is_retryable(exc) or not can_retry():
+                    raise
+                delay = policy.delay(attempt - 1, exc)
+                if time.monotonic() - started + delay > policy.budget:
+                    _record(self.name, "放弃重试", f"超出重试预算 {policy.budget}s [{exc.__class__.__name__}]")
+                    raise
+                remaining = time_remaining()
+                if remaining is not None and delay >= remaining:
+                    _record(self.name, "放弃重试", f"截止时间前无法完成重试 [{exc.__class__.__name__}]")
+                    raise
+                print(f"[{self.name}] 请求失败，{delay:.1f}s 后重试 ({attempt}/{policy.max_attempts - 1})... "
+                      f"[{exc.__class__.__name__}]")
+                _record(self.name, "重试等待", f"attempt={attempt} wait={delay:.2f}s [{exc.__class__.__name__}]")
+                await asyncio.sleep(delay)
+
+    def _stage_deadline(self) -> Any:
+        # Hold back time for this agent's own synthesis call, but never more than 40% of what is left
+        remaining = time_remaining()
+        if remaining is None:
+            return deadline_scope()
+        return deadline_scope(reserve=min(self.synthesis_reserve, max(0.0, remaining) * 0.4))
+
+    @staticmethod
+    async def _run_stage(agent: BaseAgent, message: dict[str, Any]) -> dict[str, str]:
+        """agent.run(message), served from the run's checkpoint if this exact stage already finished."""
+        key = stage_key(agent.name, {k: v for k, v in message.items() if k != "task_id"})
+        return await checkpointed(key, lambda: agent.run(message))
+
+    async def _gather_subagents(
+        self, subtasks: list[tuple[BaseAgent, dict[str, str]]]
+    ) -> tuple[list[dict[str, str]], list[str]]:
+        """Run sub-agents within the stage deadline; returns (finished results, names of missing tracks)."""
+        with self._stage_deadline():
+            results = await gather_within_deadline([self._run_stage(agent, subtask) for agent, subtask in subtasks])
+
+        if time_remaining() is None:
+            # No deadline: keep every result, including failures, as before
+            missing = [agent.name for (agent, _), result in zip(subtasks, results) if result.get("status") != "done"]
+            return results, missing
+
+        finished = [result for result in results if result and result.get("status") == "done"]
+        missing = [agent.name for (agent, _), result in zip(subtasks, results) if not result or result.get("status") != "done"]
+        if missing:
+            self._log(f"截止时间内完成 {len(finished)}/{len(subtasks)} 个子代理，缺失: {', '.join(missing)}")
+        quorum = env_int("HIVEMIND_QUORUM", 0) or len(subtasks) - len(subtasks) // 3
+        if len(finished) < min(quorum, len(subtasks)):
+            raise DeadlineExceeded(f"quorum not met ({len(finished)}/{quorum}); missing: {', '.join(missing)}")
+        return finished, missing
+
+    @staticmethod
+    def _fit_token_budget(text: str, budget: int) -> tuple[str, int]:
+        tokens = estimate_tokens(text)
+        if tokens <= budget:
+            return text, 0
+        # Keep the opening (usually the answer) and the closing (usually risks/next steps)
+        keep = max(1, len(text) * budget // tokens)
+        head = keep * 2 // 3
+        tail = keep - head
+        trimmed = tokens - budget
+        return f"{text[:head].rstrip()}\n…[trimmed ~{trimmed} tokens]…\n{text[len(text) - tail:].lstrip()}", trimmed
+
+    def _compact_results(self, results: list[dict[str, str]], budget: int | None = None) -> str:
+        """Render sub-agent results as plain sections, each capped at a per-source token budget."""
+        budget = budget or env_int("HIVEMIND_SUBAGENT_TOKEN_BUDGET", 1500)
+        sections: list[str] = []
+        trimmed_total = 0
+        for result in results:
+            source = result.get("from", "unknown")
+            text = str(result.get("result", "")).strip()
+            if result.get("status") != "done":
+                sections.append(f"## {source} (failed)\n{text[:200]}")
+                continue
+            text, trimmed = self._fit_token_budget(text, budget)
+            trimmed_total += trimmed
+            sections.append(f"## {source}\n{text}")
+
+        context = "\n\n".join(sections)
+        _record(self.name, "汇总上下文", f"≈{estimate_tokens(context)} tokens trimmed≈{trimmed_total}")
+        return context
+
+    async def _query_llm(
+        self,
+        user_prompt: str,
+        *,
+        extra_system_prompt: str = "",
+        temperature: float = 0.2,
+        max_tokens: int | None = None,
+        output_config: dict[str, Any] | None = None,
+        priority: str = "medium",
+        continuations: int = 0,
+        screen: bool | Literal["flag"] | None = None,
+        site: str = "",
+    ) -> str:
+        """Single completion; up to ``continuations`` follow-up calls resume a reply cut off at max_tokens.
+
+        ``screen`` overrides the agent's screen_output for this call. ``site`` names the call site
+        when one agent makes several kinds of calls, so each keeps its own adaptive output budget.
+        """
+        if not self.client:
+            return self._offline_response(user_prompt)
+
+        request_payload = self._build_request(
+            user_prompt,
+            extra_system_prompt=extra_system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            output_config=output_config,
+            site=site,
+        )
+        cache_key, cached = await self._cache_lookup(request_payload)
+        if cached is not None:
+            return cached
+
+        t0 = time.time()
+        _record(self.name, "调用 LLM", f"model={self.model} max_tokens={request_payload['max_tokens']}")
+
+        with self._closing_call_event():
+            default_limit = self._default_max_tokens(max_tokens)
+            text = ""
+            payload = request_payload
+            attempt = 0
+            while True:
+                sent_at = time.time()
+                response = await self._with_retries(
+                    lambda: self._scheduled(self._create_message, payload, priority, temperature)
+                )
+                usage_detail = self._track_usage(response, time.time() - sent_at)
+                self._observe_budget(site, response, time.time() - sent_at, payload["max_tokens"])
+                # Keep edge whitespace while stitching; a cut can land between two words
+                text += self._extract_text(response.content, strip=False)
+                if getattr(response, "stop_reason", None) != "max_tokens":
+                    break
+                if request_payload["max_tokens"] < default_limit:
+                    # The learned budget undershot the caller's own limit: finish once at the raised budget,
+                    # whatever the continuations setting, rather than return a cut-off reply
+                    raised = self._raised_budget(site, default_limit)
+                    _record(self.name, "输出预算不足，提高后续写", f"max_tokens {request_payload['max_tokens']} -> {raised}")
+                    request_payload = {**request_payload, "max_tokens": raised}
+                    if not text.strip():
+                        payload = request_payload
+                        continue
+                elif attempt == continuations:
+                    break
+                elif not text.strip():
+                    # Cut off while still thinking: there is no text to hand back, and an empty assistant turn is a 400
+                    _record(self.name, "输出截断，无文本可续写", f"max_tokens={payload['max_tokens']} 已耗尽于思考")
+                    break
+                else:
+                    attempt += 1
+                    _record(self.name, "输出截断，自动续写", f"第 {attempt}/{continuations} 次，已有 {len(text)} 字符")
+                # Hand the truncated reply back as an assistant turn and ask for the rest
+                payload = {
+                    **request_payload,
+                    "messages": [
+                        *request_payload["messages"],
+                        {"role": "assistant", "content": text.rstrip()},
+                        {"role": "user", "content": CONTINUE_PROMPT},
+                    ],
+                }
+
+            _record(self.name, "LLM 响应完成", f"用时约 {round(time.time() - t0, 1)}s{usage_detail}")
+        text = text.strip()
+        self._screen_output(text, screen)
+        await self._cache_store(cache_key, text, getattr(response, "stop_reason", None))
+        return text
+
+    async def _generate(self, user_prompt: str, **kwargs: Any) -> str:
+        """_query_llm, streamed instead when output is screened strictly, so a guardrail hit stops generation."""
+        if self.screen_output is True:
+            return await self._stream_llm(user_prompt, on_text=lambda _chunk: None, **kwargs)
+        return await self._query_llm(user_prompt, **kwargs)
+
+    async def _stream_llm(
+        self,
+        user_prompt: str,
+        *,
+        on_text: Callable[[str], None],
+        extra_system_prompt: str = "",
+        temperature: float = 0.2,
+        max_tokens: int | None = None,
+        output_config: dict[str, Any] | None = None,
+        priority: str = "medium",
+        screen: bool | Literal["flag"] | None = None,
+        site: str = "",
+    ) -> str:
+        """Like _query_llm, but hands each text delta to on_text as it arrives."""
+        if not self.client:
+            text = self._offline_response(user_prompt)
+            on_text(text)
+            return text
+
+        on_text = self._screened(on_text, screen)
+
+        request_payload = self._build_request(
+            user_prompt,
+            extra_system_prompt=extra_system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            output_config=output_config,
+            site=site,
+        )
+        cache_key, cached = await self._cache_lookup(request_payload)
+        if cached is not None:
+            on_text(cached)
+            return cached
+
+        t0 = time.time()
+        _record(self.name, "流式调用 LLM", f"model={self.model} max_tokens={request_payload['max_tokens']}")
+        emitted = False
+        stop_reason = None
+
+        async def send(payload: dict[str, Any]) -> str:
+            nonlocal emitted, usage_detail, stop_reason
+            chunks: list[str] = []
+            async with self.client.messages.stream(**payload) as stream:
+                async for delta in stream.text_stream:
+                    if not emitted:
+                        emitted = True
+                        _record(self.name, "首个 token", f"用时约 {round(time.time() - t0, 1)}s")
+                    chunks.append(delta)
+                    on_text(delta)
+                final_message = await stream.get_final_message()
+            usage_detail = self._track_usage(final_message, time.time() - t0)
+            self._observe_budget(site, final_message, time.time() - t0, payload["max_tokens"])
+            stop_reason = getattr(final_message, "stop_reason", None)
+            return "".join(chunks)
+
+        with self._closing_call_event():
+            # Once text has reached on_text a retry would duplicate it, so only retry before the first delta.
+            usage_detail = ""
+            text = await self._with_retries(
+                lambda: self._scheduled(send, request_payload, priority, temperature),
+                can_retry=lambda: not emitted,
+            )
+            default_limit = self._default_max_tokens(max_tokens)
+            if stop_reason == "max_tokens" and request_payload["max_tokens"] < default_limit:
+                # The learned budget undershot the caller's own limit; stream the rest at the raised budget
+                raised = self._raised_budget(site, default_limit)
+                _record(self.name, "输出预算不足，提高后续写", f"max_tokens {request_payload['max_tokens']} -> {raised}")
+                follow_up = {**request_payload, "max_tokens": raised}
+                if text.strip():
+                    follow_up["messages"] = [
+                        *request_payload["messages"],
+                        {"role": "assistant", "content": text.rstrip()},
+                        {"role": "user", "content": CONTINUE_PROMPT},
+                    ]
+                text += await self._with_retries(
+                    lambda: self._scheduled(send, follow_up, priority, temperature),
+                    can_retry=lambda: not emitted,
+                )
 
-        _record(self.name, "LLM 响应完成", f"用时约 {round(time.time() - t0, 1)}s")
-        return self._extract_text(response.content)
+            _record(self.name, "LLM 响应完成", f"用时约 {round(time.time() - t0, 1)}s{usage_detail}")
+        text = text.strip()
+        await self._cache_store(cache_key, text, stop_reason)
+        return text
 
     async def run(self, task: dict[str, Any]) -> dict[str, str]:
         task_id = str(task.get("task_id", ""))
@@ -181,7 +893,8 @@ class BaseAgent:
         )
 
         try:
-            result = await self._query_llm(prompt)
+            with span(self.name, "run", task_id=task_id):
+                result = await self._generate(prompt, priority=self._task_priority(task))
             return {
                 "task_id": task_id,
                 "from": self.name,
@@ -0,0 +1,194 @@
+"""Load benchmark: N concurrent Echo.coordinate runs against the in-process fake Anthropic API.
+
+    python benchmarks/load.py --concurrency 1,4,16
+    python benchmarks/load.py --save benchmarks/baselines/load.json
+    python benchmarks/load.py --baseline benchmarks/baselines/load.json --max-regression 0.25
+
+Per level it reports runs/sec, p50/p95/p99 end-to-end latency, and orchestration overhead: the
+p50 of the same workload against a zero-latency fake, i.e. time spent in our own code.
+
+Absolute milliseconds depend on the machine, so the baseline gate compares ratios measured within
+one run: throughput speedup and overhead growth relative to the lowest concurrency level, and the
+p95/p50 tail. Absolute numbers are only gated when the baseline was recorded on the same host.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def _run_level(concurrency: int, runs: int, fake_options: dict) -> dict[str, float]:
+    import clients
+    import fake_anthropic
+    from echo import Echo
+
+    fake = fake_anthropic.FakeAnthropic(**fake_options)
+    fake_anthropic.install(fake)
+    gate = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+
+    async def one(index: int) -> None:
+        async with gate:
+            started = time.perf_counter()
+            await Echo().coordinate(f"load benchmark goal {index}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(one(index) for index in range(runs)))
+    finally:
+        await clients.aclose_shared_clients()
+        fake_anthropic.install(None)
+    elapsed = time.perf_counter() - started
+    return {
+        "runs": runs,
+        "runs_per_sec": round(runs / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+        "requests": fake.stats["requests"],
+        "rate_limited": fake.stats["rate_limited"],
+        "server_errors": fake.stats["server_errors"],
+    }
+
+
+async def measure(levels: list[int], runs_per_level: int, fake_options: dict) -> dict[str, dict[str, float]]:
+    report: dict[str, dict[str, float]] = {}
+    for concurrency in levels:
+        runs = max(runs_per_level, concurrency)
+        level = await _run_level(concurrency, runs, fake_options)
+        idle = await _run_level(concurrency, runs, {**fake_options, "latency": 0.0, "tokens_per_second": 0.0})
+        level["overhead_p50_ms"] = idle["p50_ms"]
+        report[str(concurrency)] = level
+    return report
+
+
+def _host() -> dict[str, object]:
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _ratios(levels: dict[str, dict[str, float]]) -> dict[str, dict[str, float]]:
+    """Machine-independent shape of a result: scaling relative to the lowest level, and the tail."""
+    lowest = levels[min(levels, key=int)]
+    return {
+        level: {
+            "speedup": stats["runs_per_sec"] / lowest["runs_per_sec"],
+            "overhead_growth": stats["overhead_p50_ms"] / max(lowest["overhead_p50_ms"], 0.1),
+            "tail": stats["p95_ms"] / max(stats["p50_ms"], 0.1),
+        }
+        for level, stats in levels.items()
+    }
+
+
+def _regressions(result: dict, baseline: dict, max_regression: float) -> list[str]:
+    failures: list[str] = []
+    shared = {level: stats for level, stats in baseline.get("levels", {}).items() if level in result["levels"]}
+    if not shared:
+        return failures
+    base_ratios = _ratios(shared)
+    current_ratios = _ratios({level: result["levels"][level] for level in shared})
+    for level, base in base_ratios.items():
+        current = current_ratios[level]
+        if current["speedup"] < base["speedup"] * (1 - max_regression):
+            failures.append(f"c={level} speedup {current['speedup']:.2f}x < baseline {base['speedup']:.2f}x")
+        for key in ("overhead_growth", "tail"):
+            if current[key] > base[key] * (1 + max_regression):
+                failures.append(f"c={level} {key} {current[key]:.2f} > baseline {base[key]:.2f}")
+
+    # Absolute milliseconds only mean something on the machine that recorded them
+    if baseline.get("host") != result["host"]:
+        return failures
+    for level, base in shared.items():
+        current = result["levels"][level]
+        if current["runs_per_sec"] < base["runs_per_sec"] * (1 - max_regression):
+            failures.append(f"c={level} runs_per_sec {current['runs_per_sec']} < baseline {base['runs_per_sec']}")
+        for key in ("p95_ms", "overhead_p50_ms"):
+            if current[key] > base[key] * (1 + max_regression):
+                failures.append(f"c={level} {key} {current[key]} > baseline {base[key]}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=str, default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--runs", type=int, default=16, help="Runs per level (at least the concurrency)")
+    parser.add_argument("--latency", type=str, default="lognormal:0.05,0.3",
+                        help="Time to first token: seconds, uniform:a,b or lognormal:median,sigma")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--output-tokens", type=int, default=200)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02, help="Fraction of requests answered 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.01, help="Fraction answered 500/529")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", type=str, default=None, help="Write the result as a baseline JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare with a saved baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Fail when a gated ratio (or, on the baseline's host, an absolute number) "
+                             "is worse than the baseline by this fraction")
+    args = parser.parse_args()
+
+    try:
+        import anthropic.types  # noqa: F401
+        import httpx  # noqa: F401
+    except ImportError:
+        print("load benchmark needs the anthropic SDK and httpx: pip install -r requirements.txt")
+        return 2
+
+    # Online mode against the fake; retry backoff stays real so 429/5xx cost what they would in production
+    os.environ["ANTHROPIC_API_KEY"] = "sk-fake"
+    os.environ.pop("ANTHROPIC_BASE_URL", None)
+    os.environ.setdefault("HIVEMIND_RETRY_BASE_DELAY", "0.05")
+    fake_options = {
+        "latency": args.latency,
+        "tokens_per_second": args.tokens_per_second,
+        "output_tokens": args.output_tokens,
+        "rate_limit_rate": args.rate_limit_rate,
+        "server_error_rate": args.server_error_rate,
+        "seed": args.seed,
+    }
+    levels = [int(level) for level in args.concurrency.split(",") if level.strip()]
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = asyncio.run(measure(levels, args.runs, fake_options))
+    result = {"host": _host(), "fake": fake_options, "levels": report}
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = _regressions(result, baseline, args.max_regression)
+        for failure in failures:
+            print(f"load regression: {failure}")
+        if failures:
+            return 1
+        scope = "ratios and absolute numbers" if baseline.get("host") == result["host"] else "ratios (different host)"
+        print(f"{scope} within {args.max_regression:.0%} of baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
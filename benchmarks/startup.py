@@ -0,0 +1,99 @@
+"""Cold-start benchmark: import + Echo() + first offline call, each in a fresh interpreter.
+
+    python benchmarks/startup.py --runs 10
+    python benchmarks/startup.py --save benchmarks/baselines/startup.json
+    python benchmarks/startup.py --baseline benchmarks/baselines/startup.json --max-regression 0.25
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child; prints one JSON line of phase timings in milliseconds.
+_PROBE = r"""
+import asyncio, io, contextlib, json, sys, time
+t0 = time.perf_counter()
+from echo import Echo
+t1 = time.perf_counter()
+echo = Echo()
+t2 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    asyncio.run(echo.coordinate("startup benchmark"))
+t3 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "construct_ms": (t2 - t1) * 1000,
+    "first_call_ms": (t3 - t2) * 1000,
+    "total_ms": (t3 - t0) * 1000,
+    "sdk_imported": "anthropic" in sys.modules,
+}))
+"""
+
+
+def _probe_once() -> dict[str, float]:
+    env = {**os.environ, "ANTHROPIC_API_KEY": "", "PYTHONDONTWRITEBYTECODE": "1"}
+    # Run from an empty temp cwd so a developer's .env can't switch the probe online
+    with tempfile.TemporaryDirectory() as cwd:
+        completed = subprocess.run(
+            [sys.executable, "-c", f"import sys; sys.path.insert(0, {ROOT!r})\n{_PROBE}"],
+            capture_output=True,
+            text=True,
+            env=env,
+            cwd=cwd,
+            check=True,
+        )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def measure(runs: int) -> dict[str, float]:
+    samples = [_probe_once() for _ in range(runs)]
+    summary: dict[str, float] = {}
+    for phase in ("import_ms", "construct_ms", "first_call_ms", "total_ms"):
+        values = sorted(sample[phase] for sample in samples)
+        summary[phase] = round(statistics.median(values), 2)
+        summary[f"{phase[:-3]}_min_ms"] = round(values[0], 2)
+    summary["sdk_imported"] = any(sample["sdk_imported"] for sample in samples)
+    summary["runs"] = runs
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--save", type=str, default=None, help="Write the result as a baseline JSON file")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare the median total with a saved baseline")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Fail when total_ms exceeds the baseline by more than this fraction")
+    args = parser.parse_args()
+
+    result = measure(max(1, args.runs))
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        limit = baseline["total_ms"] * (1 + args.max_regression)
+        print(f"total_ms {result['total_ms']} vs baseline {baseline['total_ms']} (limit {round(limit, 2)})")
+        if result["total_ms"] > limit:
+            print("startup regression")
+            return 1
+    if result["sdk_imported"]:
+        print("anthropic was imported during an offline cold start")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
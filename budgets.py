@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+from collections import deque
+from typing import Any
+
+from config import DEFAULT_CACHE_DIR, env_float, env_int
+
+DEFAULT_HISTORY_PATH = os.path.join(DEFAULT_CACHE_DIR, "usage_history.json")
+# Budgets are rounded up to this step so small shifts in history don't change every request
+_BUDGET_STEP = 256
+
+
+class UsageHistory:
+    """Recent output size, stop_reason and latency per call site, persisted as JSON.
+
+    budget() turns that history into a max_tokens: the ``percentile`` of recent output tokens
+    times ``headroom``. A call cut off at max_tokens pins the site's budget to at least twice the
+    limit it hit, for as long as that call stays in the ``window``. Sites with fewer than
+    ``min_samples`` calls keep the caller's default.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_HISTORY_PATH,
+        *,
+        window: int = 50,
+        percentile: float = 95.0,
+        headroom: float = 1.25,
+        min_samples: int = 5,
+        floor: int = 512,
+        ceiling: int = 32000,
+    ) -> None:
+        self.path = path
+        self.window = max(1, window)
+        self.percentile = percentile
+        self.headroom = headroom
+        self.min_samples = max(1, min_samples)
+        self.floor = floor
+        self.ceiling = ceiling
+        # site -> deque of {"out", "thinking", "max_tokens", "truncated", "seconds"}
+        self.sites: dict[str, deque[dict[str, Any]]] = {}
+        self._dirty = False
+        self._save_lock = asyncio.Lock()
+        self.load()
+
+    @classmethod
+    def from_env(cls, path: str = DEFAULT_HISTORY_PATH) -> "UsageHistory":
+        return cls(
+            path,
+            window=env_int("HIVEMIND_BUDGET_WINDOW", 50),
+            percentile=env_float("HIVEMIND_BUDGET_PERCENTILE", 95.0),
+            headroom=env_float("HIVEMIND_BUDGET_HEADROOM", 1.25),
+            min_samples=env_int("HIVEMIND_BUDGET_MIN_SAMPLES", 5),
+            ceiling=env_int("HIVEMIND_BUDGET_CEILING", 32000),
+        )
+
+    def load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError):
+            # A corrupt history only costs the learned budgets, never the run
+            return
+        for site, samples in raw.get("sites", {}).items():
+            self.sites[site] = deque(samples, maxlen=self.window)
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self._write(self._snapshot())
+        self._dirty = False
+
+    async def asave(self) -> None:
+        """save() for use on the event loop: snapshot here, write the file in a worker thread."""
+        if not self._dirty:
+            return
+        # Snapshot on the loop so concurrent runs can keep calling observe() while the file is written
+        payload = self._snapshot()
+        self._dirty = False
+        async with self._save_lock:
+            try:
+                await asyncio.to_thread(self._write, payload)
+            except BaseException:
+                self._dirty = True
+                raise
+
+    def _snapshot(self) -> dict[str, Any]:
+        return {"sites": {site: list(samples) for site, samples in self.sites.items()}}
+
+    def _write(self, payload: dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def observe(
+        self,
+        site: str,
+        output_tokens: int,
+        *,
+        max_tokens: int,
+        truncated: bool,
+        seconds: float,
+        thinking_tokens: int = 0,
+    ) -> None:
+        self.sites.setdefault(site, deque(maxlen=self.window)).append({
+            "out": output_tokens,
+            "thinking": thinking_tokens,
+            "max_tokens": max_tokens,
+            "truncated": truncated,
+            "seconds": round(seconds, 3),
+        })
+        self._dirty = True
+
+    def budget(self, site: str, default: int) -> int:
+        samples = self.sites.get(site)
+        if not samples:
+            return default
+        truncated_floor = max((sample["max_tokens"] * 2 for sample in samples if sample["truncated"]), default=0)
+        if len(samples) < self.min_samples:
+            return min(self.ceiling, max(default, truncated_floor))
+        ordered = sorted(sample["out"] for sample in samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(self.percentile / 100 * len(ordered)) - 1))
+        budget = max(ordered[index] * self.headroom, truncated_floor, self.floor)
+        return int(min(self.ceiling, math.ceil(budget / _BUDGET_STEP) * _BUDGET_STEP))
+
+    def stats(self, site: str) -> dict[str, Any]:
+        samples = self.sites.get(site) or []
+        return {
+            "calls": len(samples),
+            "truncated": sum(1 for sample in samples if sample["truncated"]),
+            "max_out": max((sample["out"] for sample in samples), default=0),
+            "max_seconds": max((sample["seconds"] for sample in samples), default=0.0),
+        }
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+CHECKPOINT_FILE = "checkpoint.jsonl"
+
+
+class Checkpoint:
+    """Append-only record of finished stages in run_dir/checkpoint.jsonl.
+
+    The first line holds the goal; every later line is one ``{"key": ..., "value": ...}`` stage.
+    Lines are flushed as each stage completes, so a crash loses at most the stage in flight.
+    """
+
+    def __init__(self, run_dir: str, goal: str = "", *, resume: bool = False) -> None:
+        self.path = os.path.join(run_dir, CHECKPOINT_FILE)
+        self.goal = goal
+        self.stages: dict[str, Any] = {}
+        self.reused = 0
+        self._lock = asyncio.Lock()
+        if resume:
+            self._load()
+        os.makedirs(run_dir, exist_ok=True)
+        if not resume or not os.path.exists(self.path):
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"goal": self.goal}, ensure_ascii=False) + "\n")
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn final line from a crash mid-write
+                    continue
+                if "goal" in entry and not self.goal:
+                    self.goal = entry["goal"]
+                elif "key" in entry:
+                    self.stages[entry["key"]] = entry["value"]
+
+    def get(self, key: str) -> Any | None:
+        return self.stages.get(key)
+
+    def put(self, key: str, value: Any) -> None:
+        self.stages[key] = value
+        self._append(json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n")
+
+    async def aput(self, key: str, value: Any) -> None:
+        """put() with the append in a worker thread; the lock keeps lines of concurrent stages whole."""
+        self.stages[key] = value
+        line = json.dumps({"key": key, "value": value}, ensure_ascii=False) + "\n"
+        async with self._lock:
+            await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: str) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read_goal(run_dir: str) -> str:
+    """Original goal of a run, from the checkpoint header or (for finished runs) task.txt."""
+    path = os.path.join(run_dir, CHECKPOINT_FILE)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            first = f.readline()
+        try:
+            return str(json.loads(first).get("goal", ""))
+        except (json.JSONDecodeError, AttributeError):
+            pass
+    task_file = os.path.join(run_dir, "task.txt")
+    if os.path.exists(task_file):
+        with open(task_file, encoding="utf-8") as f:
+            return f.read().strip()
+    return ""
+
+
+_CURRENT_CHECKPOINT: ContextVar[Checkpoint | None] = ContextVar("hivemind_checkpoint", default=None)
+
+
+@contextmanager
+def checkpoint_scope(checkpoint: Checkpoint | None) -> Iterator[Checkpoint | None]:
+    token = _CURRENT_CHECKPOINT.set(checkpoint)
+    try:
+        yield checkpoint
+    finally:
+        _CURRENT_CHECKPOINT.reset(token)
+
+
+def stage_key(name: str, payload: Any) -> str:
+    # Keyed by content, not task_id: a resumed run re-creates the same dispatches with fresh ids
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return f"{name}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _finished(value: Any) -> bool:
+    # Failed or partial (deadline-cut) results are re-run on resume rather than frozen in
+    if isinstance(value, dict) and "status" in value:
+        return value.get("status") == "done" and not value.get("missing")
+    return value is not None
+
+
+async def checkpointed(key: str, factory: Callable[[], Awaitable[T]]) -> T:
+    """Return the stage's saved value if this run already finished it, otherwise run and save it."""
+    checkpoint = _CURRENT_CHECKPOINT.get()
+    if checkpoint is None:
+        return await factory()
+    saved = checkpoint.get(key)
+    if saved is not None:
+        checkpoint.reused += 1
+        return saved
+    value = await factory()
+    if _finished(value):
+        await checkpoint.aput(key, value)
+    return value
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import Any
+
+from config import env_flag, env_float, env_int
+
+
+# anthropic/httpx take a noticeable share of CLI start-up and offline runs never need them.
+# The module attributes below stay as the override points (tests patch them); load_sdk()
+# fills any that are still unset on first real use.
+class _Unloaded(Exception):
+    """Placeholder for an SDK name that has not been imported yet; never raised."""
+
+
+AsyncAnthropic: Any = _Unloaded
+httpx: Any = _Unloaded
+APIConnectionError: Any = _Unloaded
+APIStatusError: Any = _Unloaded
+APITimeoutError: Any = _Unloaded
+_SDK_NAMES = ("AsyncAnthropic", "httpx", "APIConnectionError", "APIStatusError", "APITimeoutError")
+
+
+def load_sdk() -> None:
+    module_globals = globals()
+    pending = [name for name in _SDK_NAMES if module_globals[name] is _Unloaded]
+    if not pending:
+        return
+    try:
+        import anthropic
+        import httpx as httpx_module
+    except ImportError:  # pragma: no cover
+        loaded: dict[str, Any] = {
+            "AsyncAnthropic": None,
+            "httpx": None,
+            "APIConnectionError": Exception,
+            "APIStatusError": Exception,
+            "APITimeoutError": Exception,
+        }
+    else:
+        loaded = {
+            "AsyncAnthropic": anthropic.AsyncAnthropic,
+            "httpx": httpx_module,
+            "APIConnectionError": anthropic.APIConnectionError,
+            "APIStatusError": anthropic.APIStatusError,
+            "APITimeoutError": anthropic.APITimeoutError,
+        }
+    for name in pending:
+        module_globals[name] = loaded[name]
+
+
+def sdk_missing() -> bool:
+    """True once load_sdk() found no anthropic SDK; False while it has not been tried yet."""
+    return not AsyncAnthropic
+
+
+def api_error_types() -> tuple[Any, Any, Any]:
+    """(APIConnectionError, APIStatusError, APITimeoutError), importing the SDK on first use."""
+    load_sdk()
+    return APIConnectionError, APIStatusError, APITimeoutError
+
+
+# One connection pool per (api_key, base_url) for the whole process, so the nine agents
+# in the Echo tree reuse keep-alive connections instead of each opening their own.
+_CLIENTS: dict[tuple[str, str], Any] = {}
+# The httpx client under each shared SDK client, for warm_up_connections()
+_HTTP_CLIENTS: dict[tuple[str, str], Any] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _build_http_client() -> Any:
+    limits = httpx.Limits(
+        max_connections=env_int("HIVEMIND_HTTP_MAX_CONNECTIONS", 32),
+        max_keepalive_connections=env_int("HIVEMIND_HTTP_MAX_KEEPALIVE", 16),
+        keepalive_expiry=env_float("HIVEMIND_HTTP_KEEPALIVE_EXPIRY", 30.0),
+    )
+    http2 = env_flag("HIVEMIND_HTTP2") and _http2_available()
+    # Bypass system proxy (Clash/VPN) to connect directly to the API endpoint
+    return httpx.AsyncClient(
+        transport=_HTTP_TRANSPORT or httpx.AsyncHTTPTransport(proxy=None, limits=limits, http2=http2),
+        timeout=env_float("HIVEMIND_HTTP_TIMEOUT", 120.0),
+    )
+
+
+# Replaces the network transport of clients built after this call (fake_anthropic.py, load benchmarks)
+_HTTP_TRANSPORT: Any | None = None
+
+
+def set_http_transport(transport: Any | None) -> None:
+    global _HTTP_TRANSPORT
+    _HTTP_TRANSPORT = transport
+
+
+def get_shared_client(api_key: str, base_url: str = "") -> Any | None:
+    """The process-wide SDK client for this key and endpoint; None when the anthropic SDK is missing."""
+    load_sdk()
+    if not AsyncAnthropic:
+        return None
+    key = (api_key, base_url)
+    client = _CLIENTS.get(key)
+    if client is None:
+        # Retries are owned by RetryPolicy; SDK-level retries would multiply attempts and hide the waits.
+        client_kwargs: dict[str, Any] = {"api_key": api_key, "max_retries": 0}
+        if base_url:
+            client_kwargs["base_url"] = base_url
+        if httpx:
+            client_kwargs["http_client"] = _HTTP_CLIENTS[key] = _build_http_client()
+        client = AsyncAnthropic(**client_kwargs)
+        _CLIENTS[key] = client
+    return client
+
+
+async def warm_up_connections(connections: int | None = None) -> int:
+    """Import the SDK and open pooled connections (TCP + TLS) before the first real request.
+
+    Best effort, for idle time such as an interactive prompt: returns how many connections
+    answered, and 0 when offline or when the endpoint can't be reached.
+    """
+    api_key = os.getenv("ANTHROPIC_API_KEY", "").strip()
+    if not api_key:
+        return 0
+    # The SDK import is the slowest part of a cold start; keep it off the event loop
+    await asyncio.to_thread(load_sdk)
+    if not AsyncAnthropic:
+        return 0
+    base_url = os.getenv("ANTHROPIC_BASE_URL", "").strip()
+    client = get_shared_client(api_key, base_url)
+    http_client = _HTTP_CLIENTS.get((api_key, base_url))
+    if http_client is None:
+        return 0
+
+    async def touch() -> bool:
+        # Any response, even a 404, leaves a handshaken keep-alive connection in the pool
+        try:
+            await http_client.head(str(client.base_url), timeout=10.0)
+        except Exception:
+            return False
+        return True
+
+    count = connections or env_int("HIVEMIND_WARM_CONNECTIONS", 2)
+    return sum(await asyncio.gather(*(touch() for _ in range(max(1, count)))))
+
+
+async def aclose_shared_clients() -> None:
+    clients = list(_CLIENTS.values())
+    _CLIENTS.clear()
+    _HTTP_CLIENTS.clear()
+    for client in clients:
+        await client.close()
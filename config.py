@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import os
+
+_ENV_LOADED = False
+
+
+def load_environment() -> None:
+    """Read .env once per process; variables already set in the environment win."""
+    global _ENV_LOADED
+    if _ENV_LOADED:
+        return
+    _ENV_LOADED = True
+    try:
+        from dotenv import load_dotenv
+    except ImportError:  # pragma: no cover
+        return
+    load_dotenv()
+
+
+def env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "").strip() or default)
+    except ValueError:
+        return default
+
+
+def env_flag(name: str, default: bool = False) -> bool:
+    value = os.getenv(name, "").strip().lower()
+    if not value:
+        return default
+    return value in {"1", "true", "yes", "on"}
+
+
+# On-disk state shared across runs: the response cache and the adaptive-budget usage history
+DEFAULT_CACHE_DIR = os.path.join("outputs", ".cache")
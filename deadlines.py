@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Iterator
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+_DEADLINE: ContextVar[float | None] = ContextVar("hivemind_deadline", default=None)
+
+
+def time_remaining() -> float | None:
+    deadline = _DEADLINE.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def deadline_scope(seconds: float | None = None, *, reserve: float = 0.0) -> Iterator[float | None]:
+    """Narrow the deadline seen by everything awaited inside (including tasks created there).
+
+    ``seconds`` sets a deadline relative to now; ``reserve`` holds back time from the current
+    deadline for work the caller still has to do afterwards (e.g. a synthesis call).
+    """
+    candidates = []
+    current = _DEADLINE.get()
+    if current is not None:
+        candidates.append(current - reserve)
+    if seconds is not None:
+        candidates.append(time.monotonic() + seconds)
+    token = _DEADLINE.set(min(candidates) if candidates else None)
+    try:
+        yield _DEADLINE.get()
+    finally:
+        _DEADLINE.reset(token)
+
+
+async def gather_within_deadline(aws: list[Awaitable[Any]]) -> list[Any | None]:
+    """asyncio.gather that, once the current deadline passes, cancels stragglers and returns None for them."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    remaining = time_remaining()
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=None if remaining is None else max(0.0, remaining))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.wait(pending)
+    return [task.result() if task in done else None for task in tasks]
@@ -1,11 +1,16 @@
 ﻿from __future__ import annotations
 
 import asyncio
+import contextvars
 import json
+import os
 import uuid
-from typing import Any
+from functools import cached_property
+from typing import Any, Awaitable, Callable
 
-from base_agent import BaseAgent
+from base_agent import BaseAgent, IncrementalJSONParser, checkpointed, span, stage_key
+from config import env_int
+from deadlines import DeadlineExceeded, gather_within_deadline, time_remaining
 from elon import Elon
 from henry import Henry
 
@@ -21,14 +26,33 @@ ECHO_ROLE_PROMPT = """
 3. 在可控风险内给予最大权限
 """.strip()
 
+# A task is either a plain goal string or an object that may name dependencies within its line
+TASK_ITEM_SCHEMA = {
+    "anyOf": [
+        {"type": "string"},
+        {
+            "type": "object",
+            "properties": {
+                "id": {"type": "string"},
+                "goal": {"type": "string"},
+                "context": {"type": "string"},
+                "priority": {"type": "string", "enum": ["high", "medium", "low"]},
+                "depends_on": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["goal"],
+            "additionalProperties": False,
+        },
+    ]
+}
+
 TASK_DECOMPOSE_OUTPUT_CONFIG = {
     "format": {
         "type": "json_schema",
         "schema": {
             "type": "object",
             "properties": {
-                "elon_tasks": {"type": "array", "items": {"type": "string"}},
-                "henry_tasks": {"type": "array", "items": {"type": "string"}},
+                "elon_tasks": {"type": "array", "items": TASK_ITEM_SCHEMA},
+                "henry_tasks": {"type": "array", "items": TASK_ITEM_SCHEMA},
             },
             "required": ["elon_tasks", "henry_tasks"],
             "additionalProperties": False,
@@ -36,20 +60,111 @@ TASK_DECOMPOSE_OUTPUT_CONFIG = {
     }
 }
 
+TASK_LINES = ("elon_tasks", "henry_tasks")
+
+FILE_PLAN_OUTPUT_CONFIG = {
+    "format": {
+        "type": "json_schema",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "files": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"name": {"type": "string"}, "outline": {"type": "string"}},
+                        "required": ["name", "outline"],
+                        "additionalProperties": False,
+                    },
+                }
+            },
+            "required": ["files"],
+            "additionalProperties": False,
+        },
+    }
+}
+
+REFINE_SELECT_OUTPUT_CONFIG = {
+    "format": {
+        "type": "json_schema",
+        "schema": {
+            "type": "object",
+            "properties": {"files": {"type": "array", "items": {"type": "string"}}},
+            "required": ["files"],
+            "additionalProperties": False,
+        },
+    }
+}
+
+
+async def run_task_graph(
+    tasks: list[dict[str, Any]],
+    run_task: Callable[[dict[str, Any], dict[str, dict[str, str]]], Awaitable[dict[str, str]]],
+) -> dict[str, dict[str, str]]:
+    """Run each task as soon as its depends_on tasks finish; independent tasks run concurrently.
+
+    Unknown ids and self-references are ignored. If the remaining edges form a cycle,
+    the tasks on it are started anyway rather than deadlocking the run.
+    """
+    by_id = {task["id"]: task for task in tasks}
+    deps = {
+        task_id: [dep for dep in task.get("depends_on", []) if dep in by_id and dep != task_id]
+        for task_id, task in by_id.items()
+    }
+    waiting = dict(deps)
+    results: dict[str, dict[str, str]] = {}
+    running: dict[asyncio.Task, str] = {}
+
+    try:
+        while waiting or running:
+            ready = [task_id for task_id, needs in waiting.items() if all(dep in results for dep in needs)]
+            if not ready and not running:
+                ready = list(waiting)
+            for task_id in ready:
+                del waiting[task_id]
+                upstream = {dep: results[dep] for dep in deps[task_id] if dep in results}
+                running[asyncio.create_task(run_task(by_id[task_id], upstream))] = task_id
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                results[running.pop(finished)] = finished.result()
+    finally:
+        for pending in running:
+            pending.cancel()
+    return results
+
 
 class Echo(BaseAgent):
-    def __init__(self, model: str = "claude-opus-4-6") -> None:
+    synthesis_reserve = 30.0
+
+    def __init__(self, model: str = "claude-opus-4-6", fan_out: bool = False, per_file: bool = False) -> None:
         super().__init__(name="Echo", role_prompt=ECHO_ROLE_PROMPT, model=model)
-        self.elon = Elon()
-        self.henry = Henry()
+        # Run each decomposed task as its own unit (see run_task_graph) instead of one packed goal per line
+        self.fan_out = fan_out
+        self.per_file = per_file
+
+    @cached_property
+    def elon(self) -> Elon:
+        return Elon()
+
+    @cached_property
+    def henry(self) -> Henry:
+        return Henry()
+
+    def agent_tree(self) -> list[BaseAgent]:
+        return [self, *self.elon.agent_tree(), *self.henry.agent_tree()]
 
     @staticmethod
-    def _normalize_task_list(items: Any) -> list[dict[str, str]]:
+    def _normalize_task_list(items: Any) -> list[dict[str, Any]]:
         if not isinstance(items, list):
             return []
 
-        normalized: list[dict[str, str]] = []
+        # Ids the model supplied keep priority; generated ids and repeats are bent around them
+        reserved = {str(item.get("id", "")).strip() for item in items if isinstance(item, dict)}
+        taken: set[str] = set()
+        normalized: list[dict[str, Any]] = []
         for item in items:
+            depends_on: list[str] = []
+            task_id = ""
             if isinstance(item, str):
                 goal = item.strip()
                 context = ""
@@ -58,6 +173,9 @@ class Echo(BaseAgent):
                 goal = str(item.get("goal", "")).strip()
                 context = str(item.get("context", "")).strip()
                 priority = str(item.get("priority", "high")).strip().lower()
+                task_id = str(item.get("id", "")).strip()
+                if isinstance(item.get("depends_on"), list):
+                    depends_on = [str(dep).strip() for dep in item["depends_on"] if str(dep).strip()]
             else:
                 continue
 
@@ -66,48 +184,100 @@ class Echo(BaseAgent):
             if not goal or goal in {"...", "…"}:
                 continue
 
-            normalized.append({"goal": goal, "context": context, "priority": priority})
+            if task_id:
+                base, suffix = task_id, 2
+                while task_id in taken:
+                    task_id = f"{base}-{suffix}"
+                    suffix += 1
+            else:
+                number = len(normalized) + 1
+                while f"t{number}" in taken or f"t{number}" in reserved:
+                    number += 1
+                task_id = f"t{number}"
+            taken.add(task_id)
+
+            normalized.append({
+                "id": task_id,
+                "goal": goal,
+                "context": context,
+                "priority": priority,
+                "depends_on": depends_on,
+            })
 
         return normalized
 
-    async def _decompose_goal(self, human_input: str) -> dict[str, list[dict[str, str]]]:
+    def _tasks_or_fallback(self, key: str, items: Any, human_input: str) -> list[dict[str, Any]]:
+        tasks = self._normalize_task_list(items)
+        if tasks:
+            return tasks
+        if key == "elon_tasks":
+            return [
+                {
+                    "id": "t1",
+                    "goal": f"Deliver the technical implementation plan for: {human_input}",
+                    "context": "Define architecture, delivery milestones, and engineering risks.",
+                    "priority": "high",
+                    "depends_on": [],
+                }
+            ]
+        return [
+            {
+                "id": "t1",
+                "goal": f"Deliver the growth strategy for: {human_input}",
+                "context": "Define audience, content distribution, and measurable growth loops.",
+                "priority": "high",
+                "depends_on": [],
+            }
+        ]
+
+    async def _decompose_goal(
+        self,
+        human_input: str,
+        on_tasks: Callable[[str, list[dict[str, Any]]], None] | None = None,
+    ) -> dict[str, list[dict[str, Any]]]:
         prompt = (
             "将人类战略目标拆解为技术和增长两条任务线。\n"
             "输出必须是 JSON，并遵守 output_config 定义。\n"
-            f"Human input: {human_input}"
+            + (
+                "每个任务输出为对象，给出简短 id；若某任务必须等待同一任务线内的其他任务完成，"
+                "用 depends_on 列出这些任务的 id，相互独立的任务不要添加依赖。\n"
+                if self.fan_out
+                else ""
+            )
+            + f"Human input: {human_input}"
         )
 
-        raw = await self._query_llm(
-            prompt,
-            temperature=0.1,
-            output_config=TASK_DECOMPOSE_OUTPUT_CONFIG,
-        )
-        parsed = self._extract_json(raw) or {}
+        if on_tasks is None:
+            raw = await self._query_llm(
+                prompt,
+                temperature=0.1,
+                output_config=TASK_DECOMPOSE_OUTPUT_CONFIG,
+                priority="high",
+                site="decompose",
+            )
+        else:
+            # Hand each task line to the caller as soon as its array closes in the stream
+            parser = IncrementalJSONParser()
 
-        elon_tasks = self._normalize_task_list(parsed.get("elon_tasks"))
-        henry_tasks = self._normalize_task_list(parsed.get("henry_tasks"))
+            def handle_chunk(chunk: str) -> None:
+                for key, value in parser.feed(chunk):
+                    if key in TASK_LINES:
+                        on_tasks(key, self._tasks_or_fallback(key, value, human_input))
 
-        if not elon_tasks:
-            elon_tasks = [
-                {
-                    "goal": f"Deliver the technical implementation plan for: {human_input}",
-                    "context": "Define architecture, delivery milestones, and engineering risks.",
-                    "priority": "high",
-                }
-            ]
-        if not henry_tasks:
-            henry_tasks = [
-                {
-                    "goal": f"Deliver the growth strategy for: {human_input}",
-                    "context": "Define audience, content distribution, and measurable growth loops.",
-                    "priority": "high",
-                }
-            ]
+            raw = await self._stream_llm(
+                prompt,
+                on_text=handle_chunk,
+                temperature=0.1,
+                output_config=TASK_DECOMPOSE_OUTPUT_CONFIG,
+                priority="high",
+                site="decompose",
+            )
+        parsed = self._extract_json(raw) or {}
 
-        return {"elon_tasks": elon_tasks, "henry_tasks": henry_tasks}
+        return {key: self._tasks_or_fallback(key, parsed.get(key), human_input) for key in TASK_LINES}
 
     @staticmethod
-    def _pack_tasks(tasks: list[dict[str, str]]) -> tuple[str, str, str]:
+    def _pack_tasks(tasks: list[dict[str, Any]]) -> tuple[str, str, str]:
         goals = [item["goal"] for item in tasks]
         context = "\n".join(
             f"- [{task['priority']}] Goal: {task['goal']} | Context: {task['context']}" for task in tasks
@@ -115,54 +285,272 @@ class Echo(BaseAgent):
         primary_priority = tasks[0]["priority"] if tasks else "medium"
         return "；".join(goals), context, primary_priority
 
-    async def coordinate(self, human_input: str) -> str:
-        self._log(f"Coordinating strategic input: {human_input[:120]}...")
-        task_plan = await self._decompose_goal(human_input)
-
-        elon_goal, elon_context, elon_priority = self._pack_tasks(task_plan["elon_tasks"])
-        henry_goal, henry_context, henry_priority = self._pack_tasks(task_plan["henry_tasks"])
-
-        elon_task = {
+    @staticmethod
+    def _build_dispatch(to: str, tasks: list[dict[str, Any]]) -> dict[str, Any]:
+        goal, context, priority = Echo._pack_tasks(tasks)
+        return {
             "task_id": str(uuid.uuid4()),
             "from": "Echo",
-            "to": "Elon",
+            "to": to,
             "type": "task_dispatch",
             "payload": {
-                "goal": elon_goal,
-                "context": elon_context,
-                "priority": elon_priority,
+                "goal": goal,
+                "context": context,
+                "priority": priority,
             },
         }
-        henry_task = {
-            "task_id": str(uuid.uuid4()),
-            "from": "Echo",
-            "to": "Henry",
-            "type": "task_dispatch",
-            "payload": {
-                "goal": henry_goal,
-                "context": henry_context,
-                "priority": henry_priority,
-            },
+
+    async def _run_line(self, key: str, tasks: list[dict[str, Any]]) -> dict[str, str]:
+        if self.fan_out and len(tasks) > 1:
+            return await self._run_line_graph(key, tasks)
+        if key == "elon_tasks":
+            return await self._run_stage(self.elon, self._build_dispatch("Elon", tasks))
+        return await self._run_stage(self.henry, self._build_dispatch("Henry", tasks))
+
+    async def _run_line_graph(self, key: str, tasks: list[dict[str, Any]]) -> dict[str, str]:
+        lead, to = (self.elon, "Elon") if key == "elon_tasks" else (self.henry, "Henry")
+
+        async def run_unit(task: dict[str, Any], upstream: dict[str, dict[str, str]]) -> dict[str, str]:
+            failed_deps = [dep_id for dep_id, result in upstream.items() if result.get("status") != "done"]
+            if failed_deps:
+                # A dependent would only build on error text; skip it and report it as missing
+                self._log(f"{key}/{task['id']}: 前置任务 {', '.join(failed_deps)} 失败，跳过")
+                return {
+                    "task_id": task["id"],
+                    "from": to,
+                    "result": "",
+                    "status": "skipped",
+                    "error": f"prerequisites failed: {', '.join(failed_deps)}",
+                }
+            dispatch = self._build_dispatch(to, [task])
+            if upstream:
+                # Dependents see what their prerequisites produced, capped so context doesn't snowball
+                dispatch["payload"]["context"] += "\n\nPrerequisite results:\n" + "\n\n".join(
+                    f"[{dep_id}] {result.get('result', '')[:1500]}" for dep_id, result in upstream.items()
+                )
+            with span(self.name, "task_unit", line=key, task=task["id"]):
+                return await self._run_stage(lead, dispatch)
+
+        self._log(f"{key}: {len(tasks)} 个任务按依赖图并行执行")
+        results = await run_task_graph(tasks, run_unit)
+
+        done = [task for task in tasks if results[task["id"]].get("status") == "done"]
+        failed = [task["id"] for task in tasks if results[task["id"]].get("status") != "done"]
+        if failed:
+            self._log(f"{key}: 未完成的任务: {', '.join(failed)}")
+        sections = [f"### {task['goal']}\n{results[task['id']].get('result', '')}" for task in done]
+        return {
+            "task_id": ",".join(result.get("task_id", "") for result in results.values()),
+            "from": to,
+            "result": "\n\n".join(sections),
+            "status": "done" if done else "error",
+            "missing": ", ".join(f"{to}/{task_id}" for task_id in failed),
         }
 
-        elon_result, henry_result = await asyncio.gather(
-            self.elon.run(elon_task),
-            self.henry.run(henry_task),
-        )
+    async def coordinate(self, human_input: str, on_text: Callable[[str], None] | None = None) -> str:
+        self._log(f"Coordinating strategic input: {human_input[:120]}...")
+
+        # Each line starts as soon as its task list is complete, while the rest of the plan is still streaming
+        started: dict[str, asyncio.Task] = {}
+
+        with self._stage_deadline():
+            run_context = contextvars.copy_context()
+
+            def dispatch(key: str, tasks: list[dict[str, Any]]) -> None:
+                if key not in started:
+                    self._log(f"{key} 已就绪，开始派发")
+                    # Parent the line's spans to the run, not to the decompose stage it was started from
+                    started[key] = asyncio.create_task(self._run_line(key, tasks), context=run_context.copy())
+
+            try:
+                with span(self.name, "decompose"):
+                    task_plan = await checkpointed(
+                        stage_key("Echo/decompose", {"goal": human_input, "fan_out": self.fan_out}),
+                        lambda: self._decompose_goal(human_input, on_tasks=dispatch),
+                    )
+                for key in TASK_LINES:
+                    dispatch(key, task_plan[key])
+                with span(self.name, "await_lines"):
+                    elon_result, henry_result = await gather_within_deadline([started[key] for key in TASK_LINES])
+            except BaseException:
+                for pending in started.values():
+                    pending.cancel()
+                raise
+
+        missing: list[str] = []
+        for name, line_result in (("Elon", elon_result), ("Henry", henry_result)):
+            if line_result is None or line_result.get("status") != "done":
+                missing.append(name)
+            elif line_result.get("missing"):
+                missing.extend(line_result["missing"].split(", "))
+        if missing:
+            self._log(f"缺失任务线: {', '.join(missing)}")
+            if time_remaining() is not None and elon_result is None and henry_result is None:
+                raise DeadlineExceeded("no task line finished before the run deadline")
 
         # Extract only the result text to avoid passing bloated JSON with repeated task strings
-        elon_text = elon_result.get("result", "") if isinstance(elon_result, dict) else str(elon_result)
-        henry_text = henry_result.get("result", "") if isinstance(henry_result, dict) else str(henry_result)
+        elon_text = elon_result.get("result", "") if elon_result else "(not completed before the run deadline)"
+        henry_text = henry_result.get("result", "") if henry_result else "(not completed before the run deadline)"
         # Truncate human_input in the synthesis prompt to avoid context bloat
         task_summary = human_input[:500] + ("..." if len(human_input) > 500 else "")
 
-        summary_prompt = (
-            "Based on the full team output below, fulfill the human's original request completely and literally.\n"
-            "If the human asked for specific files with delimiters, output every file in full using those exact delimiters.\n"
-            "Do NOT say you will generate files. Do NOT use placeholders. START IMMEDIATELY with the first === FILE: === delimiter.\n"
-            "Do NOT truncate or abbreviate any file content.\n"
+        team_output = (
             f"Human's original request: {task_summary}\n"
             f"Elon's technical output:\n{elon_text}\n\n"
             f"Henry's growth output:\n{henry_text}"
+            + (f"\n\nMissing tracks (not delivered; do not invent their content): {', '.join(missing)}" if missing else "")
+        )
+        result = None
+        if self.per_file:
+            with span(self.name, "synthesis_per_file"):
+                result = await self._synthesize_per_file(team_output, on_text=on_text)
+
+        if result is None:
+            summary_prompt = (
+                "Based on the full team output below, fulfill the human's original request completely and literally.\n"
+                "If the human asked for specific files with delimiters, output every file in full using those exact delimiters.\n"
+                "Do NOT say you will generate files. Do NOT use placeholders. START IMMEDIATELY with the first === FILE: === delimiter.\n"
+                "Do NOT truncate or abbreviate any file content.\n"
+                + team_output
+            )
+            with span(self.name, "synthesis"):
+                if on_text is not None:
+                    result = await self._stream_llm(
+                        summary_prompt, on_text=on_text, max_tokens=8192, priority="high", screen="flag", site="synthesis"
+                    )
+                else:
+                    result = await self._query_llm(
+                        summary_prompt, max_tokens=8192, priority="high", screen="flag", site="synthesis"
+                    )
+
+        # The model may or may not mention what is missing; this section always does
+        note = self._missing_section(result, missing)
+        if note and on_text is not None:
+            on_text(note)
+        return result + note
+
+    @staticmethod
+    def _missing_section(result: str, missing: list[str]) -> str:
+        if not missing:
+            return ""
+        lines = "\n".join(f"- {name}" for name in missing)
+        if "=== FILE:" in result:
+            # Text after the last delimiter would land inside the last file; give the note a file of its own
+            return f"\n\n=== FILE: MISSING.md ===\n# Missing\n\n{lines}\n"
+        return f"\n\n## Missing\n\n{lines}\n"
+
+    @staticmethod
+    def _strip_file_header(text: str) -> str:
+        # Single-file calls are told not to repeat the delimiter, but models sometimes do
+        lines = text.strip().splitlines()
+        if lines and lines[0].strip().startswith("=== FILE:"):
+            lines = lines[1:]
+        return "\n".join(lines).strip()
+
+    async def _plan_files(self, team_output: str) -> list[dict[str, str]]:
+        raw = await self._query_llm(
+            "Plan the deliverable files for the human's request below. List every file to produce with its exact "
+            "name (relative path) and a short outline of what it must contain. Do not write the files yet.\n"
+            + team_output,
+            temperature=0.1,
+            output_config=FILE_PLAN_OUTPUT_CONFIG,
+            priority="high",
+            site="plan",
         )
-        return await self._query_llm(summary_prompt, max_tokens=8192)
+        parsed = self._extract_json(raw) or {}
+        plan: list[dict[str, str]] = []
+        for item in parsed.get("files", []):
+            name = str(item.get("name", "")).strip() if isinstance(item, dict) else ""
+            if name and name not in {entry["name"] for entry in plan}:
+                plan.append({"name": name, "outline": str(item.get("outline", "")).strip()})
+        return plan
+
+    async def _synthesize_per_file(
+        self, team_output: str, on_text: Callable[[str], None] | None = None
+    ) -> str | None:
+        """Plan the files, then write each in its own concurrent call; None if no file plan came back."""
+        with span(self.name, "file_plan"):
+            plan = await self._plan_files(team_output)
+        if not plan:
+            self._log("文件规划为空，回退到单次汇总")
+            return None
+        self._log(f"文件规划: {len(plan)} 个文件并行生成")
+        listing = "\n".join(f"- {entry['name']}: {entry['outline']}" for entry in plan)
+        continuations = env_int("HIVEMIND_MAX_CONTINUATIONS", 3)
+
+        async def write_file(entry: dict[str, str]) -> str:
+            prompt = (
+                f"Write the complete content of the file `{entry['name']}` for the human's request below.\n"
+                f"Outline for this file: {entry['outline']}\n"
+                "Other files are written separately; keep names and references consistent with this plan:\n"
+                f"{listing}\n"
+                "Output ONLY the file content: no === FILE: === delimiter, no commentary, no placeholders.\n\n"
+                + team_output
+            )
+            with span(self.name, "write_file", file=entry["name"]):
+                text = await self._query_llm(
+                    prompt, max_tokens=8192, priority="high", continuations=continuations, screen="flag", site="file"
+                )
+            section = f"=== FILE: {entry['name']} ===\n{self._strip_file_header(text)}\n"
+            if on_text is not None:
+                # Sections arrive in completion order; each is whole, so the file splitter can write it at once
+                on_text(section)
+            return section
+
+        sections = await asyncio.gather(*(write_file(entry) for entry in plan))
+        return "\n".join(sections).strip()
+
+    async def _select_refine_targets(self, files: dict[str, str], feedback: str) -> list[str]:
+        if not feedback.strip():
+            # No direction given: review everything, as a full refine would
+            return list(files)
+        # Files named in the feedback are unambiguous; skip the selection call
+        lowered = feedback.lower()
+        named = [name for name in files if name.lower() in lowered or os.path.basename(name).lower() in lowered]
+        if named:
+            return named
+
+        listing = "\n".join(
+            f"- {name} ({len(content)} chars): {content.strip().splitlines()[0][:100] if content.strip() else ''}"
+            for name, content in files.items()
+        )
+        raw = await self._query_llm(
+            "根据改进反馈，判断需要修改哪些文件。只列出确实需要改动的文件，文件名必须来自下面的列表。\n"
+            f"改进反馈：\n{feedback}\n\n文件列表：\n{listing}",
+            temperature=0.0,
+            output_config=REFINE_SELECT_OUTPUT_CONFIG,
+            priority="high",
+            site="refine_select",
+        )
+        parsed = self._extract_json(raw) or {}
+        selected = [name for name in parsed.get("files", []) if name in files]
+        return selected or list(files)
+
+    async def refine_files(self, original_task: str, files: dict[str, str], feedback: str) -> dict[str, str]:
+        """Regenerate only the files the feedback affects, one concurrent call per file; returns the new contents."""
+        with span(self.name, "refine_select", files=len(files)):
+            targets = await self._select_refine_targets(files, feedback)
+        self._log(f"Refine: 重新生成 {len(targets)}/{len(files)} 个文件: {', '.join(targets)}")
+        other_files = "\n".join(f"- {name}" for name in files if name not in targets)
+
+        async def regenerate(name: str) -> tuple[str, str]:
+            prompt = (
+                "根据改进反馈修改下面这个文件，输出修改后的完整文件内容。\n"
+                "只输出文件内容本身：不要加 === FILE: === 分隔符，不要解释，不要省略任何部分。\n"
+                f"原始任务：\n{original_task[:2000]}\n\n"
+                f"改进反馈：\n{feedback or '（无具体反馈，请自行审视并优化）'}\n\n"
+                + (f"项目中其他保持不变的文件（保持与它们一致）：\n{other_files}\n\n" if other_files else "")
+                + f"=== FILE: {name} ===\n{files[name]}"
+            )
+            with span(self.name, "refine_file", file=name):
+                text = await self._query_llm(
+                    prompt,
+                    max_tokens=8192,
+                    priority="high",
+                    continuations=env_int("HIVEMIND_MAX_CONTINUATIONS", 3),
+                    screen="flag",
+                    site="refine",
+                )
+            return name, self._strip_file_header(text)
+
+        return dict(await asyncio.gather(*(regenerate(name) for name in targets)))
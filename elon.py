@@ -1,10 +1,9 @@
 ﻿from __future__ import annotations
 
-import asyncio
-import json
+from functools import cached_property
 from typing import Any
 
-from base_agent import BaseAgent
+from base_agent import BaseAgent, span
 
 ELON_ROLE_PROMPT = """
 你是 Elon，团队 CTO。
@@ -53,9 +52,23 @@ class DebugAgent(BaseAgent):
 class Elon(BaseAgent):
     def __init__(self, model: str = "claude-opus-4-6", sub_model: str = "claude-haiku-4-5") -> None:
         super().__init__(name="Elon", role_prompt=ELON_ROLE_PROMPT, model=model)
-        self.architect = ArchitectAgent(model=sub_model)
-        self.reviewer = ReviewAgent(model=sub_model)
-        self.debugger = DebugAgent(model=sub_model)
+        # Sub-agents are built on first use so constructing the tree stays cheap
+        self.sub_model = sub_model
+
+    @cached_property
+    def architect(self) -> ArchitectAgent:
+        return ArchitectAgent(model=self.sub_model)
+
+    @cached_property
+    def reviewer(self) -> ReviewAgent:
+        return ReviewAgent(model=self.sub_model)
+
+    @cached_property
+    def debugger(self) -> DebugAgent:
+        return DebugAgent(model=self.sub_model)
+
+    def agent_tree(self) -> list[BaseAgent]:
+        return [self, self.architect, self.reviewer, self.debugger]
 
     @staticmethod
     def _normalize_task(task: dict[str, Any]) -> tuple[str, str, str]:
@@ -66,13 +79,16 @@ class Elon(BaseAgent):
         context = str(task.get("context") or payload.get("context") or "").strip()
         return task_id, goal, context
 
-    def _build_subtasks(self, task_id: str, goal: str, context: str) -> list[tuple[BaseAgent, dict[str, str]]]:
+    def _build_subtasks(
+        self, task_id: str, goal: str, context: str, priority: str = "medium"
+    ) -> list[tuple[BaseAgent, dict[str, str]]]:
         return [
             (
                 self.architect,
                 {
                     "task_id": task_id,
                     "from": "Elon",
+                    "priority": priority,
                     "goal": f"Design technical architecture for: {goal}",
                     "context": context,
                 },
@@ -82,6 +98,7 @@ class Elon(BaseAgent):
                 {
                     "task_id": task_id,
                     "from": "Elon",
+                    "priority": priority,
                     "goal": f"Produce review and testing plan for: {goal}",
                     "context": context,
                 },
@@ -91,6 +108,7 @@ class Elon(BaseAgent):
                 {
                     "task_id": task_id,
                     "from": "Elon",
+                    "priority": priority,
                     "goal": f"List likely failure modes and fixes for: {goal}",
                     "context": context,
                 },
@@ -99,25 +117,30 @@ class Elon(BaseAgent):
 
     async def run(self, task: dict[str, Any]) -> dict[str, str]:
         task_id, goal, context = self._normalize_task(task)
+        priority = self._task_priority(task)
         self._log(f"Dispatching sub-agents for goal: {goal}")
 
         try:
-            subtasks = self._build_subtasks(task_id=task_id, goal=goal, context=context)
-            results = await asyncio.gather(*(agent.run(subtask) for agent, subtask in subtasks))
+            subtasks = self._build_subtasks(task_id=task_id, goal=goal, context=context, priority=priority)
+            with span(self.name, "subagents", task_id=task_id):
+                results, missing = await self._gather_subagents(subtasks)
 
             summary_prompt = (
                 "Synthesize the three technical tracks into a concise CTO report.\n"
                 "Use headings: Architecture, Quality & Testing, Debug/Fix, Delivery Risks.\n"
                 f"Goal: {goal}\n"
                 f"Context: {context}\n"
-                f"Sub-agent outputs: {json.dumps(results, ensure_ascii=False)}"
+                f"Sub-agent outputs:\n{self._compact_results(results)}"
+                + (f"\nMissing tracks (state that they are missing): {', '.join(missing)}" if missing else "")
             )
-            merged = await self._query_llm(summary_prompt)
+            with span(self.name, "merge", task_id=task_id):
+                merged = await self._query_llm(summary_prompt, priority=priority)
             return {
                 "task_id": task_id,
                 "from": "Elon",
                 "result": merged,
                 "status": "done",
+                "missing": ", ".join(missing),
             }
         except Exception as exc:  # noqa: BLE001
             self._log(f"Error: {exc}")
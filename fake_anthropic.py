@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import math
+import random
+from typing import Any, AsyncIterator, Callable
+
+_FILLER = (
+    "Ship the smallest slice that proves the loop, measure it, then widen scope only where the data says the "
+    "bottleneck is. Keep interfaces narrow and document every decision next to the code that depends on it. "
+)
+
+
+def parse_latency(spec: str | float) -> Callable[[random.Random], float]:
+    """'0.2' (fixed seconds), 'uniform:0.1,0.4' or 'lognormal:<median>,<sigma>' -> sampler."""
+    if isinstance(spec, (int, float)):
+        return lambda _rng: float(spec)
+    kind, _, args = str(spec).partition(":")
+    if not args:
+        value = float(kind)
+        return lambda _rng: value
+    params = [float(part) for part in args.split(",")]
+    if kind == "uniform":
+        low, high = params
+        return lambda rng: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = params
+        return lambda rng: median * math.exp(rng.gauss(0.0, sigma))
+    raise ValueError(f"unknown latency distribution: {spec!r}")
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+class FakeAnthropic:
+    """In-process stand-in for the Messages API, served through an httpx.MockTransport.
+
+    Every request waits for a sampled time-to-first-token, then "generates" output at
+    ``tokens_per_second`` (streamed as SSE deltas when the request asks for a stream).
+    ``rate_limit_rate`` / ``server_error_rate`` inject 429s (with retry-after) and 529/500s.
+    Structured requests (task decomposition, file plans) get schema-valid JSON so the whole
+    Echo pipeline runs end to end. System blocks marked with cache_control are cached like the
+    real API does: only prefixes of at least the model's minimum length, reported back through
+    cache_creation_input_tokens / cache_read_input_tokens.
+    """
+
+    def __init__(
+        self,
+        *,
+        latency: str | float = 0.0,
+        tokens_per_second: float = 0.0,
+        output_tokens: int = 200,
+        rate_limit_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        retry_after: float = 0.0,
+        chunk_tokens: int = 16,
+        seed: int | None = 0,
+    ) -> None:
+        self.sample_latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = output_tokens
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.rng = random.Random(seed)
+        self.stats = {"requests": 0, "streams": 0, "rate_limited": 0, "server_errors": 0, "output_tokens": 0}
+        self.simulated_seconds = 0.0
+        self._ids = itertools.count(1)
+        self._cached_prefixes: set[str] = set()
+
+    def transport(self) -> Any:
+        import httpx
+
+        return httpx.MockTransport(self.handle)
+
+    # --- request handling ---
+    async def handle(self, request: Any) -> Any:
+        import httpx
+
+        self.stats["requests"] += 1
+        if not request.url.path.endswith("/v1/messages"):
+            return httpx.Response(404, json=self._error("not_found_error", f"no route {request.url.path}"))
+        body = json.loads(request.content or b"{}")
+
+        roll = self.rng.random()
+        if roll < self.rate_limit_rate:
+            self.stats["rate_limited"] += 1
+            return httpx.Response(
+                429,
+                headers={"retry-after": str(self.retry_after)},
+                json=self._error("rate_limit_error", "injected rate limit"),
+            )
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            self.stats["server_errors"] += 1
+            status = self.rng.choice((500, 529))
+            kind = "overloaded_error" if status == 529 else "api_error"
+            return httpx.Response(status, json=self._error(kind, "injected server error"))
+
+        text = self._reply(body)
+        output_tokens = _estimate_tokens(text)
+        self.stats["output_tokens"] += output_tokens
+        input_tokens = _estimate_tokens(json.dumps([body.get("system"), body.get("messages")], ensure_ascii=False))
+        cache_read, cache_write = self._prompt_cache(body)
+        usage = self._usage(max(1, input_tokens - cache_read - cache_write), output_tokens, cache_read, cache_write)
+        first_token = max(0.0, self.sample_latency(self.rng))
+        message_id = f"msg_fake_{next(self._ids)}"
+
+        if body.get("stream"):
+            self.stats["streams"] += 1
+            return httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content=self._sse(message_id, body, text, usage, first_token),
+            )
+
+        delay = first_token + self._generation_seconds(output_tokens)
+        self.simulated_seconds += delay
+        if delay:
+            await asyncio.sleep(delay)
+        return httpx.Response(200, json=self._message(message_id, body, text, usage))
+
+    def _generation_seconds(self, tokens: int) -> float:
+        return tokens / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    @staticmethod
+    def _error(kind: str, message: str) -> dict[str, Any]:
+        return {"type": "error", "error": {"type": kind, "message": message}}
+
+    def _prompt_cache(self, body: dict[str, Any]) -> tuple[int, int]:
+        """(read, written) tokens for the request's cache_control breakpoints."""
+        from base_agent import min_cacheable_tokens
+
+        system = body.get("system")
+        if not isinstance(system, list):
+            return 0, 0
+        minimum = min_cacheable_tokens(str(body.get("model", "")))
+        breakpoints: list[tuple[str, int]] = []
+        prefix_tokens = 0
+        for index, block in enumerate(system):
+            prefix_tokens += _estimate_tokens(block.get("text", ""))
+            if block.get("cache_control") and prefix_tokens >= minimum:
+                key = json.dumps([body.get("model"), system[: index + 1]], ensure_ascii=False, sort_keys=True)
+                breakpoints.append((key, prefix_tokens))
+        if not breakpoints:
+            return 0, 0
+        read = max((tokens for key, tokens in breakpoints if key in self._cached_prefixes), default=0)
+        self._cached_prefixes.update(key for key, _tokens in breakpoints)
+        return read, breakpoints[-1][1] - read
+
+    @staticmethod
+    def _usage(input_tokens: int, output_tokens: int, cache_read: int = 0, cache_write: int = 0) -> dict[str, int]:
+        return {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "cache_creation_input_tokens": cache_write,
+            "cache_read_input_tokens": cache_read,
+        }
+
+    def _message(self, message_id: str, body: dict[str, Any], text: str, usage: dict[str, int]) -> dict:
+        return {
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": usage,
+        }
+
+    async def _sse(
+        self,
+        message_id: str,
+        body: dict[str, Any],
+        text: str,
+        usage: dict[str, int],
+        first_token: float,
+    ) -> AsyncIterator[bytes]:
+        def event(name: str, data: dict[str, Any]) -> bytes:
+            return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+        started = {
+            **self._message(message_id, body, "", {**usage, "output_tokens": 1}),
+            "content": [],
+            "stop_reason": None,
+        }
+        yield event("message_start", {"type": "message_start", "message": started})
+        self.simulated_seconds += first_token
+        if first_token:
+            await asyncio.sleep(first_token)
+        yield event("content_block_start", {"type": "content_block_start", "index": 0,
+                                            "content_block": {"type": "text", "text": ""}})
+        step = self.chunk_tokens * 4
+        for start in range(0, len(text), step):
+            piece = text[start : start + step]
+            pause = self._generation_seconds(_estimate_tokens(piece))
+            self.simulated_seconds += pause
+            if pause:
+                await asyncio.sleep(pause)
+            yield event("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                                "delta": {"type": "text_delta", "text": piece}})
+        yield event("content_block_stop", {"type": "content_block_stop", "index": 0})
+        yield event("message_delta", {"type": "message_delta",
+                                      "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                      "usage": {"output_tokens": usage["output_tokens"]}})
+        yield event("message_stop", {"type": "message_stop"})
+
+    # --- canned replies ---
+    def _filler(self, tokens: int | None = None) -> str:
+        chars = (tokens or self.output_tokens) * 4
+        return (_FILLER * (chars // len(_FILLER) + 1))[:chars].strip()
+
+    def _reply(self, body: dict[str, Any]) -> str:
+        schema = (((body.get("output_config") or {}).get("format") or {}).get("schema") or {}).get("properties", {})
+        if "elon_tasks" in schema:
+            return json.dumps({
+                "elon_tasks": [
+                    {"id": "api", "goal": "Build the API", "priority": "high", "depends_on": []},
+                    {"id": "tests", "goal": "Cover the API with tests", "priority": "medium", "depends_on": ["api"]},
+                ],
+                "henry_tasks": [
+                    {"id": "launch", "goal": "Plan the launch post", "priority": "high", "depends_on": []},
+                    {"id": "metrics", "goal": "Define activation metrics", "priority": "medium", "depends_on": []},
+                ],
+            })
+        if "files" in schema:
+            if schema["files"].get("items", {}).get("type") == "object":
+                return json.dumps({"files": [
+                    {"name": "README.md", "outline": "Overview and setup"},
+                    {"name": "docs/plan.md", "outline": "Delivery and growth plan"},
+                ]})
+            return json.dumps({"files": []})
+
+        messages = body.get("messages") or [{}]
+        prompt = messages[0].get("content", "")
+        prompt = prompt if isinstance(prompt, str) else json.dumps(prompt, ensure_ascii=False)
+        if "=== FILE:" in prompt and len(messages) == 1 and "Write the complete content" not in prompt:
+            half = max(1, self.output_tokens // 2)
+            return f"=== FILE: README.md ===\n{self._filler(half)}\n=== FILE: docs/plan.md ===\n{self._filler(half)}"
+        return self._filler()
+
+
+def install(fake: FakeAnthropic | None) -> None:
+    """Route every shared client built from now on through ``fake`` (None restores the network).
+
+    Callers still need a non-empty ANTHROPIC_API_KEY so agents go online at all.
+    """
+    import clients
+
+    clients.set_http_transport(fake.transport() if fake is not None else None)
+    # Pools built before the swap would keep talking to the old transport
+    clients._CLIENTS.clear()
+    clients._HTTP_CLIENTS.clear()
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+DEFAULT_BLOCKED_TERMS = (
+    "mass mention",
+    "bulk mention",
+    "spam",
+    "repeat post",
+    "unsolicited dm",
+    "cold dm",
+    "批量@",
+    "刷评论",
+    "私信轰炸",
+)
+
+# Output text routinely says "avoid spam" / "严禁刷评论" or describes a risk ("flagged as spam").
+# A term only counts as restated, not proposed, when one of these phrases sits directly in front of it
+# (separated by nothing but spaces or punctuation). Single CJK characters like 不/反/防 are not enough:
+# "不要担心，我们会批量@" and "反馈后刷评论" are still violations.
+_NEGATIONS = (
+    "不要", "不得", "不能", "不可", "不许", "禁止", "严禁", "避免", "杜绝", "拒绝", "切勿", "防止", "反对",
+    "no", "not", "never", "avoid", "avoiding", "don't", "do not", "without", "prohibit", "prohibits", "anti",
+    # Descriptive mentions of a risk rather than a tactic
+    "flagged as", "reported as", "marked as", "treated as", "seen as", "被视为", "被判定为", "被标记为", "被当作",
+)
+_NEGATION_PATTERN = re.compile(
+    "(?:" + "|".join(
+        # ASCII phrases must start at a word boundary, so "piano" doesn't end in a negation "no"
+        (r"\b" + re.escape(phrase)) if phrase[0].isascii() else re.escape(phrase)
+        for phrase in sorted(_NEGATIONS, key=len, reverse=True)
+    ) + r")[\s\-:：,，、]*$"
+)
+# "严禁刷评论和 spam": a negation carries over a list of blocked terms
+_CONJUNCTION_PATTERN = re.compile(r"^[\s,，、/]*(?:和|或|及|与|以及|and|or|nor)?[\s,，、/]*$")
+_NEGATION_WINDOW = 16
+
+
+class GuardrailViolation(Exception):
+    def __init__(self, agent: str, term: str) -> None:
+        super().__init__(f"Guardrail violation in {agent} output: {term!r}")
+        self.agent = agent
+        self.term = term
+
+
+def normalize(text: str) -> str:
+    """NFKC (full-width ＠ -> @, half-width kana, ligatures), casefold, drop zero-width/format chars."""
+    folded = unicodedata.normalize("NFKC", text).casefold()
+    return "".join(ch for ch in folded if unicodedata.category(ch) != "Cf")
+
+
+def _is_word(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def _term_pattern(term: str) -> str:
+    parts: list[str] = []
+    previous = ""
+    for ch in normalize(term).strip():
+        if ch.isspace():
+            # "cold dm", "cold-dm" and "colddm" are the same term
+            if parts and parts[-1] != r"[\s_-]*":
+                parts.append(r"[\s_-]*")
+            previous = ""
+            continue
+        if previous and not (_is_word(previous) and _is_word(ch)):
+            # CJK and symbols tolerate padding: "批量 @", "刷 评 论"
+            parts.append(r"\s{0,2}")
+        parts.append(re.escape(ch))
+        previous = ch
+    return "".join(parts)
+
+
+class Guardrail:
+    """All blocked terms compiled into one regex over normalized text; find() is a single pass."""
+
+    def __init__(self, terms: list[str] | tuple[str, ...]) -> None:
+        self.terms = sorted({normalize(term).strip() for term in terms if term.strip()}, key=len, reverse=True)
+        self._pattern = re.compile("|".join(_term_pattern(term) for term in self.terms)) if self.terms else None
+        # Enough trailing context to match a term split across chunks, plus its negation look-back
+        self.window = max((len(term) * 3 for term in self.terms), default=0) + _NEGATION_WINDOW
+
+    def find(self, text: str, allow_negated: bool = False) -> str | None:
+        return self._search(normalize(text), allow_negated=allow_negated)
+
+    def _search(self, normalized: str, *, allow_negated: bool, min_end: int = 0) -> str | None:
+        if self._pattern is None:
+            return None
+        negated_end = -1
+        for match in self._pattern.finditer(normalized):
+            if allow_negated:
+                before = normalized[max(0, match.start() - _NEGATION_WINDOW) : match.start()]
+                carried = negated_end >= 0 and _CONJUNCTION_PATTERN.match(normalized[negated_end : match.start()])
+                if carried or _NEGATION_PATTERN.search(before):
+                    negated_end = match.end()
+                    continue
+            negated_end = -1
+            if match.end() <= min_end:
+                continue
+            return match.group(0)
+        return None
+
+    def scanner(self, allow_negated: bool = True) -> GuardrailScanner:
+        return GuardrailScanner(self, allow_negated)
+
+
+class GuardrailScanner:
+    """Incremental find() over streamed chunks; only a bounded normalized tail is kept between feeds."""
+
+    def __init__(self, guardrail: Guardrail, allow_negated: bool = True) -> None:
+        self.guardrail = guardrail
+        self.allow_negated = allow_negated
+        self.violation: str | None = None
+        self._tail = ""
+
+    def feed(self, chunk: str) -> str | None:
+        if self.violation is None:
+            text = self._tail + normalize(chunk)
+            # Matches wholly inside the tail were already checked, with more negation context than is left now
+            self.violation = self.guardrail._search(text, allow_negated=self.allow_negated, min_end=len(self._tail))
+            self._tail = text[-self.guardrail.window :]
+        return self.violation
+
+
+def _read_terms(path: str) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+@lru_cache(maxsize=None)
+def load_guardrail() -> Guardrail:
+    """Built-in terms plus HIVEMIND_GUARDRAIL_TERMS_FILE (one per line) and HIVEMIND_GUARDRAIL_TERMS (comma-separated)."""
+    terms = list(DEFAULT_BLOCKED_TERMS)
+    path = os.getenv("HIVEMIND_GUARDRAIL_TERMS_FILE", "").strip()
+    if path:
+        terms.extend(_read_terms(path))
+    terms.extend(term for term in os.getenv("HIVEMIND_GUARDRAIL_TERMS", "").split(",") if term.strip())
+    return Guardrail(terms)
@@ -1,10 +1,10 @@
 ﻿from __future__ import annotations
 
-import asyncio
-import json
+from functools import cached_property
 from typing import Any
 
-from base_agent import BaseAgent
+from base_agent import BaseAgent, span
+from guardrails import load_guardrail
 
 HENRY_GUARDRAIL_PROMPT = """
 严格禁止以下行为：
@@ -23,50 +23,72 @@ HENRY_ROLE_PROMPT = f"""
 
 
 class CommunityAgent(BaseAgent):
+    screen_output = True
+
     def __init__(self, model: str = "claude-haiku-4-5") -> None:
         super().__init__(
             name="Henry/Community",
             model=model,
             role_prompt=(
                 "你是 Community Ops 子代理。"
-                "给出合规社区增长动作、节奏、互动方案。\n"
-                f"{HENRY_GUARDRAIL_PROMPT}"
+                "给出合规社区增长动作、节奏、互动方案。"
             ),
+            shared_prompt=HENRY_GUARDRAIL_PROMPT,
         )
 
 
 class ContentAgent(BaseAgent):
+    screen_output = True
+
     def __init__(self, model: str = "claude-haiku-4-5") -> None:
         super().__init__(
             name="Henry/Content",
             model=model,
             role_prompt=(
                 "你是 Content Creation 子代理。"
-                "输出内容主题、框架、发布计划和 CTA。\n"
-                f"{HENRY_GUARDRAIL_PROMPT}"
+                "输出内容主题、框架、发布计划和 CTA。"
             ),
+            shared_prompt=HENRY_GUARDRAIL_PROMPT,
         )
 
 
 class AnalyticsAgent(BaseAgent):
+    screen_output = True
+
     def __init__(self, model: str = "claude-haiku-4-5") -> None:
         super().__init__(
             name="Henry/Analytics",
             model=model,
             role_prompt=(
                 "你是 Data Analysis 子代理。"
-                "定义指标、实验、监控与策略洞察。\n"
-                f"{HENRY_GUARDRAIL_PROMPT}"
+                "定义指标、实验、监控与策略洞察。"
             ),
+            shared_prompt=HENRY_GUARDRAIL_PROMPT,
         )
 
 
 class Henry(BaseAgent):
+    screen_output = True
+
     def __init__(self, model: str = "claude-opus-4-6", sub_model: str = "claude-haiku-4-5") -> None:
         super().__init__(name="Henry", role_prompt=HENRY_ROLE_PROMPT, model=model)
-        self.community = CommunityAgent(model=sub_model)
-        self.content = ContentAgent(model=sub_model)
-        self.analytics = AnalyticsAgent(model=sub_model)
+        # Sub-agents are built on first use so constructing the tree stays cheap
+        self.sub_model = sub_model
+
+    @cached_property
+    def community(self) -> CommunityAgent:
+        return CommunityAgent(model=self.sub_model)
+
+    @cached_property
+    def content(self) -> ContentAgent:
+        return ContentAgent(model=self.sub_model)
+
+    @cached_property
+    def analytics(self) -> AnalyticsAgent:
+        return AnalyticsAgent(model=self.sub_model)
+
+    def agent_tree(self) -> list[BaseAgent]:
+        return [self, self.community, self.content, self.analytics]
 
     @staticmethod
     def _normalize_task(task: dict[str, Any]) -> tuple[str, str, str]:
@@ -78,28 +100,19 @@ class Henry(BaseAgent):
         return task_id, goal, context
 
     @staticmethod
-    def _violates_guardrails(goal: str, context: str) -> bool:
-        text = f"{goal}\n{context}".lower()
-        blocked_terms = [
-            "mass mention",
-            "bulk mention",
-            "spam",
-            "repeat post",
-            "unsolicited dm",
-            "cold dm",
-            "批量@",
-            "刷评论",
-            "私信轰炸",
-        ]
-        return any(term in text for term in blocked_terms)
+    def _violates_guardrails(goal: str, context: str) -> str | None:
+        # Inputs are held to the strict list: even "avoid spam" in a dispatched goal is escalated
+        return load_guardrail().find(f"{goal}\n{context}")
 
     async def run(self, task: dict[str, Any]) -> dict[str, str]:
         task_id, goal, context = self._normalize_task(task)
+        priority = self._task_priority(task)
         self._log(f"Dispatching sub-agents for goal: {goal}")
 
-        if self._violates_guardrails(goal, context):
+        blocked_term = self._violates_guardrails(goal, context)
+        if blocked_term is not None:
             message = "Guardrail violation detected. Execution stopped and escalated to Echo."
-            self._log(message)
+            self._log(f"{message} ({blocked_term})")
             return {
                 "task_id": task_id,
                 "from": "Henry",
@@ -114,6 +127,7 @@ class Henry(BaseAgent):
                     {
                         "task_id": task_id,
                         "from": "Henry",
+                        "priority": priority,
                         "goal": f"Create community operations plan for: {goal}",
                         "context": context,
                     },
@@ -123,6 +137,7 @@ class Henry(BaseAgent):
                     {
                         "task_id": task_id,
                         "from": "Henry",
+                        "priority": priority,
                         "goal": f"Create content strategy for: {goal}",
                         "context": context,
                     },
@@ -132,26 +147,31 @@ class Henry(BaseAgent):
                     {
                         "task_id": task_id,
                         "from": "Henry",
+                        "priority": priority,
                         "goal": f"Create analytics plan for: {goal}",
                         "context": context,
                     },
                 ),
             ]
-            results = await asyncio.gather(*(agent.run(subtask) for agent, subtask in subtasks))
+            with span(self.name, "subagents", task_id=task_id):
+                results, missing = await self._gather_subagents(subtasks)
 
             summary_prompt = (
                 "Synthesize the three growth tracks into a concise CMO report.\n"
                 "Use headings: Community, Content, Analytics, Risks.\n"
                 f"Goal: {goal}\n"
                 f"Context: {context}\n"
-                f"Sub-agent outputs: {json.dumps(results, ensure_ascii=False)}"
+                f"Sub-agent outputs:\n{self._compact_results(results)}"
+                + (f"\nMissing tracks (state that they are missing): {', '.join(missing)}" if missing else "")
             )
-            merged = await self._query_llm(summary_prompt)
+            with span(self.name, "merge", task_id=task_id):
+                merged = await self._generate(summary_prompt, priority=priority)
             return {
                 "task_id": task_id,
                 "from": "Henry",
                 "result": merged,
                 "status": "done",
+                "missing": ", ".join(missing),
             }
         except Exception as exc:  # noqa: BLE001
             self._log(f"Error: {exc}")
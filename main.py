@@ -2,8 +2,11 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import json
 import os
 import sys
+import threading
+import time
 from datetime import datetime
 
 # Fix Windows GBK encoding for both stdin and stdout
@@ -13,89 +16,255 @@ if hasattr(sys.stdout, "reconfigure"):
 if hasattr(sys.stdin, "reconfigure"):
     sys.stdin.reconfigure(encoding="utf-8")
 
-from base_agent import get_timeline, reset_timeline
+from base_agent import LLM_FAILED_EVENT, get_response_cache, set_response_cache, set_usage_history
+from budgets import DEFAULT_HISTORY_PATH, UsageHistory
+from checkpoint import read_goal
+from clients import aclose_shared_clients, warm_up_connections
+from config import DEFAULT_CACHE_DIR, env_flag, env_float, env_int
+from deadlines import deadline_scope
 from echo import Echo
+from guardrails import load_guardrail
+from metrics import start_metrics
+from response_cache import ResponseCache
+from runner import (
+    METADATA_FILES,
+    RUN_FINISHED_EVENT,
+    content_hash,
+    execute_run,
+    new_run_dir,
+    print_usage,
+    read_manifest,
+    write_outputs,
+)
+from tracing import TIMELINE_FILE, TimelineWriter, record, span, start_trace
 
 
-def _split_files(result: str) -> dict[str, str]:
-    """Parse '=== FILE: name ===' delimiters into separate file contents."""
-    files: dict[str, str] = {}
-    current_name: str | None = None
-    current_lines: list[str] = []
-
-    for line in result.splitlines():
-        stripped = line.strip()
-        if stripped.startswith("=== FILE:") and stripped.endswith("==="):
-            if current_name is not None:
-                files[current_name] = "\n".join(current_lines).strip()
-            current_name = stripped[9:-3].strip()
-            current_lines = []
-        else:
-            if current_name is not None:
-                current_lines.append(line)
-
-    if current_name is not None:
-        files[current_name] = "\n".join(current_lines).strip()
+# Events that open and close one LLM call, for the --tail "still waiting" summary
+_LLM_CALL_EVENTS = ("调用 LLM", "流式调用 LLM")
+# A call that raised (retries exhausted, breaker open, cancelled) closes with LLM_FAILED_EVENT instead
+_LLM_DONE_EVENTS = ("LLM 响应完成", LLM_FAILED_EVENT)
 
-    return files
 
+def _format_event(event: dict) -> str:
+    detail = f"  {event['detail']}" if event.get("detail") else ""
+    return f"+{event.get('t', 0):>8.2f}s  {event.get('agent', '?'):<22} {event.get('event', '')}{detail}"
 
-def _write_outputs(human_input: str, result: str, run_dir: str) -> None:
-    os.makedirs(run_dir, exist_ok=True)
 
-    # Try to split into named files; fall back to single result.md
-    files = _split_files(result)
-    if files:
-        for filename, content in files.items():
-            # Support subdirectories like .github/ISSUE_TEMPLATE/bug_report.yml
-            filepath = os.path.join(run_dir, filename)
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.write(content + "\n")
-        print(f"[输出] 已保存 {len(files)} 个文件到 {run_dir}/")
-    else:
-        with open(os.path.join(run_dir, "result.md"), "w", encoding="utf-8") as f:
-            f.write(f"# 任务输出\n\n**输入**: {human_input}\n\n---\n\n{result}\n")
-        print(f"[输出] result.md 已保存到 {run_dir}/")
-
-    # Always write timeline and original task
-    timeline = get_timeline()
-    lines = [
-        "# Hive Mind 行动时间线\n",
-        f"**任务**: {human_input}\n",
-        f"**时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
-        "\n| 耗时(s) | Agent | 事件 | 备注 |\n",
-        "|---------|-------|------|------|\n",
-    ]
-    for e in timeline:
-        detail = e["detail"].replace("|", "\\|") if e["detail"] else ""
-        lines.append(f"| +{e['t']} | {e['agent']} | {e['event']} | {detail} |\n")
-    with open(os.path.join(run_dir, "timeline.md"), "w", encoding="utf-8") as f:
-        f.writelines(lines)
-    with open(os.path.join(run_dir, "task.txt"), "w", encoding="utf-8") as f:
-        f.write(human_input)
-
-
-async def _run_once(echo: Echo, human_input: str) -> None:
-    reset_timeline()
-    result = await echo.coordinate(human_input)
+async def _tail_timeline(run_dir: str, poll: float = 0.5, idle_report: float = 5.0) -> None:
+    """Follow run_dir/timeline.jsonl like tail -f; after idle_report quiet seconds, name the agents still waiting on the LLM."""
+    path = os.path.join(run_dir, TIMELINE_FILE)
+    if not os.path.exists(path):
+        print(f"[tail] 等待 {path} 出现...")
+    while not os.path.exists(path):
+        await asyncio.sleep(poll)
+
+    # agent -> wall-clock start of each LLM call it still has in flight
+    waiting: dict[str, list[float]] = {}
+    offset = 0
+    partial = ""
+    last_activity = time.time()
+    reported = False
+    while True:
+        with open(path, encoding="utf-8") as f:
+            f.seek(offset)
+            chunk = f.read()
+            offset = f.tell()
+        if chunk:
+            # The writer flushes whole lines, but a reader can still land mid-write
+            lines = (partial + chunk).split("\n")
+            partial = lines.pop()
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                print(_format_event(event))
+                agent = event.get("agent", "?")
+                if event.get("event") in _LLM_CALL_EVENTS:
+                    waiting.setdefault(agent, []).append(event.get("ts", time.time()))
+                elif event.get("event") in _LLM_DONE_EVENTS and waiting.get(agent):
+                    waiting[agent].pop(0)
+                elif event.get("event") == RUN_FINISHED_EVENT:
+                    return
+            last_activity = time.time()
+            reported = False
+        elif not reported and time.time() - last_activity >= idle_report:
+            now = time.time()
+            pending = sorted(
+                ((agent, now - starts[0]) for agent, starts in waiting.items() if starts),
+                key=lambda item: item[1],
+                reverse=True,
+            )
+            if pending:
+                print("[tail] 等待 LLM 响应: " + ", ".join(f"{agent} {seconds:.0f}s" for agent, seconds in pending))
+            reported = True
+        await asyncio.sleep(poll)
+
+
+
+async def _run_once(echo: Echo, human_input: str, stream: bool = False, deadline: float | None = None) -> str:
+    run_dir = new_run_dir()
+    result = await execute_run(echo, human_input, run_dir, stream=stream, deadline=deadline)
     print(f"\nEcho > {result}\n")
-    run_dir = os.path.join("outputs", datetime.now().strftime("%Y%m%d_%H%M%S"))
-    _write_outputs(human_input, result, run_dir)
+    return run_dir
+
+
+def _stdin_lines() -> asyncio.Queue[str | None]:
+    """Lines typed on stdin, read by a daemon thread so the event loop keeps running; None marks EOF."""
+    loop = asyncio.get_running_loop()
+    lines: asyncio.Queue[str | None] = asyncio.Queue()
+
+    def pump() -> None:
+        try:
+            for line in iter(sys.stdin.readline, ""):
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+        except RuntimeError:
+            # Loop already closed (the REPL exited while a line was pending)
+            pass
+
+    threading.Thread(target=pump, name="hivemind-stdin", daemon=True).start()
+    return lines
+
+
+async def _preload(echo: Echo) -> None:
+    """Build the agent tree, compile the guardrail and pull recent cache entries into memory."""
+    for agent in echo.agent_tree():
+        # Resolves the shared client for every agent; offline this is a no-op
+        agent.client
+    load_guardrail()
+    cache = get_response_cache()
+    if cache is not None:
+        await cache.apreload()
+
+
+async def _keep_warm(echo: Echo, interval: float) -> None:
+    """Idle-time warm-up for the REPL; re-opens connections before keep-alive expiry drops them."""
+    opened = await warm_up_connections()
+    await _preload(echo)
+    if opened:
+        print(f"\n[预热] 已建立 {opened} 个 API 连接")
+    while interval > 0:
+        await asyncio.sleep(interval)
+        await warm_up_connections()
+
+
+async def _interactive(echo: Echo, args: argparse.Namespace) -> None:
+    """REPL: every goal runs as its own task with its own output dir, so a new goal can be typed while others run."""
+    print("Hive Mind 已启动。输入你的战略目标（运行中可以继续输入新目标）：")
+    warm = asyncio.create_task(_keep_warm(echo, env_float("HIVEMIND_WARM_INTERVAL", 25.0)))
+    runs: set[asyncio.Task] = set()
+
+    def finished(task: asyncio.Task) -> None:
+        runs.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"\n[Hive Mind] 运行失败: {task.exception()!r}")
+
+    lines = _stdin_lines()
+    try:
+        while True:
+            print("Human > ", end="", flush=True)
+            line = await lines.get()
+            if line is None:
+                break
+            human_input = line.strip()
+            if human_input.lower() in ("exit", "quit"):
+                break
+            if not human_input:
+                continue
+            task = asyncio.create_task(_run_once(echo, human_input, stream=args.stream, deadline=args.deadline))
+            runs.add(task)
+            task.add_done_callback(finished)
+            if len(runs) > 1:
+                print(f"[Hive Mind] 当前并行运行 {len(runs)} 个目标")
+        if runs:
+            print(f"[Hive Mind] 等待 {len(runs)} 个进行中的运行结束...")
+            await asyncio.gather(*runs, return_exceptions=True)
+        print("Hive Mind 已退出。")
+    finally:
+        warm.cancel()
+        for task in list(runs):
+            task.cancel()
+
+
+def _load_batch(path: str) -> list[str]:
+    """Read goals from a JSONL file: {"goal": ...} / {"task": ...} objects, JSON strings or plain lines."""
+    goals: list[str] = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                item = line
+            if isinstance(item, dict):
+                goal = str(item.get("goal") or item.get("task") or "").strip()
+            else:
+                goal = str(item).strip()
+            if goal:
+                goals.append(goal)
+    return goals
+
+
+async def _run_batch(
+    echo: Echo,
+    path: str,
+    concurrency: int,
+    summary_path: str | None = None,
+    stream: bool = False,
+    deadline: float | None = None,
+) -> list[dict]:
+    goals = _load_batch(path)
+    batch_dir = os.path.join("outputs", f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(batch_dir, exist_ok=True)
+    summary_path = summary_path or os.path.join(batch_dir, "summary.jsonl")
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    print(f"[Hive Mind] 批量模式，{len(goals)} 个目标，并发 {concurrency}，汇总: {summary_path}")
+
+    async def run_goal(index: int, goal: str) -> dict:
+        run_dir = os.path.join(batch_dir, f"{index:04d}")
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await execute_run(echo, goal, run_dir, stream=stream, deadline=deadline)
+                entry = {"index": index, "goal": goal, "status": "done", "run_dir": run_dir}
+            except Exception as exc:  # noqa: BLE001
+                # One failed goal must not take the rest of the batch down with it
+                entry = {"index": index, "goal": goal, "status": "error", "run_dir": run_dir,
+                         "error": f"{exc.__class__.__name__}: {exc}"}
+            entry["seconds"] = round(time.monotonic() - started, 3)
+
+        with open(summary_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        print(f"[批量] #{index} {entry['status']} ({entry['seconds']}s) → {run_dir}")
+        return entry
+
+    records = await asyncio.gather(*(run_goal(index, goal) for index, goal in enumerate(goals)))
+    failed = sum(1 for entry in records if entry["status"] != "done")
+    print(f"[批量] 完成 {len(records) - failed}/{len(records)}，失败 {failed}")
+    return list(records)
 
 
 def _load_prior_output(prior_dir: str) -> dict[str, str]:
-    """Recursively read all output files, skipping metadata."""
-    skip = {"timeline.md", "task.txt"}
+    """Read the output files listed in the manifest, or recursively all files minus metadata for older runs."""
+    manifest = read_manifest(prior_dir)
+    if manifest is not None:
+        rel_paths = [name for name in manifest if os.path.exists(os.path.join(prior_dir, name))]
+    else:
+        rel_paths = [
+            os.path.relpath(os.path.join(root, fname), prior_dir).replace("\\", "/")
+            for root, _, filenames in os.walk(prior_dir)
+            for fname in filenames
+            if fname not in METADATA_FILES
+        ]
     files: dict[str, str] = {}
-    for root, _, filenames in os.walk(prior_dir):
-        for fname in filenames:
-            if fname in skip:
-                continue
-            abs_path = os.path.join(root, fname)
-            rel_path = os.path.relpath(abs_path, prior_dir).replace("\\", "/")
-            with open(abs_path, encoding="utf-8") as f:
-                files[rel_path] = f.read()
+    for rel_path in rel_paths:
+        with open(os.path.join(prior_dir, rel_path), encoding="utf-8") as f:
+            files[rel_path] = f.read()
     return files
 
 
@@ -113,21 +282,93 @@ def _build_refine_prompt(prior_files: dict[str, str], original_task: str, feedba
     return "\n".join(p for p in parts if p is not None)
 
 
-async def main() -> None:
-    parser = argparse.ArgumentParser(description="Hive Mind — multi-agent coordinator")
-    parser.add_argument("--task", "-t", type=str, default=None,
-                        help="Run a single task non-interactively and exit")
-    parser.add_argument("--refine", type=str, default=None,
-                        help="Path to prior output dir to refine")
-    parser.add_argument("--feedback", type=str, default="",
-                        help="Specific improvement feedback for --refine mode")
-    args = parser.parse_args()
+async def _execute_refine(
+    echo: Echo,
+    prior_dir: str,
+    feedback: str,
+    run_dir: str,
+    deadline: float | None = None,
+) -> dict[str, str]:
+    """Regenerate only the files the feedback touches and carry every other file forward unchanged."""
+    prior_files = _load_prior_output(prior_dir)
+    original_task = read_goal(prior_dir)
+    manifest = read_manifest(prior_dir) or {}
+    edited = [
+        name for name, digest in manifest.items() if name in prior_files and content_hash(prior_files[name]) != digest
+    ]
+    if edited:
+        # Hand edits are kept as the new baseline and shown to the model like any other file
+        print(f"[Refine] 检测到手动修改的文件: {', '.join(edited)}")
+
+    trace = start_trace(os.path.basename(run_dir))
+    metrics = start_metrics(os.path.basename(run_dir))
+    status = "error"
+    async with TimelineWriter(os.path.join(run_dir, TIMELINE_FILE)) as timeline:
+        trace.listeners.append(timeline.write)
+        try:
+            with deadline_scope(deadline), span("Hive Mind", "refine", files=len(prior_files)):
+                updated = await echo.refine_files(original_task, prior_files, feedback)
+            unchanged = [name for name in prior_files if name not in updated]
+            record("Hive Mind", "增量 Refine", f"重新生成 {len(updated)} 个，沿用 {len(unchanged)} 个")
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            record("Hive Mind", RUN_FINISHED_EVENT, status)
+            await asyncio.to_thread(trace.export, run_dir)
+            await asyncio.to_thread(metrics.export, run_dir)
+            print_usage(metrics)
+    print(f"[Refine] 重新生成 {len(updated)} 个文件，沿用 {len(unchanged)} 个")
+    # write_file appends the trailing newline again; strip it so carried-forward files stay byte-identical
+    carried = {name: content.rstrip("\n") for name, content in prior_files.items()}
+    await asyncio.to_thread(write_outputs, original_task, "", run_dir, files={**carried, **updated})
+    return updated
+
 
-    echo = Echo()
+async def _run_mode(echo: Echo, args: argparse.Namespace) -> None:
+    if args.tail:
+        await _tail_timeline(args.tail)
+        return
+
+    if args.serve:
+        from server import serve
+
+        await serve(
+            echo,
+            host=args.host,
+            port=args.port,
+            max_inflight=args.max_inflight,
+            max_queue=args.max_queue,
+            drain_timeout=args.drain_timeout,
+            deadline=args.deadline,
+        )
+        return
+
+    if args.batch:
+        await _run_batch(
+            echo, args.batch, args.concurrency, summary_path=args.summary, stream=args.stream, deadline=args.deadline
+        )
+        return
+
+    if args.resume:
+        goal = read_goal(args.resume)
+        if not goal:
+            raise SystemExit(f"{args.resume} 中没有可恢复的任务（缺少 checkpoint.jsonl / task.txt）")
+        print(f"[Hive Mind] 断点续跑: {args.resume}")
+        result = await execute_run(echo, goal, args.resume, stream=args.stream, deadline=args.deadline, resume=True)
+        print(f"\nEcho > {result}\n")
+        return
 
     if args.task:
         print(f"[Hive Mind] 无人值守模式，任务: {args.task}")
-        await _run_once(echo, args.task)
+        await _run_once(echo, args.task, stream=args.stream, deadline=args.deadline)
+        return
+
+    if args.refine and not args.refine_all and read_manifest(args.refine) is not None:
+        print(f"[Hive Mind] 增量 Refine 模式，基于: {args.refine}")
+        run_dir = new_run_dir()
+        await _execute_refine(echo, args.refine, args.feedback, run_dir, deadline=args.deadline)
         return
 
     if args.refine:
@@ -136,19 +377,99 @@ async def main() -> None:
         original_task = open(task_file, encoding="utf-8").read().strip() if os.path.exists(task_file) else ""
         refine_prompt = _build_refine_prompt(prior_files, original_task, args.feedback)
         print(f"[Hive Mind] Refine 模式，基于: {args.refine}，载入 {len(prior_files)} 个文件")
-        await _run_once(echo, refine_prompt)
+        await _run_once(echo, refine_prompt, stream=args.stream, deadline=args.deadline)
         return
 
-    # Interactive REPL
-    print("Hive Mind 已启动。输入你的战略目标：")
-    while True:
-        human_input = input("Human > ").strip()
-        if human_input.lower() in ("exit", "quit"):
-            print("Hive Mind 已退出。")
-            break
-        if not human_input:
-            continue
-        await _run_once(echo, human_input)
+    await _interactive(echo, args)
+
+
+def _parse_duration(value: str) -> float | None:
+    """'90', '90s', '2m', '1.5h' -> seconds; empty or '0' disables the deadline."""
+    value = value.strip().lower()
+    if not value:
+        return None
+    scale = {"s": 1, "m": 60, "h": 3600}.get(value[-1])
+    try:
+        seconds = float(value[:-1] if scale else value) * (scale or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r}") from None
+    return seconds if seconds > 0 else None
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Hive Mind — multi-agent coordinator")
+    parser.add_argument("--task", "-t", type=str, default=None,
+                        help="Run a single task non-interactively and exit")
+    parser.add_argument("--refine", type=str, default=None,
+                        help="Path to prior output dir to refine")
+    parser.add_argument("--feedback", type=str, default="",
+                        help="Specific improvement feedback for --refine mode")
+    parser.add_argument("--refine-all", action="store_true",
+                        help="With --refine, have the whole team regenerate every file instead of only affected ones")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="Resume an interrupted run dir, re-running only stages without a checkpoint")
+    parser.add_argument("--tail", type=str, default=None,
+                        help="Follow the live timeline of a run dir (in progress or finished) and exit when it ends")
+    parser.add_argument("--batch", type=str, default=None,
+                        help="Run every goal in a JSONL file on one shared agent tree")
+    parser.add_argument("--concurrency", type=int, default=env_int("HIVEMIND_BATCH_CONCURRENCY", 4),
+                        help="Maximum goals running at once in --batch mode")
+    parser.add_argument("--summary", type=str, default=None,
+                        help="Summary JSONL path for --batch mode (default: <batch dir>/summary.jsonl)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Run as an HTTP service that accepts goals via POST /runs")
+    parser.add_argument("--host", type=str, default=os.getenv("HIVEMIND_HOST", "127.0.0.1"),
+                        help="Bind address for --serve")
+    parser.add_argument("--port", type=int, default=env_int("HIVEMIND_PORT", 8080),
+                        help="Port for --serve")
+    parser.add_argument("--max-inflight", type=int, default=env_int("HIVEMIND_MAX_INFLIGHT", 4),
+                        help="Runs executing at once in --serve mode")
+    parser.add_argument("--max-queue", type=int, default=env_int("HIVEMIND_MAX_QUEUE", 16),
+                        help="Runs allowed to wait for a slot before new requests get 429")
+    parser.add_argument("--drain-timeout", type=float, default=env_float("HIVEMIND_DRAIN_TIMEOUT", 60.0),
+                        help="Seconds to let in-flight runs finish on shutdown")
+    parser.add_argument("--deadline", type=_parse_duration, default=os.getenv("HIVEMIND_DEADLINE", ""),
+                        help="Wall-clock budget per run, e.g. 90s or 5m; late tracks are dropped from the merge")
+    parser.add_argument("--fan-out", action="store_true", default=env_flag("HIVEMIND_FAN_OUT"),
+                        help="Run each decomposed task as its own unit, following depends_on edges")
+    parser.add_argument("--per-file", action="store_true", default=env_flag("HIVEMIND_PER_FILE"),
+                        help="Plan the output files first, then generate each file in its own concurrent call")
+    parser.add_argument("--stream", action="store_true", default=env_flag("HIVEMIND_STREAM"),
+                        help="Stream the final synthesis and write each file as soon as it is complete")
+    parser.add_argument("--cache", action="store_true", default=env_flag("HIVEMIND_CACHE"),
+                        help="Reuse cached LLM responses for identical requests")
+    parser.add_argument("--adaptive-budget", action="store_true", default=env_flag("HIVEMIND_ADAPTIVE_BUDGET"),
+                        help="Size max_tokens per call site from its recorded output history; raise it after truncation")
+    parser.add_argument("--budget-history", type=str,
+                        default=os.getenv("HIVEMIND_BUDGET_HISTORY", DEFAULT_HISTORY_PATH),
+                        help="JSON file holding the per-call-site usage history for --adaptive-budget")
+    parser.add_argument("--cache-dir", type=str, default=os.getenv("HIVEMIND_CACHE_DIR", DEFAULT_CACHE_DIR),
+                        help="Directory for the on-disk response cache")
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache:
+        ttl = env_float("HIVEMIND_CACHE_TTL", 7 * 24 * 3600)
+        cache = ResponseCache(args.cache_dir, ttl=ttl if ttl > 0 else None)
+        set_response_cache(cache)
+    history = None
+    if args.adaptive_budget:
+        history = UsageHistory.from_env(args.budget_history)
+        set_usage_history(history)
+
+    echo = Echo(fan_out=args.fan_out, per_file=args.per_file)
+    try:
+        await _run_mode(echo, args)
+    finally:
+        # All agents share one pooled HTTP client; close it before the loop shuts down.
+        await aclose_shared_clients()
+        if cache is not None:
+            print(f"[缓存] 命中 {cache.hits} 次，未命中 {cache.misses} 次")
+            cache.close()
+            set_response_cache(None)
+        if history is not None:
+            history.save()
+            set_usage_history(None)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import json
+import os
+from contextvars import ContextVar
+from typing import Any
+
+# USD per million tokens: (input, output). Cache writes bill at 1.25x input, cache reads at 0.1x.
+# Override or extend with HIVEMIND_PRICING='{"claude-opus-4-6": [5, 25]}' (keys match as substrings).
+DEFAULT_PRICING: dict[str, tuple[float, float]] = {
+    "opus": (5.0, 25.0),
+    "sonnet": (3.0, 15.0),
+    "haiku": (1.0, 5.0),
+}
+CACHE_WRITE_MULTIPLIER = 1.25
+CACHE_READ_MULTIPLIER = 0.1
+
+TOKEN_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "thinking_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+
+def _pricing() -> dict[str, tuple[float, float]]:
+    pricing = dict(DEFAULT_PRICING)
+    raw = os.getenv("HIVEMIND_PRICING", "").strip()
+    if raw:
+        try:
+            pricing.update({key: (float(value[0]), float(value[1])) for key, value in json.loads(raw).items()})
+        except (ValueError, TypeError, IndexError, AttributeError):
+            pass
+    return pricing
+
+
+def estimate_cost(model: str, tokens: dict[str, int]) -> float:
+    pricing = _pricing()
+    # Longest matching key wins, so a full model id overrides its family default
+    matches = [key for key in pricing if key in model]
+    if not matches:
+        return 0.0
+    input_price, output_price = pricing[max(matches, key=len)]
+    # thinking_tokens are an estimate already billed inside output_tokens, so they are not added again
+    return (
+        tokens.get("input_tokens", 0) * input_price
+        + tokens.get("cache_creation_input_tokens", 0) * input_price * CACHE_WRITE_MULTIPLIER
+        + tokens.get("cache_read_input_tokens", 0) * input_price * CACHE_READ_MULTIPLIER
+        + tokens.get("output_tokens", 0) * output_price
+    ) / 1_000_000
+
+
+def _empty() -> dict[str, float]:
+    return {
+        "calls": 0,
+        "response_cache_hits": 0,
+        **{field: 0 for field in TOKEN_FIELDS},
+        "seconds": 0.0,
+        "cost_usd": 0.0,
+    }
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class UsageMetrics:
+    """Token, latency and cost totals keyed by agent and by model."""
+
+    def __init__(self, name: str = "run") -> None:
+        self.name = name
+        self.by_agent: dict[str, dict[str, float]] = {}
+        self.by_model: dict[str, dict[str, float]] = {}
+        # (agent, model) pairs, for labelled Prometheus series
+        self.by_pair: dict[tuple[str, str], dict[str, float]] = {}
+
+    def add(
+        self,
+        agent: str,
+        model: str,
+        tokens: dict[str, int],
+        seconds: float,
+        *,
+        cost: float | None = None,
+        response_cache_hit: bool = False,
+    ) -> float:
+        cost = estimate_cost(model, tokens) if cost is None else cost
+        for bucket in (
+            self.by_agent.setdefault(agent, _empty()),
+            self.by_model.setdefault(model, _empty()),
+            self.by_pair.setdefault((agent, model), _empty()),
+        ):
+            bucket["calls"] += 1
+            bucket["response_cache_hits"] += int(response_cache_hit)
+            for field in TOKEN_FIELDS:
+                bucket[field] += tokens.get(field, 0)
+            bucket["seconds"] += seconds
+            bucket["cost_usd"] += cost
+        return cost
+
+    def totals(self) -> dict[str, float]:
+        total = _empty()
+        for bucket in self.by_model.values():
+            for field, value in bucket.items():
+                total[field] += value
+        return total
+
+    @staticmethod
+    def _report(bucket: dict[str, float]) -> dict[str, float]:
+        report = dict(bucket)
+        report["seconds"] = round(bucket["seconds"], 3)
+        report["cost_usd"] = round(bucket["cost_usd"], 6)
+        report["output_tokens_per_second"] = (
+            round(bucket["output_tokens"] / bucket["seconds"], 1) if bucket["seconds"] else 0.0
+        )
+        return report
+
+    def to_json(self) -> dict[str, Any]:
+        by_agent = sorted(self.by_agent.items(), key=lambda item: item[1]["cost_usd"], reverse=True)
+        return {
+            "name": self.name,
+            "total": self._report(self.totals()),
+            "by_agent": {agent: self._report(bucket) for agent, bucket in by_agent},
+            "by_model": {model: self._report(bucket) for model, bucket in self.by_model.items()},
+        }
+
+    def export(self, run_dir: str) -> None:
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, "metrics.json"), "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix: str = "hivemind_llm") -> str:
+        """Prometheus text exposition (counters) labelled by agent and model."""
+
+        def labels(agent: str, model: str, **extra: str) -> str:
+            pairs = {"agent": agent, "model": model, **extra}
+            return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in pairs.items()) + "}"
+
+        lines = [
+            f"# HELP {prefix}_calls_total LLM calls.",
+            f"# TYPE {prefix}_calls_total counter",
+        ]
+        lines += [f"{prefix}_calls_total{labels(a, m)} {b['calls']}" for (a, m), b in self.by_pair.items()]
+        lines += [
+            f"# HELP {prefix}_tokens_total Tokens by kind (thinking is estimated and included in output).",
+            f"# TYPE {prefix}_tokens_total counter",
+        ]
+        for (agent, model), bucket in self.by_pair.items():
+            for field in TOKEN_FIELDS:
+                kind = field.removesuffix("_tokens").removesuffix("_input")
+                lines.append(f"{prefix}_tokens_total{labels(agent, model, kind=kind)} {bucket[field]}")
+        lines += [
+            f"# HELP {prefix}_seconds_total Wall-clock seconds spent waiting on responses.",
+            f"# TYPE {prefix}_seconds_total counter",
+        ]
+        lines += [
+            f"{prefix}_seconds_total{labels(a, m)} {round(b['seconds'], 3)}" for (a, m), b in self.by_pair.items()
+        ]
+        lines += [
+            f"# HELP {prefix}_cost_usd_total Estimated spend in USD.",
+            f"# TYPE {prefix}_cost_usd_total counter",
+        ]
+        lines += [
+            f"{prefix}_cost_usd_total{labels(a, m)} {round(b['cost_usd'], 6)}" for (a, m), b in self.by_pair.items()
+        ]
+        return "\n".join(lines) + "\n"
+
+
+_CURRENT_METRICS: ContextVar[UsageMetrics | None] = ContextVar("hivemind_metrics", default=None)
+# Cumulative across every run in the process; what a service scrapes at /metrics
+_PROCESS_METRICS = UsageMetrics("process")
+
+
+def start_metrics(name: str = "run") -> UsageMetrics:
+    metrics = UsageMetrics(name)
+    _CURRENT_METRICS.set(metrics)
+    return metrics
+
+
+def process_metrics() -> UsageMetrics:
+    return _PROCESS_METRICS
+
+
+def record_usage(
+    agent: str,
+    model: str,
+    tokens: dict[str, int],
+    seconds: float,
+    *,
+    response_cache_hit: bool = False,
+) -> float:
+    """Add one call to the current run and to the process totals; returns its estimated cost."""
+    cost = _PROCESS_METRICS.add(agent, model, tokens, seconds, response_cache_hit=response_cache_hit)
+    run_metrics = _CURRENT_METRICS.get()
+    if run_metrics is not None:
+        run_metrics.add(agent, model, tokens, seconds, cost=cost, response_cache_hit=response_cache_hit)
+    return cost
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from clients import api_error_types
+from config import env_flag, env_float, env_int
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter that honours retry-after and a total time budget."""
+
+    RETRYABLE_STATUS = {408, 409, 429, 529}
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 2.0,
+        max_delay: float = 30.0,
+        budget: float = 180.0,
+    ) -> None:
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        return cls(
+            max_attempts=env_int("HIVEMIND_RETRY_ATTEMPTS", 3),
+            base_delay=env_float("HIVEMIND_RETRY_BASE_DELAY", 2.0),
+            max_delay=env_float("HIVEMIND_RETRY_MAX_DELAY", 30.0),
+            budget=env_float("HIVEMIND_RETRY_BUDGET", 180.0),
+        )
+
+    def is_retryable(self, exc: Exception) -> bool:
+        connection_error, status_error, timeout_error = api_error_types()
+        if isinstance(exc, (timeout_error, connection_error)):
+            return True
+        status = getattr(exc, "status_code", None)
+        return isinstance(exc, status_error) and isinstance(status, int) and (
+            status >= 500 or status in self.RETRYABLE_STATUS
+        )
+
+    @staticmethod
+    def retry_after(exc: Exception) -> float | None:
+        headers = getattr(getattr(exc, "response", None), "headers", None)
+        if not headers:
+            return None
+        retry_after_ms = headers.get("retry-after-ms")
+        if retry_after_ms:
+            try:
+                return float(retry_after_ms) / 1000
+            except ValueError:
+                pass
+        retry_after = headers.get("retry-after")
+        if not retry_after:
+            return None
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+        try:
+            return parsedate_to_datetime(retry_after).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, attempt: int, exc: Exception) -> float:
+        hinted = self.retry_after(exc)
+        if hinted is not None:
+            return min(max(hinted, 0.0), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class LatencyTracker:
+    """Recent call latencies per model; their percentile is the hedge threshold."""
+
+    def __init__(self, window: int = 200) -> None:
+        self.window = window
+        self._samples: dict[str, deque[float]] = {}
+
+    def observe(self, model: str, seconds: float) -> None:
+        self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, model: str, percentile: float, min_samples: int = 1) -> float | None:
+        samples = self._samples.get(model)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, max(0, round(percentile / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+_LATENCY = LatencyTracker()
+_HEDGE_STATS = {"fired": 0, "won": 0}
+
+
+def get_latency_tracker() -> LatencyTracker:
+    return _LATENCY
+
+
+def count_hedge(won: bool = False) -> dict[str, int]:
+    """Count one duplicate request sent (or, with won=True, one that beat the primary); returns the totals."""
+    _HEDGE_STATS["won" if won else "fired"] += 1
+    return dict(_HEDGE_STATS)
+
+
+def get_hedge_stats() -> dict[str, int]:
+    return dict(_HEDGE_STATS)
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, model: str, retry_in: float) -> None:
+        super().__init__(f"circuit open for {model}; next probe in {retry_in:.0f}s")
+        self.model = model
+        self.retry_in = retry_in
+
+
+# Token for calls let through while the breaker is closed; only a probe's own token can close it
+_CLOSED_CALL = object()
+
+
+class CircuitBreaker:
+    """Closed -> open -> half-open breaker over a model's most recent calls.
+
+    A call fails when it ends in an outage error (5xx/529, timeout, connection) or runs longer
+    than ``slow_call`` seconds. Once ``min_calls`` outcomes are in the window and the failure
+    rate reaches ``failure_rate`` the breaker opens; after ``cooldown`` seconds a single probe
+    call is let through, and its outcome closes the breaker or opens it again. A probe that ends
+    any other way (429, cancellation, deadline) is released so the next call can probe.
+    """
+
+    def __init__(
+        self,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        slow_call: float = 100.0,
+        cooldown: float = 30.0,
+    ) -> None:
+        self.min_calls = max(1, min_calls)
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.reason = ""
+        self._outcomes: deque[bool] = deque(maxlen=max(window, self.min_calls))
+        self._opened_at: float | None = None
+        self._probe: object | None = None
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(
+            window=env_int("HIVEMIND_BREAKER_WINDOW", 20),
+            min_calls=env_int("HIVEMIND_BREAKER_MIN_CALLS", 5),
+            failure_rate=env_float("HIVEMIND_BREAKER_FAILURE_RATE", 0.5),
+            slow_call=env_float("HIVEMIND_BREAKER_SLOW_CALL", 100.0),
+            cooldown=env_float("HIVEMIND_BREAKER_COOLDOWN", 30.0),
+        )
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self.retry_in() <= 0 else "open"
+
+    def retry_in(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def allow(self) -> object | None:
+        """None when the call must not go out; otherwise a token to pass to record() and release()."""
+        state = self.state
+        if state == "closed":
+            return _CLOSED_CALL
+        if state == "half_open" and self._probe is None:
+            self._probe = object()
+            return self._probe
+        return None
+
+    def release(self, token: object | None) -> None:
+        """Give back a probe that ended without an outcome, so a later call can probe instead."""
+        if token is not None and token is self._probe:
+            self._probe = None
+
+    def record(self, ok: bool, seconds: float, token: object | None = _CLOSED_CALL) -> bool:
+        """Add one outcome; True when it opened (or re-opened) the breaker."""
+        failed = not ok or seconds > self.slow_call
+        if self._opened_at is not None:
+            # Calls still in flight when the breaker opened are ignored; only the probe decides
+            if token is None or token is not self._probe:
+                return False
+            self._probe = None
+            if failed:
+                self.reason = "探测失败" if not ok else f"探测耗时 {seconds:.1f}s"
+                self._opened_at = time.monotonic()
+                return True
+            self._opened_at = None
+            self._outcomes.clear()
+            return False
+
+        self._outcomes.append(failed)
+        failures = sum(self._outcomes)
+        if len(self._outcomes) < self.min_calls or failures / len(self._outcomes) < self.failure_rate:
+            return False
+        self.reason = f"最近 {len(self._outcomes)} 次调用失败 {failures} 次"
+        self._opened_at = time.monotonic()
+        return True
+
+
+def is_outage(exc: Exception) -> bool:
+    # 429 is our own quota, not the model degrading, so it never trips a breaker
+    connection_error, status_error, timeout_error = api_error_types()
+    if isinstance(exc, (timeout_error, connection_error)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return isinstance(exc, status_error) and isinstance(status, int) and status >= 500
+
+
+_BREAKERS: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(model: str) -> CircuitBreaker | None:
+    """The model's process-wide breaker; None when HIVEMIND_BREAKER=0."""
+    if not env_flag("HIVEMIND_BREAKER", True):
+        return None
+    breaker = _BREAKERS.get(model)
+    if breaker is None:
+        breaker = _BREAKERS[model] = CircuitBreaker.from_env()
+    return breaker
+
+
+def get_breaker_states() -> dict[str, str]:
+    return {model: breaker.state for model, breaker in _BREAKERS.items()}
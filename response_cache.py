@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from config import DEFAULT_CACHE_DIR
+
+
+class ResponseCache:
+    """Two-tier LLM response cache: in-memory LRU in front of a sqlite file.
+
+    Agents use aget()/aput(), which serve the memory tier inline and run the sqlite I/O in a
+    worker thread so it never blocks the event loop.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_CACHE_DIR,
+        *,
+        max_memory_entries: int = 256,
+        max_disk_entries: int = 5000,
+        ttl: float | None = 7 * 24 * 3600,
+    ) -> None:
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        # Disk access happens on worker threads; one connection, used by one thread at a time
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(payload: dict[str, Any]) -> str:
+        # max_tokens is left out: it shifts with --adaptive-budget, and only complete replies are stored
+        canonical = json.dumps(
+            {field: value for field, value in payload.items() if field != "max_tokens"},
+            sort_keys=True,
+            ensure_ascii=False,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.directory, "responses.sqlite3"), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        return self._db
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def _remember(self, key: str, created: float, value: str) -> None:
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _recall(self, key: str, now: float) -> str | None:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        created, value = entry
+        if self._expired(created, now):
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    def _load(self, key: str, now: float) -> tuple[str, float] | None:
+        with self._lock:
+            db = self._conn()
+            row = db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if self._expired(created, now):
+                db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+            return value, created
+
+    def _admit(self, key: str, value: str | None, row: tuple[str, float] | None) -> str | None:
+        # Runs on the caller's thread, so the LRU and counters are never touched from a worker
+        if value is None and row is not None:
+            value, created = row
+            self._remember(key, created, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        value = self._recall(key, now)
+        return self._admit(key, value, self._load(key, now) if value is None else None)
+
+    async def aget(self, key: str) -> str | None:
+        now = time.time()
+        value = self._recall(key, now)
+        row = await asyncio.to_thread(self._load, key, now) if value is None else None
+        return self._admit(key, value, row)
+
+    def _recent(self) -> list[tuple[str, str, float]]:
+        with self._lock:
+            return self._conn().execute(
+                "SELECT key, value, created FROM responses ORDER BY accessed DESC LIMIT ?", (self.max_memory_entries,)
+            ).fetchall()
+
+    def preload(self) -> int:
+        """Open the sqlite file and pull the most recently used entries into memory; returns how many."""
+        return self._warm(self._recent())
+
+    async def apreload(self) -> int:
+        return self._warm(await asyncio.to_thread(self._recent))
+
+    def _warm(self, rows: list[tuple[str, str, float]]) -> int:
+        now = time.time()
+        # Oldest first, so the most recently used entry ends up at the hot end of the LRU
+        loaded = 0
+        for key, value, created in reversed(rows):
+            if not self._expired(created, now):
+                self._remember(key, created, value)
+                loaded += 1
+        return loaded
+
+    def _write(self, key: str, value: str, now: float) -> None:
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.ttl is not None:
+                db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            # Evict least-recently-used rows beyond the disk budget
+            db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,),
+            )
+            db.commit()
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        self._remember(key, now, value)
+        self._write(key, value, now)
+
+    async def aput(self, key: str, value: str) -> None:
+        now = time.time()
+        self._remember(key, now, value)
+        await asyncio.to_thread(self._write, key, value, now)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
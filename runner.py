@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Callable
+
+from base_agent import get_usage_history
+from checkpoint import Checkpoint, checkpoint_scope
+from deadlines import deadline_scope
+from echo import Echo
+from metrics import UsageMetrics, start_metrics
+from tracing import TIMELINE_FILE, TimelineWriter, get_timeline, read_timeline, record, span, start_trace
+
+
+def split_files(result: str) -> dict[str, str]:
+    """Parse '=== FILE: name ===' delimiters into separate file contents."""
+    files: dict[str, str] = {}
+    current_name: str | None = None
+    current_lines: list[str] = []
+
+    for line in result.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("=== FILE:") and stripped.endswith("==="):
+            if current_name is not None:
+                files[current_name] = "\n".join(current_lines).strip()
+            current_name = stripped[9:-3].strip()
+            current_lines = []
+        else:
+            if current_name is not None:
+                current_lines.append(line)
+
+    if current_name is not None:
+        files[current_name] = "\n".join(current_lines).strip()
+
+    return files
+
+
+class StreamingFileSplitter:
+    """Incremental split_files: writes each file to run_dir as soon as its section closes."""
+
+    def __init__(self, run_dir: str) -> None:
+        self.run_dir = run_dir
+        self.written: list[str] = []
+        self._pending = ""
+        self._current_name: str | None = None
+        self._current_lines: list[str] = []
+
+    def feed(self, chunk: str) -> None:
+        self._pending += chunk
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._handle_line(line.rstrip("\r"))
+
+    def close(self) -> None:
+        if self._pending:
+            self._handle_line(self._pending.rstrip("\r"))
+            self._pending = ""
+        self._flush()
+        self._current_name = None
+
+    def _handle_line(self, line: str) -> None:
+        stripped = line.strip()
+        if stripped.startswith("=== FILE:") and stripped.endswith("==="):
+            self._flush()
+            self._current_name = stripped[9:-3].strip()
+            self._current_lines = []
+        elif self._current_name is not None:
+            self._current_lines.append(line)
+
+    def _flush(self) -> None:
+        if self._current_name is None:
+            return
+        write_file(self.run_dir, self._current_name, "\n".join(self._current_lines).strip())
+        if self._current_name not in self.written:
+            self.written.append(self._current_name)
+        print(f"[输出] {self._current_name} 已写入")
+        self._current_lines = []
+
+
+def write_file(run_dir: str, filename: str, content: str) -> None:
+    # Support subdirectories like .github/ISSUE_TEMPLATE/bug_report.yml
+    filepath = os.path.join(run_dir, filename)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "w", encoding="utf-8") as f:
+        f.write(content + "\n")
+
+
+MANIFEST_FILE = "manifest.json"
+# Run metadata that is never part of the deliverable
+METADATA_FILES = {
+    "timeline.md",
+    TIMELINE_FILE,
+    "task.txt",
+    "trace.json",
+    "trace.chrome.json",
+    "checkpoint.jsonl",
+    "metrics.json",
+    MANIFEST_FILE,
+}
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def write_manifest(run_dir: str, filenames: list[str]) -> None:
+    """Record the sha256 of every output file so a later --refine can tell outputs and hand edits apart."""
+    hashes: dict[str, str] = {}
+    for filename in filenames:
+        with open(os.path.join(run_dir, filename), encoding="utf-8") as f:
+            hashes[filename] = content_hash(f.read())
+    with open(os.path.join(run_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"files": hashes}, f, ensure_ascii=False, indent=2)
+
+
+def read_manifest(run_dir: str) -> dict[str, str] | None:
+    path = os.path.join(run_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("files", {})
+
+
+def write_outputs(
+    human_input: str,
+    result: str,
+    run_dir: str,
+    streamed_files: list[str] | None = None,
+    files: dict[str, str] | None = None,
+) -> None:
+    os.makedirs(run_dir, exist_ok=True)
+
+    # Try to split into named files; fall back to single result.md
+    if files is None:
+        files = {} if streamed_files else split_files(result)
+    if streamed_files:
+        written = list(streamed_files)
+        print(f"[输出] 已流式保存 {len(streamed_files)} 个文件到 {run_dir}/")
+    elif files:
+        for filename, content in files.items():
+            write_file(run_dir, filename, content)
+        written = list(files)
+        print(f"[输出] 已保存 {len(files)} 个文件到 {run_dir}/")
+    else:
+        with open(os.path.join(run_dir, "result.md"), "w", encoding="utf-8") as f:
+            f.write(f"# 任务输出\n\n**输入**: {human_input}\n\n---\n\n{result}\n")
+        written = ["result.md"]
+        print(f"[输出] result.md 已保存到 {run_dir}/")
+    write_manifest(run_dir, written)
+
+    # Always write timeline and original task; the streamed JSONL also keeps events recorded before a resume
+    timeline = read_timeline(run_dir)
+    if timeline is None:
+        timeline = get_timeline()
+    lines = [
+        "# Hive Mind 行动时间线\n",
+        f"**任务**: {human_input}\n",
+        f"**时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
+        "\n| 耗时(s) | Agent | 事件 | 备注 |\n",
+        "|---------|-------|------|------|\n",
+    ]
+    for e in timeline:
+        detail = e["detail"].replace("|", "\\|") if e["detail"] else ""
+        lines.append(f"| +{e['t']} | {e['agent']} | {e['event']} | {detail} |\n")
+    with open(os.path.join(run_dir, "timeline.md"), "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    with open(os.path.join(run_dir, "task.txt"), "w", encoding="utf-8") as f:
+        f.write(human_input)
+
+
+# Last event of every run; --tail stops following once it sees it
+RUN_FINISHED_EVENT = "运行结束"
+
+
+def print_usage(metrics: UsageMetrics) -> None:
+    total = metrics.totals()
+    if not total["calls"]:
+        return
+    print(
+        f"[用量] {int(total['calls'])} 次调用，输入 {int(total['input_tokens'])} / 输出 {int(total['output_tokens'])} tokens，"
+        f"估算 ${total['cost_usd']:.4f}"
+    )
+
+
+async def execute_run(
+    echo: Echo,
+    human_input: str,
+    run_dir: str,
+    stream: bool = False,
+    on_event: Callable[[dict], None] | None = None,
+    deadline: float | None = None,
+    resume: bool = False,
+) -> str:
+    # Each run gets its own trace; concurrent runs (batch/serve) live in separate tasks and don't mix
+    trace = start_trace(os.path.basename(run_dir))
+    metrics = start_metrics(os.path.basename(run_dir))
+    if on_event is not None:
+        trace.listeners.append(on_event)
+    checkpoint = Checkpoint(run_dir, human_input, resume=resume)
+    streamed_files = None
+    status = "error"
+    # A resumed run appends, so the timeline keeps the events of the interrupted attempt
+    async with TimelineWriter(os.path.join(run_dir, TIMELINE_FILE), append=resume) as timeline:
+        trace.listeners.append(timeline.write)
+        if resume:
+            record("Hive Mind", "断点续跑", f"已有 {len(checkpoint.stages)} 个完成阶段")
+        try:
+            with (
+                checkpoint_scope(checkpoint),
+                deadline_scope(deadline),
+                span("Hive Mind", "run", goal=human_input[:120]),
+            ):
+                if stream:
+                    splitter = StreamingFileSplitter(run_dir)
+                    result = await echo.coordinate(human_input, on_text=splitter.feed)
+                    splitter.close()
+                    streamed_files = splitter.written
+                else:
+                    result = await echo.coordinate(human_input)
+            status = "done"
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            record("Hive Mind", RUN_FINISHED_EVENT, status)
+            # File writes go to a worker thread so other runs on this loop (batch/serve) keep going
+            await asyncio.to_thread(trace.export, run_dir)
+            await asyncio.to_thread(metrics.export, run_dir)
+            print_usage(metrics)
+            # Persist learned budgets per run, so a long --serve process doesn't lose them on a crash
+            history = get_usage_history()
+            if history is not None:
+                await history.asave()
+    if checkpoint.reused:
+        print(f"[断点] 复用 {checkpoint.reused} 个已完成阶段")
+    await asyncio.to_thread(write_outputs, human_input, result, run_dir, streamed_files=streamed_files)
+    return result
+
+
+def new_run_dir() -> str:
+    """outputs/<timestamp>, with a numeric suffix when another run already claimed this second."""
+    base = os.path.join("outputs", datetime.now().strftime("%Y%m%d_%H%M%S"))
+    run_dir = base
+    for suffix in range(2, 1000):
+        try:
+            os.makedirs(run_dir)
+            return run_dir
+        except FileExistsError:
+            run_dir = f"{base}_{suffix}"
+    raise RuntimeError(f"too many runs started in the same second: {base}")
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable
+
+from config import env_float, env_int
+
+PRIORITY_RANK = {"high": 0, "medium": 1, "low": 2}
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 bytes per token for Latin text; CJK is 3 bytes per char, close to one token each
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def has(self, amount: float) -> bool:
+        self._refill()
+        return self.available >= min(float(amount), self.capacity)
+
+    async def take(self, amount: float) -> None:
+        amount = min(float(amount), self.capacity)
+        while True:
+            self._refill()
+            if self.available >= amount:
+                self.available -= amount
+                return
+            await asyncio.sleep((amount - self.available) / self.rate)
+
+
+class _ModelLane:
+    def __init__(self, concurrency: int, rpm: float, tpm: float) -> None:
+        self.concurrency = max(1, concurrency)
+        self.active = 0
+        self.requests = _TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = _TokenBucket(tpm) if tpm > 0 else None
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    async def acquire(self, rank: int) -> None:
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (rank, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation landed
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def try_acquire(self) -> bool:
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            return True
+        return False
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)  # hand the slot straight to the next waiter
+                return
+        self.active -= 1
+
+
+class LLMScheduler:
+    """Per-model concurrency caps and request/token rate limits shared by every agent.
+
+    Queued calls are served by priority (high → medium → low), FIFO within a priority.
+    ``limits`` maps a model-name substring (e.g. ``"haiku"``) to ``concurrency``/``rpm``/``tpm``;
+    ``tpm`` is metered on estimated input tokens. Unmatched models use the HIVEMIND_LLM_* env defaults.
+    """
+
+    def __init__(self, limits: dict[str, dict[str, float]] | None = None) -> None:
+        self.limits = dict(limits or {})
+        self._lanes: dict[str, _ModelLane] = {}
+
+    def _limits_for(self, model: str) -> dict[str, float]:
+        defaults = {
+            "concurrency": env_int("HIVEMIND_LLM_CONCURRENCY", 8),
+            "rpm": env_float("HIVEMIND_LLM_RPM", 0),
+            "tpm": env_float("HIVEMIND_LLM_TPM", 0),
+        }
+        for pattern, limits in self.limits.items():
+            if pattern in model:
+                return {**defaults, **limits}
+        return defaults
+
+    def _lane(self, model: str) -> _ModelLane:
+        lane = self._lanes.get(model)
+        if lane is None:
+            limits = self._limits_for(model)
+            lane = _ModelLane(int(limits["concurrency"]), limits["rpm"], limits["tpm"])
+            self._lanes[model] = lane
+        return lane
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: str = "medium", tokens: int = 0) -> AsyncIterator[None]:
+        lane = self._lane(model)
+        await lane.acquire(PRIORITY_RANK.get(priority, PRIORITY_RANK["medium"]))
+        try:
+            if lane.requests:
+                await lane.requests.take(1)
+            if lane.tokens and tokens:
+                await lane.tokens.take(tokens)
+            yield
+        finally:
+            lane.release()
+
+    def try_slot(self, model: str, tokens: int = 0) -> Callable[[], None] | None:
+        """Take a slot only if one is free right now, rpm/tpm included; returns its release callback."""
+        lane = self._lane(model)
+        if lane.requests and not lane.requests.has(1):
+            return None
+        if lane.tokens and tokens and not lane.tokens.has(tokens):
+            return None
+        if not lane.try_acquire():
+            return None
+        if lane.requests:
+            lane.requests.available -= 1
+        if lane.tokens and tokens:
+            lane.tokens.available -= min(float(tokens), lane.tokens.capacity)
+        return lane.release
+
+
+_SCHEDULER = LLMScheduler()
+
+
+def configure_scheduler(limits: dict[str, dict[str, float]] | None = None) -> LLMScheduler:
+    global _SCHEDULER
+    _SCHEDULER = LLMScheduler(limits)
+    return _SCHEDULER
+
+
+def get_scheduler() -> LLMScheduler:
+    return _SCHEDULER
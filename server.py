@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import signal
+import uuid
+from datetime import datetime
+from typing import Any, Callable
+from urllib.parse import parse_qs, urlsplit
+
+from echo import Echo
+from metrics import process_metrics
+from resilience import get_breaker_states
+from runner import execute_run, split_files
+
+_BREAKER_GAUGE = {"closed": 0, "half_open": 0.5, "open": 1}
+
+_MAX_BODY_BYTES = 1024 * 1024
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class HiveMindServer:
+    """Minimal asyncio HTTP/1.1 front end that runs goals concurrently on one warm Echo tree.
+
+    POST /runs {"goal": "..."} returns the run's files as JSON; with ``Accept: text/event-stream``
+    or ``?stream=1`` it streams timeline events as server-sent events and ends with a ``result`` event.
+    GET /healthz reports load and GET /metrics exposes token/cost counters in Prometheus text format.
+    Admission is capped at ``max_inflight`` running plus ``max_queue`` waiting.
+    """
+
+    def __init__(
+        self,
+        echo: Echo,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        max_inflight: int = 4,
+        max_queue: int = 16,
+        drain_timeout: float = 60.0,
+        output_root: str = os.path.join("outputs", "serve"),
+        deadline: float | None = None,
+    ) -> None:
+        self.echo = echo
+        self.host = host
+        self.port = port
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self.drain_timeout = drain_timeout
+        self.output_root = output_root
+        self.deadline = deadline
+        self.active = 0
+        self.waiting = 0
+        self.draining = False
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._handlers: set[asyncio.Task] = set()
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        sockets = self._server.sockets or []
+        if sockets:
+            self.port = sockets[0].getsockname()[1]
+        print(f"[Hive Mind] 服务已启动: http://{self.host}:{self.port} (max_inflight={self.max_inflight})")
+
+    async def drain(self) -> None:
+        """Stop accepting connections and give in-flight runs drain_timeout seconds to finish."""
+        self.draining = True
+        if self._server is not None:
+            self._server.close()
+        pending = {task for task in self._handlers if not task.done()}
+        if pending:
+            print(f"[Hive Mind] 等待 {len(pending)} 个请求完成...")
+            _, still_running = await asyncio.wait(pending, timeout=self.drain_timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                await asyncio.wait(still_running)
+        print("[Hive Mind] 服务已停止。")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        if task is not None:
+            self._handlers.add(task)
+        try:
+            method, target, headers, body = await self._read_request(reader)
+            url = urlsplit(target)
+            if url.path == "/healthz":
+                await self._send_json(writer, 200, self._health())
+            elif url.path == "/metrics":
+                await self._send_body(writer, 200, self._metrics().encode("utf-8"), "text/plain; version=0.0.4")
+            elif url.path == "/runs":
+                if method != "POST":
+                    raise _HTTPError(405, "use POST")
+                stream = (
+                    "text/event-stream" in headers.get("accept", "")
+                    or parse_qs(url.query).get("stream", ["0"])[0] in {"1", "true"}
+                )
+                await self._handle_run(writer, self._parse_goal(body), stream)
+            else:
+                raise _HTTPError(404, f"no route for {url.path}")
+        except _HTTPError as exc:
+            await self._send_json(writer, exc.status, {"error": str(exc)}, retry_after=exc.status in {429, 503})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as exc:  # noqa: BLE001
+            # A bug in one request must not kill the connection without a response
+            await self._send_json(writer, 500, {"error": f"{exc.__class__.__name__}: {exc}"})
+        finally:
+            if task is not None:
+                self._handlers.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes]:
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise _HTTPError(400, "malformed request line")
+        headers: dict[str, str] = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        raw_length = headers.get("content-length", "") or "0"
+        if not (raw_length.isascii() and raw_length.isdigit()):
+            raise _HTTPError(400, f"invalid Content-Length: {raw_length!r}")
+        length = int(raw_length)
+        if length > _MAX_BODY_BYTES:
+            raise _HTTPError(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        return parts[0].upper(), parts[1], headers, body
+
+    @staticmethod
+    def _parse_goal(body: bytes) -> str:
+        try:
+            payload = json.loads(body.decode("utf-8") or "{}")
+        except (UnicodeDecodeError, json.JSONDecodeError) as exc:
+            raise _HTTPError(400, f"invalid JSON body: {exc}") from exc
+        goal = str(payload.get("goal", "")).strip() if isinstance(payload, dict) else ""
+        if not goal:
+            raise _HTTPError(400, "missing 'goal'")
+        return goal
+
+    def _health(self) -> dict[str, Any]:
+        return {
+            "status": "draining" if self.draining else "ok",
+            "inflight": self.active,
+            "queued": self.waiting,
+            "max_inflight": self.max_inflight,
+        }
+
+    def _metrics(self) -> str:
+        gauges = [
+            "# HELP hivemind_runs_inflight Runs currently executing.",
+            "# TYPE hivemind_runs_inflight gauge",
+            f"hivemind_runs_inflight {self.active}",
+            "# HELP hivemind_runs_queued Runs waiting for a slot.",
+            "# TYPE hivemind_runs_queued gauge",
+            f"hivemind_runs_queued {self.waiting}",
+            "# HELP hivemind_circuit_open Model circuit breaker state (0 closed, 0.5 half-open, 1 open).",
+            "# TYPE hivemind_circuit_open gauge",
+        ]
+        gauges += [
+            f'hivemind_circuit_open{{model="{model}"}} {_BREAKER_GAUGE[state]}'
+            for model, state in get_breaker_states().items()
+        ]
+        return "\n".join(gauges) + "\n" + process_metrics().to_prometheus()
+
+    def _admit(self) -> Callable[[], None]:
+        """Reserve a queue spot right away and return its (idempotent) release.
+
+        A streamed run only reaches _run after the response headers are written, so counting it as waiting
+        there would let concurrent requests slip past max_queue in between.
+        """
+        if self.draining:
+            raise _HTTPError(503, "server is draining")
+        if self.active >= self.max_inflight and self.waiting >= self.max_queue:
+            raise _HTTPError(429, "too many runs in flight")
+        self.waiting += 1
+        reserved = True
+
+        def unqueue() -> None:
+            nonlocal reserved
+            if reserved:
+                reserved = False
+                self.waiting -= 1
+
+        return unqueue
+
+    async def _run(
+        self, goal: str, run_dir: str, unqueue: Callable[[], None], on_event: Any = None
+    ) -> dict[str, Any]:
+        try:
+            await self._slots.acquire()
+        finally:
+            unqueue()
+        self.active += 1
+        try:
+            result = await execute_run(self.echo, goal, run_dir, on_event=on_event, deadline=self.deadline)
+            return {"status": "done", "run_dir": run_dir, "files": split_files(result), "result": result}
+        except Exception as exc:  # noqa: BLE001
+            return {"status": "error", "run_dir": run_dir, "error": f"{exc.__class__.__name__}: {exc}"}
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    async def _handle_run(self, writer: asyncio.StreamWriter, goal: str, stream: bool) -> None:
+        unqueue = self._admit()
+        try:
+            await self._dispatch_run(writer, goal, stream, unqueue)
+        finally:
+            # Covers a streamed run task cancelled before it ever started
+            unqueue()
+
+    async def _dispatch_run(
+        self, writer: asyncio.StreamWriter, goal: str, stream: bool, unqueue: Callable[[], None]
+    ) -> None:
+        run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        run_dir = os.path.join(self.output_root, run_id)
+
+        if not stream:
+            outcome = await self._run(goal, run_dir, unqueue)
+            await self._send_json(writer, 200 if outcome["status"] == "done" else 500, {"run_id": run_id, **outcome})
+            return
+
+        events: asyncio.Queue[tuple[str, Any] | None] = asyncio.Queue()
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: text/event-stream; charset=utf-8\r\n"
+            b"Cache-Control: no-cache\r\n"
+            b"Connection: close\r\n\r\n"
+        )
+        run_task = asyncio.create_task(
+            self._run(goal, run_dir, unqueue, on_event=lambda e: events.put_nowait(("timeline", e)))
+        )
+        run_task.add_done_callback(lambda done: events.put_nowait(None if done.cancelled() else ("result", done.result())))
+        try:
+            await self._send_event(writer, "accepted", {"run_id": run_id, "run_dir": run_dir})
+            while (item := await events.get()) is not None:
+                name, data = item
+                await self._send_event(writer, name, {"run_id": run_id, **data} if name == "result" else data)
+                if name == "result":
+                    break
+        except ConnectionError:
+            # Client went away: stop paying for a run nobody will read
+            run_task.cancel()
+            raise
+        finally:
+            if not run_task.done():
+                await asyncio.wait({run_task})
+
+    @staticmethod
+    async def _send_event(writer: asyncio.StreamWriter, name: str, data: Any) -> None:
+        writer.write(f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await writer.drain()
+
+    @staticmethod
+    async def _send_json(
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: dict[str, Any],
+        retry_after: bool = False,
+    ) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await HiveMindServer._send_body(writer, status, body, "application/json", retry_after=retry_after)
+
+    @staticmethod
+    async def _send_body(
+        writer: asyncio.StreamWriter,
+        status: int,
+        body: bytes,
+        content_type: str,
+        retry_after: bool = False,
+    ) -> None:
+        head = [
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}",
+            f"Content-Type: {content_type}; charset=utf-8",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ]
+        if retry_after:
+            head.append("Retry-After: 5")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+async def serve(echo: Echo, **options: Any) -> None:
+    server = HiveMindServer(echo, **options)
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows: Ctrl+C cancels the main task instead
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await server.drain()
@@ -1,7 +1,40 @@
 ﻿import asyncio
+from types import SimpleNamespace
 
+import base_agent
+import clients
+import deadlines
+import resilience
+import scheduler
+from base_agent import BaseAgent
 from echo import Echo
 from henry import Henry
+from response_cache import ResponseCache
+import tracing
+
+
+class FakeMessages:
+    def __init__(self, reply: str = "ok") -> None:
+        self.reply = reply
+        self.calls: list[dict] = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=self.reply)])
+
+
+class FakeClient:
+    def __init__(self, reply: str = "ok") -> None:
+        self.messages = FakeMessages(reply)
+
+
+class FakeStatusError(Exception):
+    """Stands in for anthropic.APIStatusError once patched into clients."""
+
+    def __init__(self, status_code: int, headers: dict[str, str] | None = None) -> None:
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
 
 
 def test_henry_guardrail_blocks_mass_mention() -> None:
@@ -51,3 +84,527 @@ def test_echo_decompose_uses_output_config(monkeypatch) -> None:
     assert "output_config" in call_kwargs
     assert plan["elon_tasks"][0]["goal"] == "Build auth module"
     assert plan["henry_tasks"][0]["goal"] == "Launch content plan"
+
+
+def test_agent_tree_shares_one_client(monkeypatch) -> None:
+    class FakeAnthropic:
+        def __init__(self, **kwargs) -> None:
+            self.kwargs = kwargs
+
+    monkeypatch.setattr(clients, "AsyncAnthropic", FakeAnthropic)
+    monkeypatch.setattr(clients, "httpx", None)
+    monkeypatch.setattr(clients, "_CLIENTS", {})
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test-key")
+    monkeypatch.delenv("ANTHROPIC_BASE_URL", raising=False)
+
+    echo = Echo()
+    agent_clients = {
+        id(agent.client)
+        for agent in (
+            echo,
+            echo.elon,
+            echo.elon.architect,
+            echo.elon.reviewer,
+            echo.elon.debugger,
+            echo.henry,
+            echo.henry.community,
+            echo.henry.content,
+            echo.henry.analytics,
+        )
+    }
+
+    assert len(agent_clients) == 1
+    assert len(clients._CLIENTS) == 1
+
+
+def test_query_llm_serves_repeat_requests_from_cache(monkeypatch, tmp_path) -> None:
+    client = FakeClient("cached answer")
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5", client=client)
+    monkeypatch.setattr(base_agent, "_RESPONSE_CACHE", ResponseCache(str(tmp_path)))
+
+    first = asyncio.run(agent._query_llm("same prompt"))
+    second = asyncio.run(agent._query_llm("same prompt"))
+
+    assert first == second == "cached answer"
+    assert len(client.messages.calls) == 1
+    assert any(event["event"] == "缓存命中" for event in tracing.get_timeline())
+
+
+def test_streaming_decompose_dispatches_elon_before_plan_finishes(monkeypatch) -> None:
+    echo = Echo()
+    chunks = ['{"elon_tasks": ["Build auth', ' module"], "henry_tas', 'ks": ["Launch content plan"]}']
+    dispatched: list[tuple[str, int]] = []
+    fed = 0
+
+    async def fake_stream_llm(_prompt, *, on_text, **_kwargs) -> str:
+        nonlocal fed
+        for chunk in chunks:
+            fed += 1
+            on_text(chunk)
+        return "".join(chunks)
+
+    monkeypatch.setattr(echo, "_stream_llm", fake_stream_llm)
+
+    plan = asyncio.run(
+        echo._decompose_goal("Ship v1", on_tasks=lambda key, tasks: dispatched.append((key, fed)))
+    )
+
+    assert dispatched == [("elon_tasks", 2), ("henry_tasks", 3)]
+    assert plan["elon_tasks"][0]["goal"] == "Build auth module"
+
+
+def test_coordinate_runs_end_to_end_offline(monkeypatch) -> None:
+    monkeypatch.setattr(clients, "AsyncAnthropic", None)
+    echo = Echo()
+
+    result = asyncio.run(echo.coordinate("Ship v1"))
+
+    assert result.startswith("[offline:Echo]")
+
+
+def test_prompt_cache_marks_stable_system_prefix(monkeypatch) -> None:
+    monkeypatch.setenv("HIVEMIND_PROMPT_CACHE", "1")
+    henry = Henry()
+    client = FakeClient()
+    henry.community.client = client
+
+    # The real prompts are far below the cacheable minimum, so no breakpoint is sent
+    asyncio.run(henry.community._query_llm("plan", extra_system_prompt="Per-call note."))
+    assert all("cache_control" not in block for block in client.messages.calls[0]["system"])
+
+    monkeypatch.setattr(base_agent, "min_cacheable_tokens", lambda _model: 1)
+    asyncio.run(henry.community._query_llm("plan", extra_system_prompt="Per-call note."))
+
+    system = client.messages.calls[1]["system"]
+    assert system[0]["cache_control"] == {"type": "ephemeral"}
+    assert "批量 @" in system[0]["text"]
+    assert system[1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in system[2]
+
+
+def test_scheduler_serves_queued_calls_by_priority() -> None:
+    llm_scheduler = scheduler.LLMScheduler({"haiku": {"concurrency": 1}})
+    order: list[str] = []
+
+    async def call(priority: str, hold: asyncio.Event | None = None) -> None:
+        async with llm_scheduler.slot("claude-haiku-4-5", priority):
+            order.append(priority)
+            if hold is not None:
+                await hold.wait()
+
+    async def scenario() -> None:
+        hold = asyncio.Event()
+        first = asyncio.create_task(call("medium", hold))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(call(p)) for p in ("low", "medium", "high")]
+        await asyncio.sleep(0)
+        hold.set()
+        await asyncio.gather(first, *queued)
+
+    asyncio.run(scenario())
+
+    assert order == ["medium", "high", "medium", "low"]
+
+
+def test_query_llm_retries_rate_limits_using_retry_after(monkeypatch) -> None:
+    client = FakeClient("recovered")
+    failures = [FakeStatusError(429, {"retry-after": "1.5"}), FakeStatusError(529, {})]
+    create = client.messages.create
+
+    async def flaky_create(**kwargs):
+        if failures:
+            raise failures.pop(0)
+        return await create(**kwargs)
+
+    waits: list[float] = []
+
+    async def fake_sleep(delay: float) -> None:
+        waits.append(delay)
+
+    client.messages.create = flaky_create
+    monkeypatch.setattr(clients, "APIStatusError", FakeStatusError)
+    monkeypatch.setattr(base_agent.asyncio, "sleep", fake_sleep)
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5", client=client)
+    agent.retry_policy = resilience.RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=10.0)
+    tracing.reset_timeline()
+
+    assert asyncio.run(agent._query_llm("prompt")) == "recovered"
+    assert waits[0] == 1.5
+    assert 0 <= waits[1] <= 2.0
+    assert [e["event"] for e in tracing.get_timeline()].count("重试等待") == 2
+
+
+def test_hedged_request_takes_the_faster_duplicate(monkeypatch) -> None:
+    monkeypatch.setenv("HIVEMIND_HEDGE", "1")
+    monkeypatch.setenv("HIVEMIND_HEDGE_MIN_SAMPLES", "3")
+    monkeypatch.setattr(resilience, "_LATENCY", resilience.LatencyTracker())
+    monkeypatch.setattr(resilience, "_HEDGE_STATS", {"fired": 0, "won": 0})
+    for _ in range(3):
+        resilience._LATENCY.observe("claude-haiku-4-5", 0.01)
+
+    client = FakeClient("fast copy")
+    create = client.messages.create
+    calls = 0
+
+    async def slow_then_fast(**kwargs):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            await asyncio.sleep(5)
+        return await create(**kwargs)
+
+    client.messages.create = slow_then_fast
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5", client=client)
+
+    assert asyncio.run(agent._query_llm("prompt")) == "fast copy"
+    assert resilience.get_hedge_stats() == {"fired": 1, "won": 1}
+
+
+def test_hedge_needs_a_free_scheduler_slot_and_only_primary_latency_is_tracked(monkeypatch) -> None:
+    monkeypatch.setenv("HIVEMIND_HEDGE", "1")
+    monkeypatch.setenv("HIVEMIND_HEDGE_MIN_SAMPLES", "3")
+    monkeypatch.setattr(resilience, "_LATENCY", resilience.LatencyTracker())
+    monkeypatch.setattr(resilience, "_HEDGE_STATS", {"fired": 0, "won": 0})
+    monkeypatch.setattr(scheduler, "_SCHEDULER", scheduler.LLMScheduler({"haiku": {"concurrency": 1}}))
+    for _ in range(3):
+        resilience._LATENCY.observe("claude-haiku-4-5", 0.01)
+
+    client = FakeClient("primary")
+    create = client.messages.create
+
+    async def slow(**kwargs):
+        await asyncio.sleep(0.1)
+        return await create(**kwargs)
+
+    client.messages.create = slow
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5", client=client)
+
+    # The primary holds the only slot, so no duplicate goes out
+    assert asyncio.run(agent._query_llm("prompt")) == "primary"
+    assert len(client.messages.calls) == 1
+    assert resilience.get_hedge_stats() == {"fired": 0, "won": 0}
+    assert "跳过对冲请求" in [event["event"] for event in tracing.get_timeline()]
+    assert resilience._LATENCY.percentile("claude-haiku-4-5", 100) >= 0.1
+
+
+def test_concurrent_runs_keep_separate_traces(monkeypatch) -> None:
+    monkeypatch.setattr(clients, "AsyncAnthropic", None)
+    echo = Echo()
+
+    async def traced_run(goal: str) -> tracing.Trace:
+        trace = tracing.start_trace(goal)
+        with tracing.span("Hive Mind", "run"):
+            await echo.coordinate(goal)
+        return trace
+
+    async def scenario() -> list[tracing.Trace]:
+        return await asyncio.gather(traced_run("goal A"), traced_run("goal B"))
+
+    first, second = asyncio.run(scenario())
+
+    assert len(first.events) == len(second.events)
+    assert all("goal B" not in event["detail"] + event["event"] for event in first.events)
+    assert all(entry["end_ns"] is not None for entry in first.spans)
+    chrome = first.to_chrome()["traceEvents"]
+    assert {"X", "i", "M"} <= {event["ph"] for event in chrome}
+
+
+def test_normalized_task_ids_never_collide() -> None:
+    tasks = Echo._normalize_task_list([{"id": "t2", "goal": "A"}, "B", {"goal": "C"}, {"id": "t2", "goal": "D"}])
+
+    assert [task["id"] for task in tasks] == ["t2", "t3", "t4", "t2-2"]
+
+
+def test_task_graph_runs_independent_tasks_in_parallel() -> None:
+    from echo import run_task_graph
+
+    tasks = Echo._normalize_task_list(
+        [
+            {"id": "api", "goal": "Build API"},
+            {"id": "ui", "goal": "Build UI"},
+            {"id": "e2e", "goal": "Write e2e tests", "depends_on": ["api", "ui", "missing"]},
+        ]
+    )
+    running = 0
+    peak = 0
+    seen_upstream: dict[str, list[str]] = {}
+
+    async def run_task(task, upstream):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        seen_upstream[task["id"]] = sorted(upstream)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return {"status": "done", "result": task["goal"]}
+
+    results = asyncio.run(run_task_graph(tasks, run_task))
+
+    assert peak == 2
+    assert seen_upstream["e2e"] == ["api", "ui"]
+    assert results["e2e"]["result"] == "Write e2e tests"
+
+
+def test_line_graph_skips_dependents_of_failed_tasks_and_reports_them_missing(monkeypatch) -> None:
+    echo = Echo(fan_out=True)
+    ran: list[str] = []
+
+    async def lead_run(message):
+        goal = message["payload"]["goal"]
+        ran.append(goal)
+        if goal == "Build API":
+            return {"task_id": message["task_id"], "from": "Elon", "result": "Error: boom", "status": "error"}
+        return {"task_id": message["task_id"], "from": "Elon", "result": f"{goal} ok", "status": "done"}
+
+    monkeypatch.setattr(echo.elon, "run", lead_run)
+    tasks = Echo._normalize_task_list(
+        [
+            {"id": "api", "goal": "Build API"},
+            {"id": "ui", "goal": "Build UI"},
+            {"id": "e2e", "goal": "Write e2e tests", "depends_on": ["api", "ui"]},
+        ]
+    )
+
+    result = asyncio.run(echo._run_line_graph("elon_tasks", tasks))
+
+    assert sorted(ran) == ["Build API", "Build UI"]
+    assert result["status"] == "done"
+    assert result["missing"] == "Elon/api, Elon/e2e"
+    assert "Error: boom" not in result["result"]
+    assert "Build UI ok" in result["result"]
+
+
+def test_compact_results_trims_oversized_sources() -> None:
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5")
+    results = [
+        {"task_id": "t-1", "from": "Elon/Architecture", "result": "Use a queue.\n" + "x" * 8000, "status": "done"},
+        {"task_id": "t-1", "from": "Elon/Debug", "result": "timeout", "status": "error"},
+    ]
+
+    context = agent._compact_results(results, budget=200)
+
+    assert context.startswith("## Elon/Architecture\nUse a queue.")
+    assert "…[trimmed ~" in context
+    assert "## Elon/Debug (failed)\ntimeout" in context
+    assert "task_id" not in context
+    assert scheduler.estimate_tokens(context) < 300
+
+
+def test_deadline_merges_partial_results_and_reports_missing_tracks(monkeypatch) -> None:
+    monkeypatch.setattr(clients, "AsyncAnthropic", None)
+    echo = Echo()
+    prompts: list[str] = []
+
+    async def slow_henry(_dispatch):
+        await asyncio.sleep(10)
+        return {"status": "done", "result": "too late"}
+
+    async def record_prompt(prompt, **_kwargs) -> str:
+        prompts.append(prompt)
+        return "merged"
+
+    monkeypatch.setattr(echo.henry, "run", slow_henry)
+    monkeypatch.setattr(echo, "_query_llm", record_prompt)
+
+    async def scenario() -> tuple[str, tracing.Trace]:
+        trace = tracing.start_trace("deadline")
+        with deadlines.deadline_scope(0.5):
+            result = await echo.coordinate("Ship v1")
+        return result, trace
+
+    result, trace = asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+    assert result == "merged\n\n## Missing\n\n- Henry\n"
+    assert "Missing tracks" in prompts[-1] and "Henry" in prompts[-1]
+    assert any(event["event"].startswith("缺失任务线") for event in trace.events)
+
+
+
+def test_missing_tracks_get_their_own_file_in_file_output() -> None:
+    from runner import split_files
+
+    result = "=== FILE: README.md ===\n# Ship v1"
+    files = split_files(result + Echo._missing_section(result, ["Henry/Growth", "Elon/api"]))
+
+    assert files == {"README.md": "# Ship v1", "MISSING.md": "# Missing\n\n- Henry/Growth\n- Elon/api"}
+
+def test_query_llm_continues_replies_cut_off_at_max_tokens() -> None:
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5")
+    replies = iter([("first half, ", "max_tokens"), ("second half", "end_turn")])
+    calls: list[dict] = []
+
+    class TruncatingMessages:
+        async def create(self, **kwargs):
+            calls.append(kwargs)
+            text, stop_reason = next(replies)
+            return SimpleNamespace(content=[SimpleNamespace(type="text", text=text)], stop_reason=stop_reason)
+
+    agent.client = SimpleNamespace(messages=TruncatingMessages())
+
+    text = asyncio.run(agent._query_llm("write it all", continuations=2))
+
+    assert text == "first half, second half"
+    assert [m["role"] for m in calls[1]["messages"]] == ["user", "assistant", "user"]
+    assert calls[1]["messages"][1]["content"] == "first half,"
+
+
+def test_query_llm_does_not_continue_a_reply_cut_off_before_any_text() -> None:
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-opus-4-6")
+    calls: list[dict] = []
+
+    class ThinkingOnlyMessages:
+        async def create(self, **kwargs):
+            calls.append(kwargs)
+            return SimpleNamespace(content=[SimpleNamespace(type="thinking", thinking="...")], stop_reason="max_tokens")
+
+    agent.client = SimpleNamespace(messages=ThinkingOnlyMessages())
+
+    assert asyncio.run(agent._query_llm("write it all", continuations=2)) == ""
+    assert len(calls) == 1
+    assert "输出截断，无文本可续写" in [event["event"] for event in tracing.get_timeline()]
+
+
+def test_per_file_synthesis_writes_files_concurrently(monkeypatch) -> None:
+    echo = Echo(per_file=True)
+    running = 0
+    peak = 0
+
+    async def fake_query(prompt, **_kwargs) -> str:
+        nonlocal running, peak
+        if prompt.startswith("Plan the deliverable files"):
+            return '{"files": [{"name": "README.md", "outline": "intro"}, {"name": "app.py", "outline": "code"}]}'
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        name = prompt.split("`")[1]
+        return f"=== FILE: {name} ===\ncontent of {name}"
+
+    monkeypatch.setattr(echo, "_query_llm", fake_query)
+    streamed: list[str] = []
+
+    result = asyncio.run(echo._synthesize_per_file("Human's original request: ship", on_text=streamed.append))
+
+    assert peak == 2
+    assert result == "=== FILE: README.md ===\ncontent of README.md\n\n=== FILE: app.py ===\ncontent of app.py"
+    assert sorted(streamed) == ["=== FILE: README.md ===\ncontent of README.md\n", "=== FILE: app.py ===\ncontent of app.py\n"]
+
+
+def test_offline_cold_start_does_not_import_sdk() -> None:
+    import os
+    import subprocess
+    import sys
+
+    probe = (
+        "import asyncio, sys\n"
+        "from echo import Echo\n"
+        "echo = Echo()\n"
+        "assert 'elon' not in echo.__dict__\n"
+        "asyncio.run(echo.coordinate('cold start'))\n"
+        "print('anthropic' in sys.modules, 'httpx' in sys.modules)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run(
+        [sys.executable, "-c", probe],
+        capture_output=True,
+        text=True,
+        cwd=root,
+        env={**os.environ, "ANTHROPIC_API_KEY": "", "PYTHONPATH": root},
+        check=True,
+    )
+
+    assert completed.stdout.strip().splitlines()[-1] == "False False"
+
+
+def test_open_breaker_reroutes_to_fallback_model_without_thinking(monkeypatch) -> None:
+    monkeypatch.setattr(clients, "APIStatusError", FakeStatusError)
+    monkeypatch.setattr(resilience, "_BREAKERS", {})
+    monkeypatch.setenv("HIVEMIND_BREAKER_MIN_CALLS", "2")
+    monkeypatch.setenv("HIVEMIND_FALLBACK_MODEL", "claude-sonnet-4-5")
+
+    async def no_sleep(delay: float) -> None:
+        pass
+
+    monkeypatch.setattr(base_agent.asyncio, "sleep", no_sleep)
+    client = FakeClient("from fallback")
+    create = client.messages.create
+
+    async def overloaded_opus(**kwargs):
+        if "opus" in kwargs["model"]:
+            client.messages.calls.append(kwargs)
+            raise FakeStatusError(529)
+        return await create(**kwargs)
+
+    client.messages.create = overloaded_opus
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-opus-4-6", client=client)
+    agent.retry_policy = resilience.RetryPolicy(max_attempts=3, base_delay=0.0)
+    tracing.reset_timeline()
+
+    assert asyncio.run(agent._query_llm("prompt", temperature=0.1)) == "from fallback"
+    rerouted = client.messages.calls[-1]
+    assert rerouted["model"] == "claude-sonnet-4-5"
+    assert "thinking" not in rerouted and rerouted["temperature"] == 0.1
+    events = [e["event"] for e in tracing.get_timeline()]
+    assert events.count("熔断器打开") == 1 and "模型降级" in events
+    assert resilience.get_breaker_states()["claude-opus-4-6"] == "open"
+
+    # While open, later calls go straight to the fallback without touching Opus
+    calls_before = len(client.messages.calls)
+    asyncio.run(agent._query_llm("again"))
+    assert len(client.messages.calls) == calls_before + 1
+
+
+def test_open_breaker_fails_fast_without_fallback_and_probes_after_cooldown(monkeypatch) -> None:
+    monkeypatch.setattr(resilience, "_BREAKERS", {"claude-opus-4-6": resilience.CircuitBreaker(min_calls=1)})
+    monkeypatch.delenv("HIVEMIND_FALLBACK_MODEL", raising=False)
+    breaker = resilience.get_breaker("claude-opus-4-6")
+    assert breaker.record(False, 1.0)
+
+    client = FakeClient("never")
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-opus-4-6", client=client)
+    try:
+        asyncio.run(agent._query_llm("prompt"))
+    except resilience.CircuitOpenError as exc:
+        assert exc.model == "claude-opus-4-6"
+    else:
+        raise AssertionError("expected CircuitOpenError")
+    assert client.messages.calls == []
+
+    breaker.cooldown = 0.0
+    assert breaker.state == "half_open"
+    assert asyncio.run(agent._query_llm("probe")) == "never"
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_ending_in_429_is_released_for_the_next_call(monkeypatch) -> None:
+    monkeypatch.setattr(clients, "APIStatusError", FakeStatusError)
+    monkeypatch.setattr(resilience, "_BREAKERS", {"claude-opus-4-6": resilience.CircuitBreaker(min_calls=1, cooldown=0.0)})
+    monkeypatch.delenv("HIVEMIND_FALLBACK_MODEL", raising=False)
+    breaker = resilience.get_breaker("claude-opus-4-6")
+    assert breaker.record(False, 1.0)
+
+    client = FakeClient("recovered")
+    create = client.messages.create
+    failures = [FakeStatusError(429)]
+
+    async def rate_limited_once(**kwargs):
+        if failures:
+            # Another call finishing while the probe is in flight must not decide for it
+            assert not breaker.record(True, 0.1)
+            raise failures.pop()
+        return await create(**kwargs)
+
+    client.messages.create = rate_limited_once
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-opus-4-6", client=client)
+    agent.retry_policy = resilience.RetryPolicy(max_attempts=1, base_delay=0.0)
+
+    try:
+        asyncio.run(agent._query_llm("probe"))
+    except FakeStatusError:
+        pass
+    else:
+        raise AssertionError("expected the 429 to surface")
+    assert breaker.state == "half_open"
+
+    assert asyncio.run(agent._query_llm("probe again")) == "recovered"
+    assert breaker.state == "closed"
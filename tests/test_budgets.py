@@ -0,0 +1,100 @@
+import asyncio
+from types import SimpleNamespace
+
+import base_agent
+from base_agent import BaseAgent
+from budgets import UsageHistory
+import tracing
+
+
+def test_budget_follows_recent_output_and_doubles_after_truncation(tmp_path) -> None:
+    path = tmp_path / "history.json"
+    history = UsageHistory(str(path), min_samples=3)
+    assert history.budget("Echo:synthesis", 8192) == 8192
+
+    for out in (900, 1000, 1100):
+        history.observe("Echo:synthesis", out, max_tokens=8192, truncated=False, seconds=20.0)
+    # p95 of [900, 1000, 1100] is 1100; x1.25 headroom, rounded up to 256
+    assert history.budget("Echo:synthesis", 8192) == 1536
+
+    history.observe("Echo:synthesis", 1536, max_tokens=1536, truncated=True, seconds=30.0)
+    assert history.budget("Echo:synthesis", 8192) == 3072
+
+    history.save()
+    reloaded = UsageHistory(str(path), min_samples=3)
+    assert reloaded.budget("Echo:synthesis", 8192) == 3072
+    assert reloaded.stats("Echo:synthesis")["truncated"] == 1
+
+
+
+def test_async_save_writes_a_snapshot_while_runs_keep_observing(tmp_path) -> None:
+    path = tmp_path / "history.json"
+    history = UsageHistory(str(path))
+    history.observe("Echo:synthesis", 900, max_tokens=8192, truncated=False, seconds=20.0)
+
+    async def scenario() -> None:
+        saving = asyncio.create_task(history.asave())
+        await asyncio.sleep(0)
+        history.observe("Echo:synthesis", 1000, max_tokens=8192, truncated=False, seconds=20.0)
+        await saving
+
+    asyncio.run(scenario())
+
+    assert UsageHistory(str(path)).stats("Echo:synthesis")["calls"] == 1
+    history.save()
+    assert UsageHistory(str(path)).stats("Echo:synthesis")["calls"] == 2
+
+
+class BudgetMessages:
+    def __init__(self) -> None:
+        self.calls: list[dict] = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        truncated = len(self.calls) == 1
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text="part " if truncated else "rest")],
+            stop_reason="max_tokens" if truncated else "end_turn",
+            usage=SimpleNamespace(
+                input_tokens=10, output_tokens=kwargs["max_tokens"] if truncated else 50,
+                cache_creation_input_tokens=0, cache_read_input_tokens=0,
+            ),
+        )
+
+
+def test_query_llm_uses_and_raises_the_call_site_budget(monkeypatch, tmp_path) -> None:
+    history = UsageHistory(str(tmp_path / "history.json"))
+    monkeypatch.setattr(base_agent, "_USAGE_HISTORY", history)
+    client = SimpleNamespace(messages=BudgetMessages())
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5", client=client)
+    tracing.reset_timeline()
+
+    assert asyncio.run(agent._query_llm("prompt", max_tokens=1000, continuations=1, site="report")) == "part rest"
+
+    assert [call["max_tokens"] for call in client.messages.calls] == [1000, 1000]
+    stats = history.stats("Tester:report")
+    assert (stats["calls"], stats["truncated"], stats["max_out"]) == (2, 1, 1000)
+    assert "输出预算上调" in [e["event"] for e in tracing.get_timeline()]
+
+    asyncio.run(agent._query_llm("next prompt", max_tokens=1000, site="report"))
+    assert client.messages.calls[-1]["max_tokens"] == 2000
+
+
+def test_learned_budget_below_the_callers_limit_finishes_truncated_replies(monkeypatch, tmp_path) -> None:
+    history = UsageHistory(str(tmp_path / "history.json"))
+    for _ in range(5):
+        history.observe("Tester:report", 100, max_tokens=8192, truncated=False, seconds=1.0)
+        history.observe("Tester:plan", 100, max_tokens=8192, truncated=False, seconds=1.0)
+    monkeypatch.setattr(base_agent, "_USAGE_HISTORY", history)
+    client = SimpleNamespace(messages=BudgetMessages())
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5", client=client)
+
+    # No continuations asked for, but the cut came from the learned budget, not the caller's 8192
+    assert asyncio.run(agent._query_llm("prompt", max_tokens=8192, site="report")) == "part rest"
+    assert [call["max_tokens"] for call in client.messages.calls] == [512, 8192]
+    assert client.messages.calls[1]["messages"][-2] == {"role": "assistant", "content": "part"}
+
+    # Structured output is never given less than the caller asked for
+    schema = {"format": {"type": "json_schema", "schema": {"type": "object"}}}
+    asyncio.run(agent._query_llm("plan", max_tokens=8192, output_config=schema, site="plan"))
+    assert client.messages.calls[-1]["max_tokens"] == 8192
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import base_agent
+import clients
+import fake_anthropic
+from echo import Echo
+from fake_anthropic import FakeAnthropic, parse_latency
+
+httpx = pytest.importorskip("httpx")
+pytest.importorskip("anthropic.types")
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    def install(**options) -> FakeAnthropic:
+        server = FakeAnthropic(**options)
+        monkeypatch.setenv("ANTHROPIC_API_KEY", "sk-fake")
+        monkeypatch.setenv("HIVEMIND_RETRY_BASE_DELAY", "0")
+        fake_anthropic.install(server)
+        return server
+
+    yield install
+    fake_anthropic.install(None)
+    asyncio.run(clients.aclose_shared_clients())
+
+
+def test_parse_latency_distributions() -> None:
+    import random
+
+    rng = random.Random(1)
+    assert parse_latency("0.25")(rng) == 0.25
+    assert all(0.1 <= parse_latency("uniform:0.1,0.2")(rng) <= 0.2 for _ in range(20))
+    assert parse_latency("lognormal:0.2,0.5")(rng) > 0
+    with pytest.raises(ValueError):
+        parse_latency("pareto:1,2")
+
+
+def test_coordinate_runs_end_to_end_against_fake_with_injected_429(fake) -> None:
+    server = fake(rate_limit_rate=0.2, seed=3)
+
+    result = asyncio.run(Echo().coordinate("Ship v1"))
+
+    assert result and not result.startswith("[offline:")
+    assert server.stats["rate_limited"] > 0
+    assert server.stats["requests"] > server.stats["rate_limited"]
+
+
+def test_streamed_reply_arrives_in_chunks(fake) -> None:
+    server = fake(output_tokens=120, chunk_tokens=8)
+    chunks: list[str] = []
+
+    result = asyncio.run(Echo().coordinate("Ship v1", on_text=chunks.append))
+
+    assert server.stats["streams"] >= 1
+    assert len(chunks) > 1
+    assert "".join(chunks).strip() in result
+
+
+def test_warm_up_opens_connections_before_the_first_call(fake) -> None:
+    server = fake()
+
+    assert asyncio.run(clients.warm_up_connections(3)) == 3
+    assert server.stats["requests"] == 3
+
+
+def test_prompt_cache_hits_only_once_the_prefix_clears_the_minimum(fake, monkeypatch) -> None:
+    fake()
+    monkeypatch.setenv("HIVEMIND_PROMPT_CACHE", "1")
+    long_role = "Follow the team playbook exactly. " * 600
+    short = base_agent.BaseAgent(name="Short", role_prompt="Test role.", model="claude-haiku-4-5")
+    long = base_agent.BaseAgent(name="Long", role_prompt=long_role, model="claude-haiku-4-5")
+
+    async def scenario() -> None:
+        for prompt in ("first", "second"):
+            await short._query_llm(prompt)
+            await long._query_llm(prompt)
+
+    asyncio.run(scenario())
+
+    assert short.usage["cache_read_input_tokens"] == short.usage["cache_creation_input_tokens"] == 0
+    assert long.usage["cache_creation_input_tokens"] >= base_agent.min_cacheable_tokens("claude-haiku-4-5")
+    assert long.usage["cache_read_input_tokens"] == long.usage["cache_creation_input_tokens"]
@@ -0,0 +1,119 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import resilience
+from base_agent import BaseAgent
+from guardrails import Guardrail, GuardrailViolation, load_guardrail
+import tracing
+
+
+def test_matcher_normalizes_width_case_and_padding() -> None:
+    guardrail = Guardrail(["批量@", "cold dm", "刷评论"])
+
+    assert guardrail.find("计划：批量＠所有粉丝") == "批量@"
+    assert guardrail.find("Send a COLD-DM to each lead") == "cold-dm"
+    assert guardrail.find("安排刷​评论") == "刷评论"
+    assert guardrail.find("批量 @ 用户") == "批量 @"
+    assert guardrail.find("Build a community newsletter") is None
+
+
+def test_output_scan_skips_restated_rules_but_input_scan_does_not() -> None:
+    guardrail = load_guardrail()
+
+    assert guardrail.find("注意：严禁刷评论和 spam", allow_negated=True) is None
+    assert guardrail.find("Never spam the forum", allow_negated=False) == "spam"
+    assert guardrail.find("Day 3: spam every subreddit", allow_negated=True) == "spam"
+
+
+def test_negation_must_directly_precede_the_term() -> None:
+    guardrail = load_guardrail()
+
+    # Describing a risk is not proposing the tactic
+    assert guardrail.find("Risks: accounts may get flagged as spam", allow_negated=True) is None
+    assert guardrail.find("over-posting could be reported as spam", allow_negated=True) is None
+    # A negation elsewhere in the sentence doesn't excuse the term
+    assert guardrail.find("不要担心，我们会批量@所有粉丝", allow_negated=True) == "批量@"
+    assert guardrail.find("发布反馈后立即刷评论提升热度", allow_negated=True) == "刷评论"
+
+
+def test_scanner_catches_terms_split_across_chunks() -> None:
+    scanner = load_guardrail().scanner()
+    chunks = ["Week 1 plan: run a mass ", "men", "tion blast on launch day"]
+
+    hits = [scanner.feed(chunk) for chunk in chunks]
+
+    assert hits == [None, None, "mass mention"]
+
+
+def test_streamed_output_is_aborted_at_the_first_violation() -> None:
+    deltas = ["Launch plan:\n", "1. Post the demo\n", "2. Cold DM ", "every follower\n", "3. Measure signups\n"]
+    pulled: list[str] = []
+
+    class FakeStream:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        @property
+        async def text_stream(self):
+            for delta in deltas:
+                pulled.append(delta)
+                yield delta
+
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5")
+    agent.screen_output = True
+    agent.client = SimpleNamespace(messages=SimpleNamespace(stream=lambda **_kwargs: FakeStream()))
+    received: list[str] = []
+
+    with pytest.raises(GuardrailViolation):
+        asyncio.run(agent._stream_llm("plan", on_text=received.append))
+
+    assert received == deltas[:2]
+    assert len(pulled) == 3
+
+
+def test_flag_mode_records_the_hit_and_keeps_the_output() -> None:
+    class FakeMessages:
+        async def create(self, **_kwargs):
+            return SimpleNamespace(content=[SimpleNamespace(type="text", text="Day 3: spam every subreddit")])
+
+    agent = BaseAgent(name="Tester", role_prompt="Test role.", model="claude-haiku-4-5")
+    agent.client = SimpleNamespace(messages=FakeMessages())
+    tracing.reset_timeline()
+
+    assert asyncio.run(agent._query_llm("report", screen="flag")) == "Day 3: spam every subreddit"
+    events = [event["event"] for event in tracing.get_timeline()]
+    assert "护栏标记" in events and "护栏拦截" not in events
+
+
+def test_henry_sub_agent_run_stops_generating_at_the_first_violation() -> None:
+    from henry import CommunityAgent
+
+    deltas = ["Week 1:\n", "- Host an AMA\n", "- Cold DM ", "every follower\n", "- Review signups\n"]
+    pulled: list[str] = []
+
+    class FakeStream:
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            return False
+
+        @property
+        async def text_stream(self):
+            for delta in deltas:
+                pulled.append(delta)
+                yield delta
+
+    agent = CommunityAgent()
+    agent.client = SimpleNamespace(messages=SimpleNamespace(stream=lambda **_kwargs: FakeStream()))
+    agent.retry_policy = resilience.RetryPolicy(max_attempts=1)
+
+    result = asyncio.run(agent.run({"task_id": "t-1", "goal": "Grow the community"}))
+
+    assert result["status"] == "error" and "Guardrail violation" in result["result"]
+    assert len(pulled) == 3
@@ -0,0 +1,215 @@
+import asyncio
+import json
+
+import pytest
+
+import base_agent
+import clients
+from echo import Echo
+from main import _run_batch
+from runner import StreamingFileSplitter, execute_run, split_files
+
+SAMPLE = (
+    "Preamble that is not a file\n"
+    "=== FILE: README.md ===\n"
+    "# Title\n"
+    "\n"
+    "Body text\n"
+    "=== FILE: .github/workflows/ci.yml ===\n"
+    "name: ci\n"
+    "on: [push]\n"
+)
+
+
+def test_streaming_splitter_matches_split_files(tmp_path) -> None:
+    splitter = StreamingFileSplitter(str(tmp_path))
+    for start in range(0, len(SAMPLE), 7):
+        splitter.feed(SAMPLE[start : start + 7])
+    splitter.close()
+
+    expected = split_files(SAMPLE)
+    assert splitter.written == list(expected)
+    for name, content in expected.items():
+        assert (tmp_path / name).read_text(encoding="utf-8") == content + "\n"
+
+
+def test_streaming_splitter_flushes_file_when_next_one_starts(tmp_path) -> None:
+    splitter = StreamingFileSplitter(str(tmp_path))
+    splitter.feed("=== FILE: a.txt ===\nalpha\n=== FILE: b.txt ===\nbe")
+
+    assert (tmp_path / "a.txt").read_text(encoding="utf-8") == "alpha\n"
+    assert not (tmp_path / "b.txt").exists()
+
+
+def test_batch_isolates_failures_and_writes_summary(monkeypatch, tmp_path) -> None:
+    monkeypatch.chdir(tmp_path)
+    goals = tmp_path / "goals.jsonl"
+    goals.write_text('{"goal": "ship docs"}\n"break things"\nplain goal\n\n', encoding="utf-8")
+
+    class FakeEcho:
+        async def coordinate(self, human_input: str, on_text=None) -> str:
+            if "break" in human_input:
+                raise RuntimeError("boom")
+            return f"=== FILE: out.md ===\n{human_input}"
+
+    records = asyncio.run(_run_batch(FakeEcho(), str(goals), concurrency=2, summary_path="summary.jsonl"))
+
+    summary = [json.loads(line) for line in (tmp_path / "summary.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["index"] for r in summary) == [0, 1, 2]
+    assert {r["goal"]: r["status"] for r in records} == {
+        "ship docs": "done",
+        "break things": "error",
+        "plain goal": "done",
+    }
+    done = next(r for r in records if r["goal"] == "plain goal")
+    assert (tmp_path / done["run_dir"] / "out.md").read_text(encoding="utf-8") == "plain goal\n"
+
+
+def test_resume_reuses_checkpointed_stages(monkeypatch, tmp_path) -> None:
+    monkeypatch.setattr(clients, "AsyncAnthropic", None)
+    echo = Echo()
+    run_dir = str(tmp_path / "run")
+    calls = {"architect": 0, "elon": 0}
+    architect_run, elon_run, echo_query = echo.elon.architect.run, echo.elon.run, echo._query_llm
+
+    async def counted_architect(message):
+        calls["architect"] += 1
+        return await architect_run(message)
+
+    async def counted_elon(message):
+        calls["elon"] += 1
+        return await elon_run(message)
+
+    async def crash_in_synthesis(prompt, **kwargs):
+        if "Elon's technical output" in prompt:
+            raise RuntimeError("synthesis died")
+        return await echo_query(prompt, **kwargs)
+
+    monkeypatch.setattr(echo.elon.architect, "run", counted_architect)
+    monkeypatch.setattr(echo.elon, "run", counted_elon)
+    monkeypatch.setattr(echo, "_query_llm", crash_in_synthesis)
+    with pytest.raises(RuntimeError):
+        asyncio.run(execute_run(echo, "Ship v1", run_dir))
+
+    monkeypatch.setattr(echo, "_query_llm", echo_query)
+    result = asyncio.run(execute_run(echo, "Ship v1", run_dir, resume=True))
+
+    assert result.startswith("[offline:Echo]")
+    assert calls == {"architect": 1, "elon": 1}
+    assert (tmp_path / "run" / "checkpoint.jsonl").exists()
+
+
+
+def test_concurrent_checkpoint_writes_keep_every_stage(tmp_path) -> None:
+    from checkpoint import Checkpoint
+
+    checkpoint = Checkpoint(str(tmp_path), "Ship v1")
+
+    async def scenario() -> None:
+        await asyncio.gather(*(checkpoint.aput(f"stage-{i}", {"result": "x" * 20000}) for i in range(8)))
+
+    asyncio.run(scenario())
+
+    reloaded = Checkpoint(str(tmp_path), resume=True)
+    assert reloaded.goal == "Ship v1"
+    assert sorted(reloaded.stages) == [f"stage-{i}" for i in range(8)]
+
+def test_incremental_refine_regenerates_only_named_files(monkeypatch, tmp_path) -> None:
+    from main import _execute_refine
+    from runner import read_manifest, write_outputs
+
+    prior_dir = str(tmp_path / "prior")
+    write_outputs("Ship v1", SAMPLE, prior_dir)
+    assert set(read_manifest(prior_dir)) == {"README.md", ".github/workflows/ci.yml"}
+
+    echo = Echo()
+    prompts: list[str] = []
+
+    async def fake_query(prompt, **_kwargs) -> str:
+        prompts.append(prompt)
+        return "=== FILE: README.md ===\n# New title"
+
+    monkeypatch.setattr(echo, "_query_llm", fake_query)
+    run_dir = tmp_path / "refined"
+    updated = asyncio.run(_execute_refine(echo, prior_dir, "Fix the heading in README.md", str(run_dir)))
+
+    assert list(updated) == ["README.md"]
+    assert len(prompts) == 1 and "Ship v1" in prompts[0]
+    assert (run_dir / "README.md").read_text(encoding="utf-8") == "# New title\n"
+    assert (run_dir / ".github/workflows/ci.yml").read_text(encoding="utf-8") == "name: ci\non: [push]\n"
+    assert (run_dir / "task.txt").read_text(encoding="utf-8") == "Ship v1"
+
+
+def test_run_streams_timeline_jsonl_and_tail_replays_it(monkeypatch, tmp_path, capsys) -> None:
+    from main import _tail_timeline
+
+    monkeypatch.setattr(clients, "AsyncAnthropic", None)
+    run_dir = tmp_path / "run"
+
+    asyncio.run(execute_run(Echo(), "Ship v1", str(run_dir)))
+
+    events = [json.loads(line) for line in (run_dir / "timeline.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert events[-1]["event"] == "运行结束" and events[-1]["detail"] == "done"
+    assert all("ts" in event for event in events)
+    rows = [line for line in (run_dir / "timeline.md").read_text(encoding="utf-8").splitlines() if line.startswith("| +")]
+    assert len(rows) == len(events)
+
+    capsys.readouterr()
+    asyncio.run(asyncio.wait_for(_tail_timeline(str(run_dir), poll=0.01), timeout=5))
+    assert capsys.readouterr().out.count("\n") == len(events)
+
+
+def test_tail_stops_waiting_on_calls_that_failed(tmp_path, capsys) -> None:
+    from main import _tail_timeline
+
+    path = tmp_path / "timeline.jsonl"
+    events = [
+        {"t": 0.1, "ts": 1.0, "agent": "Elon", "event": "调用 LLM", "detail": ""},
+        {"t": 0.2, "ts": 1.1, "agent": "Henry", "event": "调用 LLM", "detail": ""},
+        {"t": 0.3, "ts": 1.2, "agent": "Elon", "event": base_agent.LLM_FAILED_EVENT, "detail": "CircuitOpenError"},
+    ]
+    path.write_text("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events), encoding="utf-8")
+
+    async def scenario() -> None:
+        tail = asyncio.create_task(_tail_timeline(str(tmp_path), poll=0.01, idle_report=0.05))
+        await asyncio.sleep(0.2)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"t": 1.0, "agent": "Hive Mind", "event": "运行结束", "detail": "done"}) + "\n")
+        await asyncio.wait_for(tail, timeout=5)
+
+    asyncio.run(scenario())
+    report = [line for line in capsys.readouterr().out.splitlines() if line.startswith("[tail] 等待 LLM 响应")]
+    assert report and "Henry" in report[0] and "Elon" not in report[0]
+
+
+def test_timeline_writer_flushes_while_the_run_is_still_going(tmp_path) -> None:
+    from tracing import TimelineWriter
+
+    path = tmp_path / "timeline.jsonl"
+
+    async def scenario() -> list[str]:
+        async with TimelineWriter(str(path), flush_interval=0.01) as writer:
+            writer.write({"t": 0.1, "agent": "Elon", "event": "调用 LLM", "detail": ""})
+            await asyncio.sleep(0.1)
+            return path.read_text(encoding="utf-8").splitlines()
+
+    during = asyncio.run(scenario())
+    assert len(during) == 1 and json.loads(during[0])["agent"] == "Elon"
+
+
+def test_repl_runs_goals_concurrently_into_separate_output_dirs(monkeypatch, tmp_path) -> None:
+    import argparse
+    import io
+    import sys
+
+    from main import _interactive
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(clients, "AsyncAnthropic", None)
+    monkeypatch.setattr(sys, "stdin", io.StringIO("first goal\n\nsecond goal\nexit\n"))
+
+    asyncio.run(_interactive(Echo(), argparse.Namespace(stream=False, deadline=None)))
+
+    run_dirs = sorted((tmp_path / "outputs").iterdir())
+    assert len(run_dirs) == 2
+    assert sorted((d / "task.txt").read_text(encoding="utf-8") for d in run_dirs) == ["first goal", "second goal"]
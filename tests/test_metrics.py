@@ -0,0 +1,57 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from base_agent import BaseAgent
+from metrics import estimate_cost, start_metrics
+
+
+class UsageMessages:
+    async def create(self, **kwargs):
+        usage = SimpleNamespace(
+            input_tokens=1000,
+            output_tokens=400,
+            cache_creation_input_tokens=0,
+            cache_read_input_tokens=2000,
+        )
+        content = [
+            SimpleNamespace(type="thinking", thinking="x" * 400),
+            SimpleNamespace(type="text", text="answer"),
+        ]
+        return SimpleNamespace(content=content, usage=usage, stop_reason="end_turn")
+
+
+def test_usage_is_aggregated_per_agent_and_model(tmp_path) -> None:
+    client = SimpleNamespace(messages=UsageMessages())
+    review = BaseAgent(name="Elon/Review", role_prompt="Review.", model="claude-haiku-4-5", client=client)
+    elon = BaseAgent(name="Elon", role_prompt="CTO.", model="claude-opus-4-6", client=client)
+
+    async def scenario():
+        metrics = start_metrics("run-1")
+        await asyncio.gather(review._query_llm("a"), review._query_llm("b"), elon._query_llm("c"))
+        return metrics
+
+    metrics = asyncio.run(scenario())
+    metrics.export(str(tmp_path))
+    report = json.loads((tmp_path / "metrics.json").read_text(encoding="utf-8"))
+
+    assert report["by_agent"]["Elon/Review"]["calls"] == 2
+    assert report["by_agent"]["Elon/Review"]["input_tokens"] == 2000
+    assert report["by_agent"]["Elon/Review"]["thinking_tokens"] == 200
+    assert report["by_model"]["claude-opus-4-6"]["calls"] == 1
+    assert report["total"]["calls"] == 3
+    # Opus: 1000 in * $5 + 2000 cache reads * $0.5 + 400 out * $25 per MTok
+    assert abs(report["by_model"]["claude-opus-4-6"]["cost_usd"] - 0.016) < 1e-9
+    assert list(report["by_agent"]) == ["Elon", "Elon/Review"]
+
+    prom = metrics.to_prometheus()
+    assert 'hivemind_llm_calls_total{agent="Elon/Review",model="claude-haiku-4-5"} 2' in prom
+    assert 'kind="cache_read"} 4000' in prom
+
+
+def test_pricing_can_be_overridden(monkeypatch) -> None:
+    monkeypatch.setenv("HIVEMIND_PRICING", '{"claude-opus-4-6": [15, 75]}')
+
+    assert estimate_cost("claude-opus-4-6", {"output_tokens": 1_000_000}) == 75.0
+    assert estimate_cost("claude-opus-4-1", {"output_tokens": 1_000_000}) == 25.0
+    assert estimate_cost("unknown-model", {"output_tokens": 1_000_000}) == 0.0
@@ -0,0 +1,47 @@
+from response_cache import ResponseCache
+
+
+def test_cache_round_trips_through_disk(tmp_path) -> None:
+    payload = {"model": "claude-haiku-4-5", "messages": [{"role": "user", "content": "hi"}]}
+    cache = ResponseCache(str(tmp_path))
+    key = cache.key(payload)
+
+    assert cache.get(key) is None
+    cache.put(key, "hello")
+    cache.close()
+
+    reopened = ResponseCache(str(tmp_path))
+    assert reopened.get(reopened.key(dict(reversed(list(payload.items()))))) == "hello"
+    assert reopened.stats()["hits"] == 1
+
+
+def test_cache_evicts_lru_and_expired_entries(tmp_path) -> None:
+    cache = ResponseCache(str(tmp_path), max_memory_entries=1, max_disk_entries=2)
+    for name in ("a", "b", "c"):
+        cache.put(name, name.upper())
+
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+
+    expired = ResponseCache(str(tmp_path), ttl=-1)
+    assert expired.get("c") is None
+
+
+def test_async_access_runs_disk_io_off_the_loop_and_ignores_max_tokens(tmp_path, monkeypatch) -> None:
+    import asyncio
+    import threading
+
+    payload = {"model": "claude-haiku-4-5", "max_tokens": 1024, "messages": [{"role": "user", "content": "hi"}]}
+    cache = ResponseCache(str(tmp_path))
+    threads: set[str] = set()
+    load, write = cache._load, cache._write
+    monkeypatch.setattr(cache, "_load", lambda *a: threads.add(threading.current_thread().name) or load(*a))
+    monkeypatch.setattr(cache, "_write", lambda *a: threads.add(threading.current_thread().name) or write(*a))
+
+    async def scenario() -> str | None:
+        await cache.aput(cache.key(payload), "hello")
+        cache._memory.clear()
+        return await cache.aget(cache.key({**payload, "max_tokens": 4096}))
+
+    assert asyncio.run(scenario()) == "hello"
+    assert threads and threading.main_thread().name not in threads
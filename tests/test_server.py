@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+import tracing
+from server import HiveMindServer
+
+
+class FakeEcho:
+    def __init__(self) -> None:
+        self.release = asyncio.Event()
+
+    async def coordinate(self, human_input: str, on_text=None) -> str:
+        tracing.record("Echo", "Coordinating", human_input)
+        await self.release.wait()
+        return f"=== FILE: plan.md ===\n{human_input}"
+
+
+async def _request(port: int, method: str, path: str, body: dict | None = None, accept: str = "") -> tuple[int, str]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = json.dumps(body or {}).encode("utf-8")
+    head = f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(payload)}\r\n"
+    if accept:
+        head += f"Accept: {accept}\r\n"
+    writer.write(head.encode("latin-1") + b"\r\n" + payload)
+    await writer.drain()
+    raw = (await reader.read()).decode("utf-8")
+    writer.close()
+    status = int(raw.split(" ", 2)[1])
+    return status, raw.split("\r\n\r\n", 1)[1]
+
+
+def test_server_runs_goals_and_applies_backpressure(tmp_path) -> None:
+    async def scenario() -> None:
+        echo = FakeEcho()
+        server = HiveMindServer(echo, port=0, max_inflight=1, max_queue=0, output_root=str(tmp_path))
+        await server.start()
+
+        first = asyncio.create_task(_request(server.port, "POST", "/runs", {"goal": "ship docs"}))
+        while server.active == 0:
+            await asyncio.sleep(0.01)
+        rejected_status, _ = await _request(server.port, "POST", "/runs", {"goal": "second"})
+        echo.release.set()
+        status, body = await first
+
+        assert rejected_status == 429
+        assert status == 200
+        assert json.loads(body)["files"] == {"plan.md": "ship docs"}
+
+        stream_status, stream_body = await _request(
+            server.port, "POST", "/runs", {"goal": "streamed"}, accept="text/event-stream"
+        )
+        assert stream_status == 200
+        assert "event: timeline" in stream_body
+        assert stream_body.rstrip().splitlines()[-1].startswith("data: ")
+        assert "event: result" in stream_body
+
+        metrics_status, metrics_body = await _request(server.port, "GET", "/metrics")
+        assert metrics_status == 200
+        assert "# TYPE hivemind_runs_inflight gauge" in metrics_body
+
+        await server.drain()
+        health = server._health()
+        assert health["status"] == "draining"
+
+    asyncio.run(scenario())
+
+
+def test_streamed_runs_reserve_their_queue_spot_on_admission(tmp_path) -> None:
+    async def scenario() -> None:
+        echo = FakeEcho()
+        server = HiveMindServer(echo, port=0, max_inflight=1, max_queue=1, output_root=str(tmp_path))
+        await server.start()
+
+        def streamed(goal: str) -> asyncio.Task:
+            return asyncio.create_task(
+                _request(server.port, "POST", "/runs", {"goal": goal}, accept="text/event-stream")
+            )
+
+        running = streamed("first")
+        while server.active == 0:
+            await asyncio.sleep(0.01)
+        # Both arrive before either run task starts; only one may take the single queue spot
+        contenders = [streamed("second"), streamed("third")]
+        done, _ = await asyncio.wait(contenders, timeout=5, return_when=asyncio.FIRST_COMPLETED)
+        assert [task.result()[0] for task in done] == [429]
+        assert server.waiting == 1
+
+        echo.release.set()
+        statuses = sorted(status for status, _ in await asyncio.gather(running, *contenders))
+        assert statuses == [200, 200, 429]
+        assert server.waiting == 0 and server.active == 0
+        await server.drain()
+
+    asyncio.run(scenario())
+
+
+def test_server_answers_an_unexpected_error_with_500(tmp_path) -> None:
+    async def scenario() -> None:
+        server = HiveMindServer(FakeEcho(), port=0, output_root=str(tmp_path))
+
+        def broken(body: bytes) -> str:
+            raise RuntimeError("boom")
+
+        server._parse_goal = broken
+        await server.start()
+        status, body = await _request(server.port, "POST", "/runs", {"goal": "x"})
+        assert status == 500
+        assert json.loads(body) == {"error": "RuntimeError: boom"}
+        await server.drain()
+
+    asyncio.run(scenario())
+
+
+def test_server_rejects_a_bad_content_length(tmp_path) -> None:
+    async def scenario() -> None:
+        server = HiveMindServer(FakeEcho(), port=0, output_root=str(tmp_path))
+        await server.start()
+        for length in ("abc", "-5"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(f"POST /runs HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            raw = (await reader.read()).decode("utf-8")
+            writer.close()
+            assert raw.startswith("HTTP/1.1 400") and "Content-Length" in raw
+        await server.drain()
+
+    asyncio.run(scenario())
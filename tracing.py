@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator
+
+
+class Trace:
+    """One run's timeline: flat events plus nested spans on a monotonic nanosecond clock."""
+
+    def __init__(self, name: str = "run") -> None:
+        self.name = name
+        self.started_at = time.time()
+        self.start_ns = time.monotonic_ns()
+        self.events: list[dict[str, Any]] = []
+        self.spans: list[dict[str, Any]] = []
+        self._span_ids = itertools.count(1)
+        # Called with each event as it is recorded (live progress streams)
+        self.listeners: list[Callable[[dict[str, Any]], None]] = []
+
+    def now_ns(self) -> int:
+        return time.monotonic_ns() - self.start_ns
+
+    def record(self, agent: str, event: str, detail: str = "") -> dict[str, Any]:
+        t_ns = self.now_ns()
+        parent = _CURRENT_SPAN.get()
+        entry = {
+            "t": round(t_ns / 1e9, 3),
+            "t_ns": t_ns,
+            "agent": agent,
+            "event": event,
+            "detail": detail,
+            "span": parent["id"] if parent else None,
+        }
+        self.events.append(entry)
+        for listener in self.listeners:
+            listener(entry)
+        return entry
+
+    def open_span(self, agent: str, name: str, attrs: dict[str, Any]) -> dict[str, Any]:
+        parent = _CURRENT_SPAN.get()
+        entry = {
+            "id": next(self._span_ids),
+            "parent": parent["id"] if parent else None,
+            "agent": agent,
+            "name": name,
+            "start_ns": self.now_ns(),
+            "end_ns": None,
+            "status": "ok",
+            "attrs": attrs,
+        }
+        self.spans.append(entry)
+        return entry
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "events": list(self.events),
+            "spans": list(self.spans),
+        }
+
+    def to_chrome(self) -> dict[str, Any]:
+        """Chrome trace-event format (chrome://tracing, Perfetto): one thread row per agent."""
+        thread_ids: dict[str, int] = {}
+
+        def tid(agent: str) -> int:
+            return thread_ids.setdefault(agent, len(thread_ids) + 1)
+
+        now_ns = self.now_ns()
+        trace_events: list[dict[str, Any]] = []
+        for entry in self.spans:
+            end_ns = entry["end_ns"] if entry["end_ns"] is not None else now_ns
+            trace_events.append({
+                "name": entry["name"],
+                "cat": "span",
+                "ph": "X",
+                "ts": entry["start_ns"] / 1000,
+                "dur": (end_ns - entry["start_ns"]) / 1000,
+                "pid": 1,
+                "tid": tid(entry["agent"]),
+                "args": {"status": entry["status"], **entry["attrs"]},
+            })
+        for entry in self.events:
+            trace_events.append({
+                "name": entry["event"],
+                "cat": "event",
+                "ph": "i",
+                "s": "t",
+                "ts": entry["t_ns"] / 1000,
+                "pid": 1,
+                "tid": tid(entry["agent"]),
+                "args": {"detail": entry["detail"]},
+            })
+        for agent, thread_id in thread_ids.items():
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": thread_id, "args": {"name": agent}})
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export(self, run_dir: str) -> None:
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, "trace.json"), "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, ensure_ascii=False, indent=2)
+        with open(os.path.join(run_dir, "trace.chrome.json"), "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome(), f, ensure_ascii=False)
+
+
+TIMELINE_FILE = "timeline.jsonl"
+
+
+class TimelineWriter:
+    """Appends trace events to a JSONL file while the run is going.
+
+    write() only buffers the serialized line, so it is safe to call from a trace listener;
+    a background task hands the buffer to a worker thread every ``flush_interval`` seconds
+    (sooner once ``max_buffer`` lines pile up), and aclose() flushes what is left.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.25, max_buffer: int = 256, append: bool = False) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: list[str] = []
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._closed = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if not append:
+            # Truncate up front so a tail attached to the run dir sees this run from its first event
+            open(path, "w", encoding="utf-8").close()
+
+    def write(self, entry: dict[str, Any]) -> None:
+        self._buffer.append(json.dumps({"ts": round(time.time(), 3), **entry}, ensure_ascii=False) + "\n")
+        if len(self._buffer) >= self.max_buffer and self._wake is not None:
+            self._wake.set()
+
+    def _append(self, lines: list[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+
+    async def _flush(self) -> None:
+        lines, self._buffer = self._buffer, []
+        if lines:
+            await asyncio.to_thread(self._append, lines)
+
+    async def _run(self) -> None:
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush()
+
+    async def __aenter__(self) -> "TimelineWriter":
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self._flush()
+
+
+def read_timeline(run_dir: str) -> list[dict[str, Any]] | None:
+    """Events from run_dir/timeline.jsonl; None when the run did not stream one."""
+    path = os.path.join(run_dir, TIMELINE_FILE)
+    if not os.path.exists(path):
+        return None
+    events: list[dict[str, Any]] = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A crash can leave a half-written last line
+                continue
+    return events
+
+
+_CURRENT_TRACE: ContextVar[Trace | None] = ContextVar("hivemind_trace", default=None)
+_CURRENT_SPAN: ContextVar[dict[str, Any] | None] = ContextVar("hivemind_span", default=None)
+# Catches events emitted outside any run (e.g. calling an agent directly)
+_DEFAULT_TRACE = Trace("default")
+
+
+def current_trace() -> Trace:
+    return _CURRENT_TRACE.get() or _DEFAULT_TRACE
+
+
+def start_trace(name: str = "run") -> Trace:
+    # Tasks created after this point inherit the trace; concurrent runs in other tasks keep their own.
+    trace = Trace(name)
+    _CURRENT_TRACE.set(trace)
+    _CURRENT_SPAN.set(None)
+    return trace
+
+
+def reset_timeline() -> None:
+    start_trace()
+
+
+def get_timeline() -> list[dict[str, Any]]:
+    return list(current_trace().events)
+
+
+def record(agent: str, event: str, detail: str = "") -> None:
+    current_trace().record(agent, event, detail)
+
+
+@contextmanager
+def span(agent: str, name: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+    trace = current_trace()
+    entry = trace.open_span(agent, name, attrs)
+    token = _CURRENT_SPAN.set(entry)
+    try:
+        yield entry
+    except BaseException as exc:
+        entry["status"] = "cancelled" if isinstance(exc, asyncio.CancelledError) else "error"
+        raise
+    finally:
+        entry["end_ns"] = trace.now_ns()
+        _CURRENT_SPAN.reset(token)